@@ -0,0 +1,98 @@
+import asyncio
+import json
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+
+class AsgiResponse(object):
+    """Response collected by AsgiTestClient, chunks holds the body messages as they were sent"""
+
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], chunks: List[bytes]):
+        self.status = status
+        self.headers = headers
+        self.chunks = chunks
+
+    @property
+    def body(self) -> bytes:
+        return b''.join(self.chunks)
+
+    def header(self, name: str, default: str = None) -> str:
+        name = name.lower().encode('latin-1')
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value.decode('latin-1')
+        return default
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class AsgiTestClient(object):
+    """
+    Calls an ASGI application in process, without a server or a socket. The request body is delivered in messages of
+    at most body_chunk_size bytes. Used as an async context manager it runs the lifespan startup and shutdown events.
+    """
+
+    def __init__(self, app: Callable, body_chunk_size: int = 64 * 1024):
+        self.app = app
+        self.body_chunk_size = body_chunk_size
+        self._lifespan_queue: asyncio.Queue = None
+        self._lifespan_sent: asyncio.Queue = None
+        self._lifespan_task: asyncio.Task = None
+
+    async def request(self, method: str, path: str = '/', body: bytes = b'',
+                      headers: Iterable[Tuple[str, str]] = ()) -> AsgiResponse:
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'path': path,
+                 'raw_path': path.encode('latin-1'), 'query_string': b'', 'scheme': 'http',
+                 'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers]}
+
+        size = self.body_chunk_size
+        messages = [{'type': 'http.request', 'body': body[start:start + size], 'more_body': start + size < len(body)}
+                    for start in range(0, max(len(body), 1), size)]
+
+        async def receive() -> Dict:
+            if messages:
+                return messages.pop(0)
+            # the request is fully read, block like a client keeping the connection open
+            await asyncio.Event().wait()
+
+        response = AsgiResponse(None, [], [])
+
+        async def send(message: Dict):
+            if message['type'] == 'http.response.start':
+                assert response.status is None, 'response started twice'
+                response.status = message['status']
+                response.headers = list(message.get('headers', []))
+            elif message['type'] == 'http.response.body':
+                assert response.status is not None, 'body sent before the response started'
+                if message.get('body'):
+                    response.chunks.append(bytes(message['body']))
+
+        await self.app(scope, receive, send)
+        return response
+
+    async def post_json(self, path: str = '/', data: Any = None) -> AsgiResponse:
+        return await self.request('POST', path, json.dumps(data).encode('utf-8'),
+                                  [('content-type', 'application/json')])
+
+    def post(self, path: str = '/', data: Any = None) -> AsgiResponse:
+        """Synchronous post_json, runs its own event loop"""
+        return asyncio.run(self.post_json(path, data))
+
+    # lifespan
+
+    async def _lifespan_event(self, event: str):
+        await self._lifespan_queue.put({'type': 'lifespan.%s' % event})
+        message = await self._lifespan_sent.get()
+        if message['type'] != 'lifespan.%s.complete' % event:
+            raise RuntimeError('lifespan %s failed: %s' % (event, message.get('message')))
+
+    async def __aenter__(self) -> 'AsgiTestClient':
+        self._lifespan_queue, self._lifespan_sent = asyncio.Queue(), asyncio.Queue()
+        scope = {'type': 'lifespan', 'asgi': {'version': '3.0'}}
+        self._lifespan_task = asyncio.ensure_future(self.app(scope, self._lifespan_queue.get, self._lifespan_sent.put))
+        await self._lifespan_event('startup')
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._lifespan_event('shutdown')
+        await self._lifespan_task
@@ -1,6 +1,7 @@
 from typing import List
 
 from DialogFlowPy.Button import Button
+from DialogFlowPy.CompactComponents import CompactButton
 from DialogFlowPy.Image import Image
 from DialogFlowPy.OpenUriAction import OpenUriAction
 
@@ -30,7 +31,7 @@ class BasicCard(dict):
         self['buttons'] = []
 
         for item in buttons:
-            assert isinstance(item, Button)
+            assert isinstance(item, (Button, CompactButton))
             self['buttons'].append(item)
 
         if title is not None:
@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import importlib
+import inspect
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, List, Tuple, Union
+
+from DialogFlowPy.DialogFlow import DialogFlow
+from DialogFlowPy.ProcessOffload import InlineRunner, set_process_runner
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+BatchStats = namedtuple('BatchStats', ('requests', 'errors', 'seconds'))
+
+Handler = Union[str, Callable[[DialogFlow], Any]]
+
+DEFAULT_CHUNK_SIZE = 256
+
+
+def _loads(line: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def resolve_handler(handler: Handler) -> Callable[[DialogFlow], Any]:
+    """Imports a 'package.module:name' handler, callables are returned as they are"""
+    if callable(handler):
+        return handler
+
+    module_name, separator, attribute = handler.partition(':')
+    assert separator and attribute, 'handler must look like package.module:name, got %s' % handler
+    resolved = importlib.import_module(module_name)
+    for name in attribute.split('.'):
+        resolved = getattr(resolved, name)
+    assert callable(resolved), '%s is not callable' % handler
+    return resolved
+
+
+def iter_lines(stream: BinaryIO) -> Iterator[bytes]:
+    """Yields the non empty lines of newline delimited json, one at a time"""
+    for line in stream:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def _chunks(lines: Iterable[bytes], chunk_size: int) -> Iterator[List[bytes]]:
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# worker state, set once per process
+_handlers = {}
+_loop: asyncio.AbstractEventLoop = None
+
+
+def _init_worker():
+    # process bound handlers already run in a worker, they must not start a pool of their own
+    set_process_runner(InlineRunner())
+
+
+def _respond(handler: Callable[[DialogFlow], Any], line: bytes, version: str, create_payload_object: bool) -> bytes:
+    global _loop
+    dialog_flow = DialogFlow(_loads(line), version=version, create_payload_object=create_payload_object)
+    result = handler(dialog_flow)
+    if inspect.isawaitable(result):
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+        result = _loop.run_until_complete(result)
+    if isinstance(result, DialogFlow):
+        dialog_flow = result
+    return dialog_flow.to_json_bytes()
+
+
+def process_chunk(handler: Handler, lines: List[bytes], version: str = 'v1',
+                  create_payload_object: bool = False) -> Tuple[List[bytes], int]:
+    """
+    Returns one encoded response per request line, in the same order, and how many requests failed. A request that
+    fails gives an {"error": ...} object instead, so the output stays aligned with the input.
+    """
+    resolved = _handlers.get(handler) if isinstance(handler, str) else handler
+    if resolved is None:
+        resolved = _handlers[handler] = resolve_handler(handler)
+
+    responses, errors = [], 0
+    for line in lines:
+        try:
+            responses.append(_respond(resolved, line, version, create_payload_object))
+        except Exception as e:
+            logger.debug('request failed: %s', line, exc_info=True)
+            responses.append(json.dumps({'error': '%s: %s' % (type(e).__name__, e)}).encode('utf-8'))
+            errors += 1
+    return responses, errors
+
+
+def run_batch(handler: Handler, lines: Iterable[bytes], write: Callable[[bytes], Any], workers: int = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE, window: int = None, version: str = 'v1',
+              create_payload_object: bool = False) -> BatchStats:
+    """
+    Runs every request line through the handler and writes one response line per request, in input order.
+
+    Lines are sent to a pool of worker processes in chunks of chunk_size. At most window chunks (twice the workers
+    by default) are in flight, reading stops until the oldest one is written, so memory stays bounded however long
+    the input is. The handler is a module level callable or a 'package.module:name' string, imported once per
+    worker. workers=0 runs everything in this process.
+    """
+    assert chunk_size > 0
+    start = time.perf_counter()
+    requests = errors = 0
+
+    def emit(result: Tuple[List[bytes], int]):
+        nonlocal requests, errors
+        responses, chunk_errors = result
+        for response in responses:
+            write(response + b'\n')
+        requests += len(responses)
+        errors += chunk_errors
+
+    if workers == 0:
+        for chunk in _chunks(lines, chunk_size):
+            emit(process_chunk(handler, chunk, version, create_payload_object))
+        return BatchStats(requests, errors, time.perf_counter() - start)
+
+    workers = workers or os.cpu_count() or 1
+    window = window or 2 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        in_flight: deque = deque()
+        for chunk in _chunks(lines, chunk_size):
+            if len(in_flight) >= window:
+                emit(in_flight.popleft().result())
+            in_flight.append(executor.submit(process_chunk, handler, chunk, version, create_payload_object))
+        while in_flight:
+            emit(in_flight.popleft().result())
+
+    return BatchStats(requests, errors, time.perf_counter() - start)
+
+
+def process_file(handler: Handler, input_path: str, output_path: str, **kwargs) -> BatchStats:
+    """run_batch over newline delimited json files, '-' is stdin or stdout"""
+    input_file = sys.stdin.buffer if input_path == '-' else open(input_path, 'rb')
+    output_file = sys.stdout.buffer if output_path == '-' else open(output_path, 'wb')
+    try:
+        return run_batch(handler, iter_lines(input_file), output_file.write, **kwargs)
+    finally:
+        if input_file is not sys.stdin.buffer:
+            input_file.close()
+        if output_file is not sys.stdout.buffer:
+            output_file.close()
+        else:
+            output_file.flush()
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m DialogFlowPy.Batch',
+                                     description='Runs recorded webhook requests, one json object per line, through '
+                                                 'a handler and writes the responses in the same order.')
+    parser.add_argument('handler', help='package.module:name of the handler')
+    parser.add_argument('input', help="newline delimited requests, '-' for stdin")
+    parser.add_argument('output', help="file the responses are written to, '-' for stdout")
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, 0 runs in process '
+                                                                   '(default: one per cpu)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='requests sent to a worker at once')
+    parser.add_argument('--window', type=int, default=None, help='chunks in flight (default: twice the workers)')
+    parser.add_argument('--version', default='v1', help='Dialogflow api version of the requests')
+    parser.add_argument('--payload-object', action='store_true', help='create the google payload object')
+    arguments = parser.parse_args(argv)
+
+    stats = process_file(arguments.handler, arguments.input, arguments.output, workers=arguments.workers,
+                         chunk_size=arguments.chunk_size, window=arguments.window, version=arguments.version,
+                         create_payload_object=arguments.payload_object)
+    print('%d requests, %d errors in %.1f s (%.0f requests/s)' % (
+        stats.requests, stats.errors, stats.seconds, stats.requests / stats.seconds if stats.seconds else 0),
+        file=sys.stderr)
+    return 1 if stats.errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
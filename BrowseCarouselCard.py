@@ -1,6 +1,7 @@
 from typing import List
 from DialogFlowPy import ImageDisplayOptions
 from DialogFlowPy.BrowseCarouselCardItem import BrowseCarouselCardItem
+from DialogFlowPy.CompactComponents import CompactBrowseCarouselCardItem
 from DialogFlowPy.Image import Image
 from DialogFlowPy.OpenUrlAction import OpenUrlAction
 
@@ -46,7 +47,7 @@ class BrowseCarouselCard(dict):
 
     def add_browse_carousel_card_items(self, browse_carousel_card_items: List[BrowseCarouselCardItem]):
         for item in browse_carousel_card_items:
-            assert isinstance(item, BrowseCarouselCardItem)
+            assert isinstance(item, (BrowseCarouselCardItem, CompactBrowseCarouselCardItem))
             self.browse_carouse_card_items.append(item)
 
         return self.browse_carouse_card_items
@@ -1,5 +1,6 @@
 from typing import List
 from DialogFlowPy.Button import Button
+from DialogFlowPy.CompactComponents import CompactButton
 from DialogFlowPy.OpenUriAction import OpenUriAction
 
 
@@ -23,8 +24,7 @@ class Card(dict):
         self['buttons'] = []
 
         for item in buttons:
-            print(type(item))
-            assert isinstance(item, Button)
+            assert isinstance(item, (Button, CompactButton))
             self['buttons'].append(item)
 
         if title is not None:
@@ -1,6 +1,7 @@
 from typing import List
 
 from DialogFlowPy.CarouselItem import CarouselItem
+from DialogFlowPy.CompactComponents import CompactCarouselItem
 from DialogFlowPy.Image import Image
 from DialogFlowPy.SelectOptionInfo import SelectOptionInfo
 
@@ -21,7 +22,7 @@ class CarouselSelect(dict):
 
         self['items'] = []
         for item in carousel_items:
-            assert isinstance(item, CarouselItem)
+            assert isinstance(item, (CarouselItem, CompactCarouselItem))
             self['items'].append(item)
 
     @property
@@ -34,7 +35,7 @@ class CarouselSelect(dict):
 
     def add_carousel_items(self, carousel_items: CarouselItem) -> List[CarouselItem]:
         for item in carousel_items:
-            assert isinstance(item, CarouselItem)
+            assert isinstance(item, (CarouselItem, CompactCarouselItem))
             self.carousel_items.append(item)
         return self.carousel_items
 
@@ -0,0 +1,244 @@
+import asyncio
+import http.client
+import json
+import logging
+import re
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Tuple
+
+from DialogFlowPy.Instrumentation import span
+from DialogFlowPy.SingleFlight import SingleFlight
+
+GOOGLE_CERTS_HOST = 'www.googleapis.com'
+GOOGLE_CERTS_PATH = '/oauth2/v1/certs'
+
+_MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+logger = logging.getLogger(__name__)
+
+
+def parse_max_age(cache_control: str, default: int = 0) -> int:
+    """Returns the max-age in seconds of a Cache-Control header value, or default if it has none"""
+    match = _MAX_AGE_PATTERN.search(cache_control or '')
+    if match is None:
+        return default
+    return int(match.group(1))
+
+
+def _parse_certs_response(status: int, reason: str, cache_control: str, age: str,
+                          body: bytes) -> Tuple[Dict[str, str], int]:
+    if status != 200:
+        raise ConnectionError('fetching certificates failed: %s %s' % (status, reason))
+
+    max_age = parse_max_age(cache_control)
+    return json.loads(body.decode('utf-8')), max(max_age - int(age or 0), 0)
+
+
+def fetch_google_certs(host: str = GOOGLE_CERTS_HOST, path: str = GOOGLE_CERTS_PATH,
+                       timeout: float = 10) -> Tuple[Dict[str, str], int]:
+    """Downloads Google's signing certificates, returns the certs and how many seconds they may be cached"""
+    conn = http.client.HTTPSConnection(host, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return _parse_certs_response(response.status, response.reason, response.getheader('Cache-Control'),
+                                     response.getheader('Age'), response.read())
+    finally:
+        conn.close()
+
+
+async def fetch_google_certs_async(host: str = GOOGLE_CERTS_HOST, path: str = GOOGLE_CERTS_PATH,
+                                   timeout: float = 10) -> Tuple[Dict[str, str], int]:
+    """Same as fetch_google_certs, using non-blocking asyncio streams"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, 443, ssl=True), timeout)
+    try:
+        # HTTP/1.0 keeps the response free of chunked transfer encoding, the body simply runs until EOF
+        writer.write(('GET %s HTTP/1.0\r\nHost: %s\r\nAccept: application/json\r\n\r\n' % (path, host)).encode('ascii'))
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('iso-8859-1').split('\r\n')
+    _, status, reason = (status_line.split(' ', 2) + [''])[:3]
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    return _parse_certs_response(int(status), reason, headers.get('cache-control'), headers.get('age'), body)
+
+
+class CertificateStore(object):
+    """
+    Process wide cache of the certificates used to verify Google idTokens.
+
+    Certificates are kept for as long as the Cache-Control max-age of the response allows. Within refresh_ahead
+    seconds of expiry the cached certificates are still served while a background thread re-fetches them
+    (stale-while-revalidate). A token signed with an unknown kid triggers a single re-fetch, at most once every
+    min_refetch_interval seconds, to pick up rotated keys.
+
+    fetcher is any callable returning (certs, max_age), tests can pass a local stand-in. get_certs_async uses
+    async_fetcher, a coroutine function returning the same, or runs fetcher in the default executor when there is none.
+    """
+
+    def __init__(self, fetcher: Callable[[], Tuple[Dict[str, str], int]] = fetch_google_certs,
+                 refresh_ahead: float = 300, default_max_age: float = 300, min_refetch_interval: float = 30,
+                 clock: Callable[[], float] = time.monotonic,
+                 async_fetcher: Callable[[], Awaitable[Tuple[Dict[str, str], int]]] = None):
+        if async_fetcher is None and fetcher is fetch_google_certs:
+            async_fetcher = fetch_google_certs_async
+
+        self._fetcher = fetcher
+        self._async_fetcher = async_fetcher
+        self._refresh_ahead = refresh_ahead
+        self._default_max_age = default_max_age
+        self._min_refetch_interval = min_refetch_interval
+        self._clock = clock
+
+        self._certs: Dict[str, str] = {}
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._async_fetches = SingleFlight()
+
+    @property
+    def certs(self) -> Dict[str, str]:
+        return self._certs
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def get_certs(self, kid: str = None) -> Dict[str, str]:
+        """Returns the current certificates, fetching them only when missing, expired or kid is unknown"""
+        now = self._clock()
+        certs = self._certs
+
+        if not certs or now >= self._expires_at:
+            certs = self._refresh(force=False)
+        elif now >= self._refresh_at:
+            self._refresh_in_background()
+
+        if kid is not None and kid not in certs:
+            certs = self._refresh(force=True)
+
+        return certs
+
+    async def get_certs_async(self, kid: str = None) -> Dict[str, str]:
+        """
+        Same as get_certs without blocking the event loop, concurrent callers share a single in-flight fetch
+        """
+        now = self._clock()
+        certs = self._certs
+
+        if not certs or now >= self._expires_at:
+            certs = await self._refresh_async(force=False)
+        elif now >= self._refresh_at:
+            self._refresh_in_background()
+
+        if kid is not None and kid not in certs:
+            certs = await self._refresh_async(force=True)
+
+        return certs
+
+    def refresh(self) -> Dict[str, str]:
+        """Fetches the certificates right away regardless of their age"""
+        with self._lock:
+            return self._store(*self._fetch())
+
+    def clear(self):
+        with self._lock:
+            self._certs = {}
+            self._fetched_at = 0.0
+            self._expires_at = 0.0
+            self._refresh_at = 0.0
+
+    def _store(self, certs: Dict[str, str], max_age: int) -> Dict[str, str]:
+        now = self._clock()
+        self._certs = certs
+        self._fetched_at = now
+        ttl = max_age or self._default_max_age
+        self._expires_at = now + ttl
+        # never start revalidating before half of the lifetime has passed
+        self._refresh_at = now + max(ttl - self._refresh_ahead, ttl / 2)
+        return certs
+
+    def _refresh(self, force: bool) -> Dict[str, str]:
+        with self._lock:
+            # another thread may have refreshed while we were waiting for the lock
+            now = self._clock()
+            if force:
+                if now - self._fetched_at < self._min_refetch_interval:
+                    return self._certs
+            elif self._certs and now < self._expires_at:
+                return self._certs
+
+            return self._store(*self._fetch())
+
+    def _fetch(self) -> Tuple[Dict[str, str], int]:
+        with span('certificates.fetch'):
+            return self._fetcher()
+
+    async def _refresh_async(self, force: bool) -> Dict[str, str]:
+        now = self._clock()
+        if force:
+            if now - self._fetched_at < self._min_refetch_interval:
+                return self._certs
+        elif self._certs and now < self._expires_at:
+            return self._certs
+
+        return await self._async_fetches.do('certs', self._fetch_async)
+
+    async def _fetch_async(self) -> Dict[str, str]:
+        with span('certificates.fetch'):
+            if self._async_fetcher is not None:
+                certs, max_age = await self._async_fetcher()
+            else:
+                certs, max_age = await asyncio.get_running_loop().run_in_executor(None, self._fetcher)
+
+        with self._lock:
+            return self._store(certs, max_age)
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        thread = threading.Thread(target=self._background_refresh, name='CertificateStoreRefresh', daemon=True)
+        thread.start()
+
+    def _background_refresh(self):
+        try:
+            certs, max_age = self._fetch()
+            with self._lock:
+                self._store(certs, max_age)
+        except Exception:
+            # keep serving the cached certificates, the next request after expiry fetches them synchronously
+            logger.warning('background certificate refresh failed', exc_info=True)
+        finally:
+            self._refreshing = False
+
+
+_certificate_store: CertificateStore = None
+
+
+def get_certificate_store() -> CertificateStore:
+    """Returns the certificate store shared by every DialogFlow in this process"""
+    global _certificate_store
+    if _certificate_store is None:
+        _certificate_store = CertificateStore()
+    return _certificate_store
+
+
+def set_certificate_store(certificate_store: CertificateStore) -> CertificateStore:
+    """Replaces the shared certificate store, e.g. with one using a local fetcher in tests"""
+    global _certificate_store
+    assert certificate_store is None or isinstance(certificate_store, CertificateStore)
+    _certificate_store = certificate_store
+    return certificate_store
@@ -0,0 +1,110 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from DialogFlowPy.Metrics import CACHE_LOOKUPS
+
+_HITS = CACHE_LOOKUPS.labels('claims', 'hit')
+_MISSES = CACHE_LOOKUPS.labels('claims', 'miss')
+
+
+class ClaimsCache(object):
+    """
+    Bounded LRU cache of the claims of already verified idTokens.
+
+    Entries are keyed by a sha256 of the audience and the token, so raw tokens are never kept in memory, and live
+    until the token's own exp. A hit skips the signature verification entirely.
+    """
+
+    def __init__(self, max_entries: int = 1024, clock: Callable[[], float] = time.time):
+        assert isinstance(max_entries, int) and max_entries > 0
+
+        self._max_entries = max_entries
+        self._clock = clock
+        self._entries: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(encoded_token: str, audience: str = None) -> str:
+        return hashlib.sha256(('%s\0%s' % (audience or '', encoded_token)).encode('utf-8')).hexdigest()
+
+    def get(self, encoded_token: str, audience: str = None) -> Optional[dict]:
+        key = self.key(encoded_token, audience)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if self._clock() < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    _HITS.inc()
+                    return claims
+
+                del self._entries[key]
+
+            self.misses += 1
+            _MISSES.inc()
+            return None
+
+    def put(self, encoded_token: str, claims: dict, audience: str = None) -> dict:
+        expires_at = claims.get('exp')
+        if expires_at is None:
+            # without an expiry there is nothing that bounds how long the claims stay valid
+            return claims
+
+        key = self.key(encoded_token, audience)
+        with self._lock:
+            self._entries[key] = (claims, float(expires_at))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'size': len(self._entries),
+            'max_entries': self._max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hit_ratio
+        }
+
+
+_claims_cache: ClaimsCache = None
+
+
+def get_claims_cache() -> ClaimsCache:
+    """Returns the claims cache shared by every DialogFlow in this process"""
+    global _claims_cache
+    if _claims_cache is None:
+        _claims_cache = ClaimsCache()
+    return _claims_cache
+
+
+def set_claims_cache(claims_cache: ClaimsCache) -> ClaimsCache:
+    global _claims_cache
+    assert claims_cache is None or isinstance(claims_cache, ClaimsCache)
+    _claims_cache = claims_cache
+    return claims_cache
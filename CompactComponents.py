@@ -0,0 +1,189 @@
+from typing import FrozenSet, List, Tuple
+
+from DialogFlowPy import UrlTypeHint
+from DialogFlowPy.Image import Image
+from DialogFlowPy.OpenUriAction import OpenUriAction
+from DialogFlowPy.OpenUrlAction import OpenUrlAction
+from DialogFlowPy.SelectOptionInfo import SelectOptionInfo
+
+
+def _attributes(fields: Tuple[Tuple[str, str], ...]) -> Tuple[str, ...]:
+    return tuple(attribute for attribute, _ in fields)
+
+
+class CompactComponent(object):
+    """
+    __slots__ record standing in for one of the dict based components. Fields are plain attributes, named like the
+    properties of the dict component, and the wire mapping is only built by to_dict() when the response is encoded.
+    Fields left as None are not written, except the ones the dict component always writes.
+    """
+
+    __slots__ = ()
+
+    # (attribute, json key) pairs, in the order they are written
+    _fields: Tuple[Tuple[str, str], ...] = ()
+    # attributes written even when None, like the dict component does
+    _always_written: FrozenSet[str] = frozenset()
+
+    def to_dict(self) -> dict:
+        wire = {}
+        always_written = self._always_written
+        for attribute, key in self._fields:
+            value = getattr(self, attribute)
+            if value is not None or attribute in always_written:
+                wire[key] = value
+        return wire
+
+    def __eq__(self, other):
+        if isinstance(other, CompactComponent):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_dict())
+
+
+class CompactImage(CompactComponent):
+    _fields = (('image_uri', 'imageUri'), ('accessibility_text', 'accessibilityText'))
+    __slots__ = _attributes(_fields)
+
+    def __init__(self, image_uri: str = '', accessibility_text: str = ''):
+        self.image_uri = image_uri
+        self.accessibility_text = accessibility_text
+
+
+class CompactButton(CompactComponent):
+    _fields = (('title', 'title'), ('open_uri_action', 'openUriAction'))
+    __slots__ = _attributes(_fields)
+
+    def __init__(self, title: str = '', open_uri_action: OpenUriAction = None):
+        self.title = title
+        self.open_uri_action = open_uri_action
+
+    def add_open_uri_action(self, uri: str = '') -> OpenUriAction:
+        self.open_uri_action = OpenUriAction(uri=uri)
+        return self.open_uri_action
+
+
+class _ImageMixin(object):
+    __slots__ = ()
+
+    def add_image(self, image_uri: str, accessibility_text: str = '') -> CompactImage:
+        self.image = CompactImage(image_uri=image_uri, accessibility_text=accessibility_text)
+        return self.image
+
+
+class _ButtonsMixin(object):
+    __slots__ = ()
+
+    def add_button(self, title: str, uri: str) -> CompactButton:
+        button = CompactButton(title=title, open_uri_action=OpenUriAction(uri=uri))
+        self.buttons.append(button)
+        return button
+
+
+class CompactCard(_ButtonsMixin, CompactComponent):
+    _fields = (('buttons', 'buttons'), ('title', 'title'), ('image_uri', 'imageUri'), ('subtitle', 'subtitle'))
+    _always_written = frozenset(('buttons',))
+    __slots__ = _attributes(_fields)
+
+    def __init__(self, title: str = '', image_uri: str = '', subtitle: str = '', buttons: List = None):
+        self.title = title
+        self.subtitle = subtitle
+        self.image_uri = image_uri
+        self.buttons = list(buttons) if buttons else []
+
+
+class CompactBasicCard(_ImageMixin, _ButtonsMixin, CompactComponent):
+    _fields = (('buttons', 'buttons'), ('title', 'title'), ('formatted_text', 'formattedText'),
+               ('subtitle', 'subtitle'), ('image', 'image'))
+    _always_written = frozenset(('buttons',))
+    __slots__ = _attributes(_fields)
+
+    def __init__(self, title: str = '', formatted_text: str = '', subtitle: str = '', image: Image = None,
+                 buttons: List = None):
+        self.title = title
+        self.subtitle = subtitle
+        self.formatted_text = formatted_text
+        self.image = image
+        self.buttons = list(buttons) if buttons else []
+
+
+class CompactListItem(_ImageMixin, CompactComponent):
+    _fields = (('option_info', 'info'), ('image', 'image'), ('title', 'title'), ('description', 'description'))
+    _always_written = frozenset(_attributes(_fields))
+    __slots__ = _attributes(_fields)
+
+    def __init__(self, title: str, description: str, image: Image, option_info: SelectOptionInfo):
+        self.option_info = option_info
+        self.title = title
+        self.description = description
+        self.image = image
+
+
+class CompactCarouselItem(_ImageMixin, CompactComponent):
+    _fields = (('select_option_info', 'info'), ('image', 'image'), ('title', 'title'),
+               ('description', 'description'))
+    __slots__ = _attributes(_fields)
+
+    def __init__(self, title: str, description: str, image: Image = None, option_info: SelectOptionInfo = None):
+        self.select_option_info = option_info
+        self.title = title
+        self.description = description
+        self.image = image
+
+    def add_option_info(self, key: str, synonyms: List[str]) -> SelectOptionInfo:
+        self.select_option_info = SelectOptionInfo(key=key, synonyms=synonyms)
+        return self.select_option_info
+
+
+class CompactBrowseCarouselCardItem(_ImageMixin, CompactComponent):
+    _fields = (('open_uri_action', 'openUriAction'), ('footer', 'footer'), ('image', 'image'), ('title', 'title'),
+               ('description', 'description'))
+    _always_written = frozenset(_attributes(_fields))
+    __slots__ = _attributes(_fields)
+
+    def __init__(self, open_uri_action: OpenUrlAction, title: str, description: str, image: Image, footer: str):
+        self.open_uri_action = open_uri_action
+        self.title = title
+        self.description = description
+        self.image = image
+        self.footer = footer
+
+    def add_open_uri_action(self, url: str, url_type_hint: UrlTypeHint) -> OpenUrlAction:
+        self.open_uri_action = OpenUrlAction(url=url, url_type_hint=url_type_hint)
+        return self.open_uri_action
+
+
+class CompactTableCardCell(CompactComponent):
+    _fields = (('text', 'text'),)
+    _always_written = frozenset(_attributes(_fields))
+    __slots__ = _attributes(_fields)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class CompactTableCardRow(CompactComponent):
+    _fields = (('divider_after', 'dividerAfter'), ('table_card_cells', 'cells'))
+    _always_written = frozenset(_attributes(_fields))
+    __slots__ = _attributes(_fields)
+
+    def __init__(self, divider_after: bool = False, table_card_cells: List = None):
+        self.divider_after = divider_after
+        self.table_card_cells = list(table_card_cells) if table_card_cells else []
+
+    def add_cells(self, cells: List) -> List:
+        for item in cells:
+            assert isinstance(item, (CompactTableCardCell, dict))
+            self.table_card_cells.append(item)
+        return self.table_card_cells
+
+    def add_cell(self, text: str) -> CompactTableCardCell:
+        cell = CompactTableCardCell(text=text)
+        self.table_card_cells.append(cell)
+        return cell
@@ -31,3 +31,15 @@ class Context(dict):
     @name.setter
     def name(self, value):
         self['name'] = value
+
+    @property
+    def lifespan_count(self) -> int:
+        return self['lifespanCount']
+
+    @lifespan_count.setter
+    def lifespan_count(self, value: int):
+        self['lifespanCount'] = value
+
+    @property
+    def parameters(self) -> dict:
+        return self['parameters']
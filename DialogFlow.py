@@ -1,6 +1,8 @@
-import json
-from ast import literal_eval
-from typing import List, Union
+import asyncio
+import functools
+import logging
+from concurrent.futures import Executor
+from typing import AsyncIterator, Iterator, List, Mapping, Union
 from .Entity import Entity
 from . import PlatformEnum, ImageDisplayOptions, ResponseMediaType
 from .BasicCard import BasicCard
@@ -8,32 +10,62 @@ from .BrowseCarouselCard import BrowseCarouselCard
 from .BrowseCarouselCardItem import BrowseCarouselCardItem
 from .Button import Button
 from .Card import Card
+from .CertificateStore import get_certificate_store
+from .ClaimsCache import get_claims_cache
 from .CarouselItem import CarouselItem
 from .CarouselSelect import CarouselSelect
 from .ColumnProperties import ColumnProperties
 from .Context import Context
 from .EventInput import EventInput
+from .FulfillmentMessages import FulfillmentMessages
 from .GooglePayload import GooglePayload
 from .Image import Image
+from .Instrumentation import span, traced
+from .JsonEncoder import JsonEncoder, MemoizingJsonEncoder, get_json_encoder
+from .JsonStream import DEFAULT_CHUNK_SIZE, aiter_json, iter_json
+from .IncomingContexts import IncomingContexts
 from .LinkOutSuggestion import LinkOutSuggestion
 from .ListItem import ListItem
 from .ListSelect import ListSelect
 from .MediaContent import MediaContent
 from .MediaObject import MediaObject
 from .Message import Message
+from .OutputContexts import OutputContexts
 from .Payload import Payload
+from .PayloadSampler import get_payload_sampler
 from .QuickReplies import QuickReplies
+from .ResponseBudget import BudgetReport, ResponseBudget, ResponseLimits
 from .SimpleResponse import SimpleResponse
 from .SimpleResponses import SimpleResponses
+from .SingleFlight import SingleFlight
 from .Suggestion import Suggestion
 from .Suggestions import Suggestions
 from .TableCard import TableCard
 from .TableCardRow import TableCardRow
 from .Text import Text
+from .UserStorage import UserStorage
+from .WebhookRequest import WebhookRequest
 from GoogleActions import ImageDisplayOptions as GoogleImageDisplayOptions
 from google.auth import jwt
+from .SessionStore import SessionState, get_session_store
 from .SessionEntityType import SessionEntityType, EntityOverrideMode
 
+logger = logging.getLogger(__name__)
+
+_token_verifications = SingleFlight()
+
+# actions Dialogflow names differently from what handlers are written against
+_ACTION_ALIASES = {'input.welcome': 'welcome'}
+
+
+def normalize_action(action: str) -> str:
+    """Action name as DialogFlow.action returns it, 'input.welcome' becomes 'welcome'"""
+    return _ACTION_ALIASES.get(action, action)
+
+
+class InvalidIdToken(PermissionError, ValueError):
+    """The user's idToken is malformed, expired or not signed by Google, still a ValueError as jwt.decode raises"""
+
 
 class DialogFlow(dict):
     """
@@ -177,24 +209,20 @@ class DialogFlow(dict):
                  client_key: str = None):
         super().__init__()
 
-        self._source = ''
-        self._session_id = ''
-        self._result = {}
-        self._parameters = {}
-        self._action = ''
+        self._request: WebhookRequest = None
+        self._client_key = client_key
+        self._user_claims = None
 
         self.create_payload_object = create_payload_object
         self._max_msg_length = 550
-        self['fulfillmentMessages']: List[Message] = list()
+        self._budget: ResponseBudget = None
+        self._session_state: SessionState = None
+        self.budget_report: BudgetReport = None
+        self['fulfillmentMessages']: FulfillmentMessages = FulfillmentMessages()
         self['source'] = None
         self['followupEventInput'] = None
         self['fulfillmentText'] = ''
         self['session_entity_types'] = list()
-        self._user_given_name = ''
-        self._user_family_name = ''
-        self._user_email = ''
-        self._user_verification_status = ''
-        self._user_storage = dict()
 
         if self.create_payload_object:
             self['payload'] = Payload('google', GooglePayload())
@@ -202,104 +230,179 @@ class DialogFlow(dict):
         self.load_request_data(request_data_json=request_data_json, version=version, client_key=client_key)
 
     def load_request_data(self, request_data_json: dict, version: str = 'v1', client_key: str = None):
+        """
+        Wraps the request in a lazily parsed WebhookRequest, fields are only read out of the json when first used and
+        the idToken is only verified once user_given_name, user_family_name or user_email is read
+        """
 
-        print('initializing Dialogflow with: ', version, request_data_json)
+        logger.debug('initializing Dialogflow with: %s %s', version, request_data_json)
         assert isinstance(request_data_json, dict)
-        super(DialogFlow, self).__init__()
-
-        self._session_id = request_data_json.get('session')
-        print('session_id : ', self._session_id)
-
-        self._result = request_data_json.get('queryResult') or request_data_json.get('result')
-        print('result: ', self._result)
-
-        self._parameters = self._result.get('parameters')
-        print('parameters: ', self._parameters)
-
-        self._action = self._result.get('action')
-        if self._action == 'input.welcome':
-            self._action = 'welcome'
-        print('action: ', self._action)
-
-        self._source = None
-
-        if request_data_json.get('originalDetectIntentRequest') is not None:
-            self._source = request_data_json.get('originalDetectIntentRequest').get('source')
-
-        self['outputContexts']: List[Context] = []
-        # contexts = self._result.get('outputContexts') or self._result.get('contexts')
-        # for context in contexts:
-        #    self['outputContexts'].append(Context(context.get('name')))
-        print('outputContexts: ', self['outputContexts'])
-
-        if request_data_json.get('originalDetectIntentRequest'):
-            if request_data_json.get('originalDetectIntentRequest').get('payload'):
-                if request_data_json.get('originalDetectIntentRequest').get('payload').get('user'):
-
-                    self._user_verification_status = request_data_json.get('originalDetectIntentRequest').get(
-                        'payload').get('user').get('userVerificationStatus')
-
-                    self._user_storage = request_data_json.get('originalDetectIntentRequest').get(
-                        'payload').get('user').get('userStorage')
-
-                    if isinstance(self._user_storage, str):
-                        # converting user storage to string since its in
-                        self._user_storage = self._user_storage.replace('null', '""')
-                        self._user_storage = literal_eval(self._user_storage)
-
-                    if request_data_json.get('originalDetectIntentRequest').get('payload').get('user').get('idToken'):
-                        import http.client
-                        conn = http.client.HTTPSConnection("www.googleapis.com")
-                        conn.request("GET", "/oauth2/v1/certs")
-                        r1 = conn.getresponse()
-                        print(r1.status, r1.reason)
-                        certs = json.loads(r1.read().decode('utf-8'))  # This will return entire content.
-                        print(type(certs), certs)
-
-                        encoded_user_token = request_data_json.get('originalDetectIntentRequest').get('payload').get(
-                            'user').get('idToken')
-                        print('encoded_token: ', encoded_user_token)
-                        decoded_user_token = jwt.decode(encoded_user_token, certs=certs, verify=True,
-                                                        audience=client_key)
-                        print('decoded_token: ', decoded_user_token)
-                        self._user_given_name = decoded_user_token.get('given_name')
-                        self._user_family_name = decoded_user_token.get('family_name')
-                        self._user_email = decoded_user_token.get('email')
+        with span('dialogflow.load_request') as current:
+            super(DialogFlow, self).__init__()
+
+            self._request = WebhookRequest(request_data_json)
+            self._client_key = client_key
+            self._user_claims = None
+
+            self._sampled = get_payload_sampler().sample()
+            if self._sampled:
+                get_payload_sampler().dump('request', request_data_json)
+
+            self['outputContexts']: OutputContexts = OutputContexts()
+            if current:
+                current.set('action', self.action)
+
+    @staticmethod
+    def _verify_id_token(encoded_user_token: str, client_key: str = None) -> dict:
+        """
+        Verifies the idToken against Google's certificates, taken from the shared CertificateStore. Claims of tokens
+        seen on earlier turns come from the shared ClaimsCache without verifying the signature again.
+        """
+        claims_cache = get_claims_cache()
+        decoded_user_token = claims_cache.get(encoded_user_token, audience=client_key)
+        if decoded_user_token is not None:
+            return decoded_user_token
+
+        try:
+            kid = jwt.decode_header(encoded_user_token).get('kid')
+            certs = get_certificate_store().get_certs(kid=kid)
+            with span('jwt.verify'):
+                decoded_user_token = jwt.decode(encoded_user_token, certs=certs, verify=True, audience=client_key)
+        except ValueError as e:
+            raise InvalidIdToken(str(e)) from e
+        return claims_cache.put(encoded_user_token, decoded_user_token, audience=client_key)
+
+    @classmethod
+    async def from_request_async(cls, request_data_json: dict, version: str = 'v1',
+                                 create_payload_object: bool = False, client_key: str = None,
+                                 executor: Executor = None) -> 'DialogFlow':
+        """
+        Builds a DialogFlow without blocking the event loop. Certificates are fetched with non-blocking I/O and the
+        idToken signature is verified in executor (the loop's default one if None). Concurrent requests carrying the
+        same token share one verification, concurrent certificate fetches share one download.
+        """
+        dialog_flow = cls(request_data_json, version=version, create_payload_object=create_payload_object,
+                          client_key=client_key)
+
+        encoded_user_token = dialog_flow.request.user.id_token
+        if encoded_user_token:
+            dialog_flow._user_claims = await cls._verify_id_token_async(encoded_user_token, client_key=client_key,
+                                                                        executor=executor)
+        return dialog_flow
+
+    @staticmethod
+    async def _verify_id_token_async(encoded_user_token: str, client_key: str = None,
+                                     executor: Executor = None) -> dict:
+        claims_cache = get_claims_cache()
+        decoded_user_token = claims_cache.get(encoded_user_token, audience=client_key)
+        if decoded_user_token is not None:
+            return decoded_user_token
+
+        async def verify():
+            try:
+                kid = jwt.decode_header(encoded_user_token).get('kid')
+                certs = await get_certificate_store().get_certs_async(kid=kid)
+                with span('jwt.verify'):
+                    decoded = await asyncio.get_running_loop().run_in_executor(
+                        executor, functools.partial(jwt.decode, encoded_user_token, certs=certs, verify=True,
+                                                    audience=client_key))
+            except ValueError as e:
+                raise InvalidIdToken(str(e)) from e
+            return claims_cache.put(encoded_user_token, decoded, audience=client_key)
+
+        return await _token_verifications.do(claims_cache.key(encoded_user_token, client_key), verify)
+
+    @property
+    def request(self) -> WebhookRequest:
+        return self._request
+
+    @property
+    def user_claims(self) -> dict:
+        """Claims of the user's idToken, verified on first access"""
+        if self._user_claims is None:
+            encoded_user_token = self._request.user.id_token
+            self._user_claims = self._verify_id_token(encoded_user_token, client_key=self._client_key) \
+                if encoded_user_token else {}
+        return self._user_claims
 
     @property
     def user_given_name(self):
-        return self._user_given_name
+        return self.user_claims.get('given_name', '')
 
     @property
     def user_family_name(self):
-        return self._user_family_name
+        return self.user_claims.get('family_name', '')
 
     @property
     def user_email(self):
-        return self._user_email
+        return self.user_claims.get('email', '')
 
     @property
     def session_id(self):
-        return self._session_id
+        return self._request.session
 
     @property
     def action(self):
-        return self._action
+        action = self._request.query_result.action
+        return _ACTION_ALIASES.get(action, action)
 
     @property
-    def parameters(self):
-        return self._parameters
+    def parameters(self) -> Mapping:
+        return self._request.query_result.parameters
 
     def get_parameter(self, parameter_name: str):
-        return self._parameters.get(parameter_name)
+        return self._request.query_result.parameters.get(parameter_name)
 
     @property
-    def user_storage(self):
-        return self._user_storage
+    def user_storage(self) -> UserStorage:
+        """userStorage of the request, decoded on first access and writable through save_user_storage"""
+        return self._request.user.storage
+
+    def save_user_storage(self, compress: bool = None) -> bool:
+        """
+        Writes user_storage into the google payload when its content changed during this turn
+        :return: True if the payload's userStorage was written
+        """
+        if self.payload is None:
+            return False
+
+        encoded = self._request.user.storage.encode_if_changed(compress=compress)
+        if encoded is None:
+            return False
+
+        self.payload.payload.user_storage = encoded
+        return True
+
+    @property
+    def session_state(self) -> SessionState:
+        """State kept between turns in the shared session store, loaded on first access"""
+        if self._session_state is None:
+            session_id = self.session_id
+            self._session_state = SessionState(get_session_store().load(session_id) if session_id else None)
+        return self._session_state
+
+    def save_session_state(self) -> bool:
+        """
+        Writes session_state back to the session store when it changed during this turn, WebhookApp calls it once the
+        response is sent
+        :return: True if the state was written
+        """
+        if not self.session_state_changed:
+            return False
+
+        state = self._session_state
+        get_session_store().save(self.session_id, state.data, state.ttl)
+        return True
+
+    @property
+    def session_state_changed(self) -> bool:
+        """True when session_state was loaded and changed during this turn, in a request with a session"""
+        state = self._session_state
+        return state is not None and state.changed and bool(self.session_id)
 
     @property
     def user_verification_status(self):
-        return self._user_verification_status
+        return self._request.user.user_verification_status or ''
 
     # Source functions
     @property
@@ -317,45 +420,50 @@ class DialogFlow(dict):
 
     # Context functions
     @property
-    def contexts(self) -> List[Context]:
+    def contexts(self) -> OutputContexts:
         return self['outputContexts']
 
     @contexts.setter
-    def contexts(self, context_name: str, lifespan: int = 0, **parameters):
-        assert isinstance(context_name, str)
-        assert isinstance(lifespan, int)
+    def contexts(self, contexts: List[Context]):
+        self['outputContexts'] = OutputContexts(contexts)
+
+    @property
+    def incoming_contexts(self) -> IncomingContexts:
+        """Contexts sent with the request, indexed by short name"""
+        return self._request.contexts
 
-        for context in self['outputContexts']:
-            if context.name == context_name:
-                context.lifespan_count = lifespan
-                context.update_parameters(**parameters)
+    def has_context(self, context_name: str) -> bool:
+        return context_name in self._request.contexts
 
-    def add_context(self, context_name: str, lifespan: int = 0, **parameters) -> List[Context]:
+    def get_context_parameter(self, context_name: str, parameter_name: str, default=None):
+        return self._request.contexts.get_parameter(context_name, parameter_name, default)
+
+    def add_context(self, context_name: str, lifespan: int = 0, **parameters) -> OutputContexts:
         assert isinstance(context_name, str)
         assert isinstance(lifespan, int)
 
-        for context in self['outputContexts']:
-            if context.name == context_name:
-                context.update_parameters(**parameters)
-                context.lifespan = lifespan
-                return self['outputContexts']
-
-        self['outputContexts'].append(Context(name=context_name, lifespan_count=lifespan, **parameters))
-        print('context: ', self['outputContexts'])
+        self['outputContexts'].set_context(context_name, lifespan_count=lifespan, **parameters)
+        logger.debug('context: %s', self['outputContexts'])
         return self['outputContexts']
 
+    def set_contexts(self, contexts: List[Context]) -> OutputContexts:
+        """Adds every context to the response, replacing the ones with the same name"""
+        return self['outputContexts'].set_contexts(contexts)
+
+    def expire_contexts(self, context_names: List[str]) -> OutputContexts:
+        """Sends the contexts with a lifespan of 0 so Dialogflow removes them from the session"""
+        return self['outputContexts'].expire_contexts(context_names)
+
     def delete_context(self, context_names) -> bool:
 
         if len(context_names) == 0:
-            self['outputContexts'] = list()
+            self['outputContexts'].clear()
 
         else:
             for context_name in context_names:
                 assert isinstance(context_name, str)
 
-                for context in self['outputContexts']:
-                    if context.name == context_name:
-                        self['outputContexts'].remove(context)
+            self['outputContexts'].remove_contexts(context_names)
 
         return True
 
@@ -368,7 +476,7 @@ class DialogFlow(dict):
         self['session_entity_types'] = session_entity_types
 
     def add_session_entity(self, entity_name: str, entity_overide_mode: EntityOverrideMode, entities: List[Entity]):
-        self['session_entity_types'].append(SessionEntityType(name=self._session_id + '/entityTypes/' + entity_name,
+        self['session_entity_types'].append(SessionEntityType(name=self.session_id + '/entityTypes/' + entity_name,
                                                               entity_overide_mode=entity_overide_mode,
                                                               entities=entities))
 
@@ -382,7 +490,7 @@ class DialogFlow(dict):
 
     # Fulfillment_messages functions
     @property
-    def fulfillment_messages(self) -> List[Message]:
+    def fulfillment_messages(self) -> FulfillmentMessages:
         return self['fulfillmentMessages']
 
     @fulfillment_messages.setter
@@ -390,46 +498,100 @@ class DialogFlow(dict):
         for message in message_list:
             self.add_fulfillment_messages(message)
 
-    def add_fulfillment_messages(self, message: Message) -> List[Message]:
+    def add_fulfillment_messages(self, message: Message) -> FulfillmentMessages:
 
-        print('adding fulfillment_message: ', type(message), message)
+        logger.debug('adding fulfillment_message: %s %s', type(message), message)
         assert isinstance(message, Message)
+        if self._sampled:
+            get_payload_sampler().dump('fulfillment_message', message)
+
+        platform = message.platform
+        message_type = message.message_type
+        fulfillment_messages = self.fulfillment_messages
 
         # only add the message if its simple responses or if not then theres already a simple response in the
         # fulfillment messages
-        if self.has_fulfillment_message_type(message.platform,
-                                             'simple_responses') or message.message_type == 'simple_responses':
+        if message_type == 'simple_responses' or fulfillment_messages.has_message_type(platform, 'simple_responses'):
             # check if the same type of message object already exists in the list,if yes then modify it or add a new one
-            if self.has_fulfillment_message_type(message.platform,
-                                                 message.message_type) and message.message_type == 'payload':
-                self.get_fulfillment_message(message.platform, message.message_type).message_object = \
-                    message.message_object
+            payload_message = fulfillment_messages.get_message(platform, message_type) \
+                if message_type == 'payload' else None
+            if payload_message is not None:
+                payload_message.message_object = message.message_object
+                message = payload_message
             else:
-                self.fulfillment_messages.append(message)
+                fulfillment_messages.append(message)
+            if self._budget is not None:
+                self._budget.track(message)
 
-        return self['fulfillmentMessages']
+        return fulfillment_messages
+
+    def message_types(self) -> List[str]:
+        """The message_type of every fulfillment message, in order"""
+        return [message.message_type for message in self.fulfillment_messages]
 
     def delete_messages(self):
-        self['fulfillmentMessages'] = []
+        self['fulfillmentMessages'] = FulfillmentMessages()
         return self
 
     def has_fulfillment_message_type(self, platform, message_type) -> bool:
-        for message in self.fulfillment_messages:
-            if message_type == message.message_type and message.platform == platform:
-                return True
-
-        return False
+        return self.fulfillment_messages.has_message_type(platform, message_type)
 
     def get_fulfillment_message(self, platform, message_type):
-        print('looking for fulfillment message for', platform, message_type)
-        for message in self.fulfillment_messages:
-            print('in message ', message.message_type, message.platform)
-            if message_type == message.message_type and message.platform == platform:
-                print('found it: ', message)
-                return message
+        logger.debug('looking for fulfillment message for %s %s', platform, message_type)
+        message = self.fulfillment_messages.get_message(platform, message_type)
+        if message is not None:
+            return message
 
         return KeyError()
 
+    # Serialization functions
+    def to_json_bytes(self, encoder: JsonEncoder = None, memoize: bool = False) -> bytes:
+        """
+        Encodes the response, ready to be written to the socket, with the shared JsonEncoder unless given one.
+        memoize encodes subtrees shared between the messages and the payload only once. With a budget enabled the
+        response is first brought inside its limits, what changed is left in budget_report.
+        """
+        if memoize:
+            encoder = MemoizingJsonEncoder(encoder)
+        with span('dialogflow.encode') as current:
+            if self._budget is not None:
+                self.budget_report = self._budget.enforce(self, encoder)
+                data = self.budget_report.data
+            else:
+                data = (encoder or get_json_encoder()).encode(self)
+            if current:
+                current.set('action', self.action)
+                current.set('message_count', len(self.fulfillment_messages))
+                current.set('message_types', ','.join(self.message_types()))
+                current.set('bytes', len(data))
+        if self._sampled:
+            get_payload_sampler().dump('response', data)
+        return data
+
+    def iter_json(self, encoder: JsonEncoder = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Encodes the response in chunks of about chunk_size bytes, for responses too large to hold in memory at once.
+        Streamed responses are neither sampled nor budgeted.
+        """
+        return iter_json(self, encoder, chunk_size)
+
+    def aiter_json(self, encoder: JsonEncoder = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        return aiter_json(self, encoder, chunk_size)
+
+    def enable_budget(self, limits: ResponseLimits = None) -> ResponseBudget:
+        """
+        Keeps the response inside the Actions on Google limits from now on, texts are cut at _max_msg_length unless
+        other limits are given
+        """
+        self._budget = ResponseBudget(limits or ResponseLimits(max_text_length=self._max_msg_length))
+        for message in self.fulfillment_messages:
+            self._budget.track(message)
+        return self._budget
+
+    @property
+    def budget(self) -> ResponseBudget:
+        return self._budget
+
     # Payload functions
     @property
     def payload(self):
@@ -459,6 +621,7 @@ class DialogFlow(dict):
         self['fulfillmentText'] = display_text
 
     # Helper functions for Message
+    @traced('dialogflow.add_text_message', 'platform')
     def add_text_message(self, platform: PlatformEnum, text_to_speech: str, ssml: str = '', display_text: str = ''):
         self.fulfillment_text = display_text if display_text else text_to_speech
 
@@ -468,7 +631,7 @@ class DialogFlow(dict):
             simple_responses: SimpleResponses = SimpleResponses(
                 [SimpleResponse(text_to_speech=text_to_speech, ssml=ssml,
                                 display_text=display_text)])
-            print('simple_responses: ', simple_responses)
+            logger.debug('simple_responses: %s', simple_responses)
             self.add_fulfillment_messages(Message(platform=platform, message_object=simple_responses))
 
         if self.create_payload_object:
@@ -477,27 +640,23 @@ class DialogFlow(dict):
                 self.add_fulfillment_messages(Message(platform=platform,
                                                       message_object=self.payload))
             fulfillment_message = self.get_fulfillment_message(platform=platform, message_type='payload')
-            print('fulfillment_message: ', type(fulfillment_message), fulfillment_message)
             message_object = fulfillment_message.message_object
-            print('message_object: ', type(message_object), message_object)
             payload_object = message_object.payload
-            print('payload_object', type(payload_object), payload_object)
+            logger.debug('payload_object: %s %s', type(payload_object), payload_object)
             payload_object.add_simple_response(text_to_speech=text_to_speech, ssml=ssml, display_text=display_text)
 
         return self
 
+    @traced('dialogflow.add_image', 'platform')
     def add_image(self, platform: PlatformEnum, uri: str = '', accessibility_text: str = ''):
-        print('adding image: ', platform, uri, accessibility_text)
+        logger.debug('adding image: %s %s %s', platform, uri, accessibility_text)
         image = Image(image_uri=uri, accessibility_text=accessibility_text)
         self.add_fulfillment_messages(Message(platform=platform, message_object=image))
         return self
 
+    @traced('dialogflow.add_quick_replies', 'platform')
     def add_quick_replies(self, platform: PlatformEnum, title: str, quick_replies):
-        print('adding quick_replies: ', platform, title, quick_replies)
-        print('adding quick replies')
-        print('platform:', platform)
-        print('title:', title)
-        print('quick_replies: ', quick_replies)
+        logger.debug('adding quick_replies: %s %s %s', platform, title, quick_replies)
         quick_reply: QuickReplies = QuickReplies(title, quick_replies)
         self.add_fulfillment_messages(Message(platform=platform, message_object=quick_reply))
 
@@ -512,17 +671,17 @@ class DialogFlow(dict):
                 self.add_fulfillment_messages(Message(platform=platform,
                                                       message_object=self.payload))
             fulfillment_message = self.get_fulfillment_message(platform=platform, message_type='payload')
-            print('fulfillment_message: ', type(fulfillment_message), fulfillment_message)
             message_object = fulfillment_message.message_object
-            print('message_object: ', type(message_object), message_object)
             payload_object = message_object.payload
-            print('payload_object', type(payload_object), payload_object)
+            logger.debug('payload_object: %s %s', type(payload_object), payload_object)
             payload_object.add_suggestions(quick_replies)
             return self
 
+    @traced('dialogflow.add_card', 'platform')
     def add_card(self, platform: PlatformEnum, title: str, subtitle: str, image_uri: str, formatted_text: str = '',
                  image_text: str = '', buttons: List[Button] = None):
-        print('adding card: ', platform, title, subtitle, image_uri, formatted_text, image_text, buttons)
+        logger.debug('adding card: %s %s %s %s %s %s %s', platform, title, subtitle, image_uri, formatted_text,
+                     image_text, buttons)
         if buttons is None:
             buttons = []
 
@@ -547,8 +706,9 @@ class DialogFlow(dict):
         return self
 
     # Google Actions Functions      
+    @traced('dialogflow.add_link_out_suggestion', 'platform')
     def add_link_out_suggestion(self, platform: PlatformEnum, uri: str, destination_name: str):
-        print('adding link_out_suggestion: ', platform, uri, destination_name)
+        logger.debug('adding link_out_suggestion: %s %s %s', platform, uri, destination_name)
         link_out_suggestion = LinkOutSuggestion(uri=uri, destination_name=destination_name)
         self.add_fulfillment_messages(Message(platform=platform, message_object=link_out_suggestion))
 
@@ -562,21 +722,25 @@ class DialogFlow(dict):
 
         return link_out_suggestion
 
+    @traced('dialogflow.add_list_select', 'platform')
     def add_list_select(self, platform: PlatformEnum, title: str, subtitle: str, list_items: List[ListItem]):
-        print('adding list_select: ', platform, title, subtitle, list_items)
+        logger.debug('adding list_select: %s %s %s %s', platform, title, subtitle, list_items)
         list_select = ListSelect(title=title, subtitle=subtitle, list_items=list_items)
         self.add_fulfillment_messages(Message(platform=platform, message_object=list_select))
         return list_select
 
+    @traced('dialogflow.add_carousel_select', 'platform')
     def add_carousel_select(self, platform: PlatformEnum, carousel_items: List[CarouselItem]):
-        print('adding carousel_select: ', platform, carousel_items)
+        logger.debug('adding carousel_select: %s %s', platform, carousel_items)
         carousel_select = CarouselSelect(carousel_items)
         self.add_fulfillment_messages(Message(platform=platform, message_object=carousel_select))
         return carousel_select
 
+    @traced('dialogflow.add_carousel_browse_card', 'platform')
     def add_carousel_browse_card(self, platform: PlatformEnum, image_display_options: ImageDisplayOptions,
                                  browse_carousel_card_items: List[BrowseCarouselCardItem]):
-        print('adding carousel_browse_card: ', platform, image_display_options, browse_carousel_card_items)
+        logger.debug('adding carousel_browse_card: %s %s %s', platform, image_display_options,
+                     browse_carousel_card_items)
         carousel_browse = BrowseCarouselCard(image_display_options=image_display_options,
                                              browse_carousel_card_items=browse_carousel_card_items)
         self.add_fulfillment_messages(Message(platform=platform, message_object=carousel_browse))
@@ -587,11 +751,9 @@ class DialogFlow(dict):
 
         if self.create_payload_object:
             fulfillment_message = self.get_fulfillment_message(platform=platform, message_type='payload')
-            print('fulfillment_message: ', type(fulfillment_message), fulfillment_message)
             message_object = fulfillment_message.message_object
-            print('message_object: ', type(message_object), message_object)
             payload_object = message_object.payload
-            print('payload_object', type(payload_object), payload_object)
+            logger.debug('payload_object: %s %s', type(payload_object), payload_object)
             assert image_display_options in (ImageDisplayOptions.WHITE, ImageDisplayOptions.CROPPED,
                                              ImageDisplayOptions.IMAGE_DISPLAY_OPTIONS_UNSPECIFIED)
             if image_display_options == ImageDisplayOptions.IMAGE_DISPLAY_OPTIONS_UNSPECIFIED:
@@ -600,11 +762,12 @@ class DialogFlow(dict):
                                                browse_carousel_card_items=browse_carousel_card_items)
         return self
 
+    @traced('dialogflow.add_table_card', 'platform')
     def add_table_card(self, platform: PlatformEnum, title: str, subtitle: str, image_uri: str, accessibility_text: str,
                        image_height: int, image_width: int, column_properties: List[ColumnProperties],
                        rows: List[TableCardRow], buttons: List[Button]):
-        print('adding table_card: ', platform, title, subtitle, image_uri, accessibility_text, image_height,
-              image_width, column_properties, rows, buttons)
+        logger.debug('adding table_card: %s %s %s %s %s %s %s %s %s %s', platform, title, subtitle, image_uri,
+                     accessibility_text, image_height, image_width, column_properties, rows, buttons)
         table_card = TableCard(title=title, subtitle=subtitle, image=Image(image_uri=image_uri,
                                                                            accessibility_text=accessibility_text),
                                column_properties=column_properties, rows=rows, buttons=buttons)
@@ -620,8 +783,9 @@ class DialogFlow(dict):
                                image_width=image_width, column_properties=column_properties, rows=rows, buttons=buttons)
         return self
 
+    @traced('dialogflow.add_media', 'platform')
     def add_media(self, platform: PlatformEnum, media_type: ResponseMediaType, media_objects: List[MediaObject]):
-        print('adding media: ', platform, media_type, media_objects)
+        logger.debug('adding media: %s %s %s', platform, media_type, media_objects)
         media_content = MediaContent(media_type=media_type, media_objects=media_objects)
         self.add_fulfillment_messages(Message(platform=platform, message_object=media_content))
 
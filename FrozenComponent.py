@@ -0,0 +1,155 @@
+import threading
+import weakref
+from collections.abc import Mapping
+from typing import Any, Dict
+
+from DialogFlowPy.Button import Button
+from DialogFlowPy.Image import Image
+from DialogFlowPy.JsonEncoder import JsonEncoder, get_json_encoder
+from DialogFlowPy.OpenUriAction import OpenUriAction
+from DialogFlowPy.SelectOptionInfo import SelectOptionInfo
+from DialogFlowPy.Suggestion import Suggestion
+
+# mutable component type -> frozen variant
+_frozen_types: Dict[type, type] = {}
+
+_interned = weakref.WeakValueDictionary()
+_interned_lock = threading.Lock()
+
+
+def _freeze_value(value: Any) -> Any:
+    if isinstance(value, FrozenComponent):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze_value(item) for item in value)
+    if isinstance(value, Mapping):
+        return freeze(value)
+    return value
+
+
+def _value_types(value: Any) -> Any:
+    if isinstance(value, FrozenComponent):
+        # interned, its identity already tells components holding 1 and True apart
+        return id(value)
+    if isinstance(value, tuple):
+        return tuple(_value_types(item) for item in value)
+    return type(value)
+
+
+def _intern(frozen_type: type, items: tuple) -> 'FrozenComponent':
+    # 1, 1.0 and True are equal and hash alike, the types keep them from sharing one interned component
+    key = (frozen_type, items, tuple((type(item_key), _value_types(value)) for item_key, value in items))
+    with _interned_lock:
+        component = _interned.get(key)
+        if component is None:
+            component = dict.__new__(frozen_type)
+            dict.update(component, items)
+            # equal to any frozen component with the same items whatever its type, so the type stays out of the hash
+            component._hash = hash(items)
+            _interned[key] = component
+        return component
+
+
+def _restore(frozen_type: type, items: tuple) -> 'FrozenComponent':
+    return _intern(frozen_type, items)
+
+
+def freeze(component: Mapping) -> 'FrozenComponent':
+    """Returns the interned frozen variant of a component, nested components and lists are frozen too"""
+    if isinstance(component, FrozenComponent):
+        return component
+
+    frozen_type = _frozen_types.get(type(component), FrozenDict if isinstance(component, dict) else None)
+    if frozen_type is None:
+        raise TypeError('no frozen variant of %s' % type(component).__name__)
+
+    return _intern(frozen_type, tuple((key, _freeze_value(value)) for key, value in component.items()))
+
+
+class FrozenComponent(object):
+    """
+    Immutable, hashable variant of a dict based component. Instances are interned by value, building the same
+    component twice returns the same object, so constants can be defined once at module level and shared between
+    threads and requests. The json fragment of a component is encoded on first use and kept with it.
+
+        LOGO = FrozenImage(image_uri='https://example.com/logo.png', accessibility_text='Logo')
+        HELP = FrozenSuggestion('Help')
+    """
+
+    _mutable_type: type = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls._mutable_type is not None:
+            _frozen_types.setdefault(cls._mutable_type, cls)
+
+    def __new__(cls, *args, **kwargs):
+        # the mutable component validates and lays out the fields, only its items are kept
+        scratch = cls._mutable_type(*args, **kwargs)
+        return _intern(cls, tuple((key, _freeze_value(value)) for key, value in scratch.items()))
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return _restore, (type(self), tuple(dict.items(self)))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('%s is immutable, thaw() it to get an editable copy' % type(self).__name__)
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __setattr__(self, name, value):
+        if name != '_hash' and not name.startswith('_json_fragment'):
+            self._immutable()
+        object.__setattr__(self, name, value)
+
+    def thaw(self):
+        """Mutable copy of the component, nested components stay frozen"""
+        component = dict.__new__(self._mutable_type)
+        dict.update(component, ((key, list(value) if isinstance(value, tuple) else value)
+                                for key, value in dict.items(self)))
+        return component
+
+    def json_fragment(self, encoder: JsonEncoder = None) -> bytes:
+        """The component encoded as json, cached per encoder"""
+        encoder = encoder or get_json_encoder()
+        cached = self.__dict__.get('_json_fragment')
+        if cached is None or cached[0] is not encoder:
+            cached = (encoder, encoder.encode(self))
+            self._json_fragment = cached
+        return cached[1]
+
+
+class FrozenDict(FrozenComponent, dict):
+    _mutable_type = dict
+
+
+class FrozenOpenUriAction(FrozenComponent, OpenUriAction):
+    _mutable_type = OpenUriAction
+
+
+class FrozenImage(FrozenComponent, Image):
+    _mutable_type = Image
+
+
+class FrozenButton(FrozenComponent, Button):
+    _mutable_type = Button
+
+
+class FrozenSuggestion(FrozenComponent, Suggestion):
+    _mutable_type = Suggestion
+
+
+class FrozenSelectOptionInfo(FrozenComponent, SelectOptionInfo):
+    _mutable_type = SelectOptionInfo
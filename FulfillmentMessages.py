@@ -0,0 +1,90 @@
+import copy
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from DialogFlowPy import PlatformEnum
+from DialogFlowPy.Message import Message
+
+
+class FulfillmentMessages(list):
+    """
+    Fulfillment messages of the response, indexed by (platform, message_type).
+
+    It is still a list of Message and serializes exactly like one, while checking for or fetching a message of a given
+    type is a single dict lookup. The regular list methods keep the index in sync; a message whose platform or type is
+    changed after it was added has to be re-added to be found under its new key.
+    """
+
+    def __init__(self, messages: Iterable[Message] = ()):
+        super().__init__()
+        self._index: Dict[Tuple[PlatformEnum, str], List[Message]] = {}
+        self.extend(messages)
+
+    def __reduce_ex__(self, protocol):
+        # the default list pickling appends the items before the index exists, rebuild it through __init__ instead
+        return self.__class__, (list(self),)
+
+    def __deepcopy__(self, memo: dict) -> 'FulfillmentMessages':
+        copied = self.__class__()
+        memo[id(self)] = copied
+        copied.extend(copy.deepcopy(message, memo) for message in self)
+        return copied
+
+    def has_message_type(self, platform: PlatformEnum, message_type: str) -> bool:
+        return (platform, message_type) in self._index
+
+    def get_message(self, platform: PlatformEnum, message_type: str) -> Optional[Message]:
+        messages = self._index.get((platform, message_type))
+        return messages[0] if messages else None
+
+    def get_messages(self, platform: PlatformEnum, message_type: str) -> List[Message]:
+        return list(self._index.get((platform, message_type), ()))
+
+    def _add_to_index(self, message: Message):
+        self._index.setdefault((message.platform, message.message_type), []).append(message)
+
+    # list methods, kept consistent with the index
+
+    def append(self, message: Message):
+        assert isinstance(message, Message)
+        super().append(message)
+        self._add_to_index(message)
+
+    def extend(self, messages: Iterable[Message]):
+        for message in messages:
+            self.append(message)
+
+    def __iadd__(self, messages: Iterable[Message]):
+        self.extend(messages)
+        return self
+
+    def insert(self, position: int, message: Message):
+        assert isinstance(message, Message)
+        super().insert(position, message)
+        self._reindex()
+
+    def remove(self, message: Message):
+        super().remove(message)
+        self._reindex()
+
+    def pop(self, position: int = -1) -> Message:
+        message = super().pop(position)
+        self._reindex()
+        return message
+
+    def clear(self):
+        super().clear()
+        self._index.clear()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._reindex()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._reindex()
+
+    def _reindex(self):
+        # insert and removal must keep the per key lists in list order, rebuilding is the simplest way to do that
+        self._index = {}
+        for message in self:
+            self._add_to_index(message)
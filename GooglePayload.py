@@ -1,4 +1,5 @@
-from typing import List
+import logging
+from typing import List, Union
 from DialogFlowPy import ImageDisplayOptions
 from GoogleActions import MediaType
 from GoogleActions.Button import Button
@@ -13,6 +14,10 @@ from GoogleActions.Suggestion import Suggestion
 from GoogleActions import UrlTypeHint
 from GoogleActions import Permission
 from DialogFlowPy.BrowseCarouselCardItem import BrowseCarouselCardItem
+from DialogFlowPy.Instrumentation import traced
+from DialogFlowPy.UserStorage import UserStorage, get_user_storage_codec
+
+logger = logging.getLogger(__name__)
 
 
 class GooglePayload(dict):
@@ -43,7 +48,7 @@ class GooglePayload(dict):
             self['systemIntent'] = system_intent
 
         if user_storage is not None:
-            self['userStorage'] = user_storage
+            self.user_storage = user_storage
 
     @property
     def expect_user_response(self):
@@ -54,11 +59,16 @@ class GooglePayload(dict):
         self['expectUserResponse'] = value
 
     @property
-    def user_storage(self):
+    def user_storage(self) -> str:
         return self.get('userStorage')
 
     @user_storage.setter
-    def user_storage(self, value: str):
+    def user_storage(self, value: Union[str, dict, UserStorage]):
+        """Dicts and UserStorage are encoded with the shared UserStorageCodec, strings are written as they are"""
+        if isinstance(value, UserStorage):
+            value = value.encode()
+        elif isinstance(value, dict):
+            value = get_user_storage_codec().encode(value)
         self['userStorage'] = value
 
     @property
@@ -83,6 +93,7 @@ class GooglePayload(dict):
         self['systemIntent'] = ExpectedIntent(intent=intent, parameter_name=parameter_name, input_value=input_value)
         return self.system_intent
 
+    @traced('google_payload.add_rich_response')
     def add_rich_response(self, items_list: List[Item] = None, suggestions: List[Suggestion] = None,
                           link_name: str = '',
                           link_url: str = '') -> RichResponse:
@@ -98,6 +109,7 @@ class GooglePayload(dict):
         self.rich_response.add_items(items)
         return self.rich_response
 
+    @traced('google_payload.add_simple_response')
     def add_simple_response(self, text_to_speech: str, ssml: str = '', display_text: str = ''):
         if self.rich_response is None:
             self['richResponse'] = RichResponse()
@@ -106,6 +118,7 @@ class GooglePayload(dict):
 
         return self.rich_response
 
+    @traced('google_payload.add_basic_card')
     def add_basic_card(self, title: str = '', formatted_text: str = '', subtitle: str = '', image_uri: str = '',
                        image_text: str = '', image_height: int = 0, image_width: int = 0,
                        image_display_options: ImageDisplayOptions = None, buttons=None):
@@ -126,6 +139,7 @@ class GooglePayload(dict):
     def add_carousel_select(self):
         return NotImplementedError('Carousel select doesnt exist in Payload')
 
+    @traced('google_payload.add_carousel_browse')
     def add_carousel_browse(self, image_display_options, browse_carousel_card_items: List[BrowseCarouselCardItem]):
         if self.rich_response is None:
             self['richResponse'] = RichResponse()
@@ -138,6 +152,7 @@ class GooglePayload(dict):
 
         return self.rich_response
 
+    @traced('google_payload.add_table_card')
     def add_table_card(self, title: str, subtitle: str, image_uri: str, accessibility_text: str, image_height: int,
                        image_width: int, column_properties, rows, buttons):
         if self.rich_response is None:
@@ -151,6 +166,7 @@ class GooglePayload(dict):
                                           buttons=google_buttons)
         return self.rich_response
 
+    @traced('google_payload.add_structured_response')
     def add_structured_response(self, receipt=None, info_extension=None,
                                 return_info=None,
                                 user_notification=None, rejection_info=None, update_time=None,
@@ -174,6 +190,7 @@ class GooglePayload(dict):
                                                    order_management_actions_list=order_management_actions_list)
         return self.rich_response
 
+    @traced('google_payload.add_media_response')
     def add_media_response(self, media_type: MediaType, media_objects: List[MediaObject]) -> RichResponse:
         if self.rich_response is None:
             self['richResponse'] = RichResponse()
@@ -184,15 +201,17 @@ class GooglePayload(dict):
     def add_html_region(self):
         return NotImplementedError('Not Implemented')
 
+    @traced('google_payload.add_suggestions')
     def add_suggestions(self, titles: str):
-        print('adding suggestions inside GooglePayload: ', titles)
+        logger.debug('adding suggestions inside GooglePayload: %s', titles)
         if self.rich_response is None:
             self['richResponse'] = RichResponse()
         self.rich_response.add_suggestions(titles)
         return self.rich_response
 
+    @traced('google_payload.add_link_out_suggestions')
     def add_link_out_suggestions(self, url: str, destination_name: str):
-        print('adding link_out_suggestions inside GooglePayload: ', url, destination_name)
+        logger.debug('adding link_out_suggestions inside GooglePayload: %s %s', url, destination_name)
         if self.rich_response is None:
             self['richResponse'] = RichResponse()
         self.rich_response.add_link_out_suggestion(url=url, destination_name=destination_name)
@@ -0,0 +1,113 @@
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Any, Iterator, List, Optional
+
+_EMPTY = MappingProxyType({})
+_CONTEXTS_SEGMENT = '/contexts/'
+
+
+class IncomingContext(object):
+    """
+    Context sent with the request, its long name parsed once into the session prefix and the short name
+    {
+      "name": string,
+      "lifespanCount": number,
+      "parameters": {
+        object
+      }
+    }
+    """
+
+    __slots__ = ('_data', 'session', 'short_name')
+
+    def __init__(self, data: dict, session: Optional[str], short_name: str):
+        self._data = data
+        self.session = session
+        self.short_name = short_name
+
+    @property
+    def name(self) -> str:
+        return self._data.get('name')
+
+    @property
+    def lifespan_count(self) -> int:
+        return self._data.get('lifespanCount', self._data.get('lifespan', 0))
+
+    @property
+    def parameters(self) -> Mapping:
+        parameters = self._data.get('parameters')
+        return MappingProxyType(parameters) if parameters is not None else _EMPTY
+
+    def get_parameter(self, parameter_name: str, default: Any = None) -> Any:
+        return (self._data.get('parameters') or _EMPTY).get(parameter_name, default)
+
+    def __repr__(self):
+        return 'IncomingContext(%r)' % self._data
+
+
+class IncomingContexts(Mapping):
+    """
+    Read-only index of the request's contexts keyed by short name
+    ('projects/<Project ID>/agent/sessions/<Session ID>/contexts/<Context Name>' is found under '<Context Name>').
+    Lookups also accept the long name of a context of the same session. The index is built on first lookup, every
+    short name lookup after that is a single dict access.
+    """
+
+    def __init__(self, contexts: List[dict], session: str = None):
+        self._contexts = contexts or []
+        self._session = session
+        self._index = None
+
+    def _build(self) -> dict:
+        index = {}
+        for context in self._contexts:
+            session, separator, short_name = (context.get('name') or '').rpartition(_CONTEXTS_SEGMENT)
+            if not separator:
+                # v1 requests only carry the short name
+                session, short_name = self._session, context.get('name')
+            elif session == self._session:
+                # share the session prefix string between every context of the request
+                session = self._session
+            index[short_name] = IncomingContext(context, session, short_name)
+
+        self._index = index
+        return index
+
+    def _find(self, name: str) -> Optional[IncomingContext]:
+        index = self._index if self._index is not None else self._build()
+        context = index.get(name)
+        if context is None and isinstance(name, str) and _CONTEXTS_SEGMENT in name:
+            session, _, short_name = name.rpartition(_CONTEXTS_SEGMENT)
+            context = index.get(short_name)
+            if context is not None and context.session != session:
+                return None
+        return context
+
+    def __getitem__(self, name: str) -> IncomingContext:
+        context = self._find(name)
+        if context is None:
+            raise KeyError(name)
+        return context
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index if self._index is not None else self._build())
+
+    def __len__(self) -> int:
+        return len(self._index if self._index is not None else self._build())
+
+    def __contains__(self, name) -> bool:
+        return self._find(name) is not None
+
+    def get_parameter(self, context_name: str, parameter_name: str, default: Any = None) -> Any:
+        context = self._find(context_name)
+        if context is None:
+            return default
+        return context.get_parameter(parameter_name, default)
+
+    def full_name(self, short_name: str) -> str:
+        """Long name of a context in this request's session"""
+        context = (self._index if self._index is not None else self._build()).get(short_name)
+        session = context.session if context is not None else self._session
+        if not session:
+            return short_name
+        return session + _CONTEXTS_SEGMENT + short_name
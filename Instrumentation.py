@@ -0,0 +1,229 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SpanSink = Callable[['Span'], Any]
+
+# replaced, never mutated, so readers need no lock
+_sinks: Tuple[SpanSink, ...] = ()
+_current_span: contextvars.ContextVar = contextvars.ContextVar('DialogFlowPy.current_span', default=None)
+
+
+class Span(object):
+    """
+    One timed stage of a request. Spans opened while another one is open in the same context become its children
+    and share its trace id. Every registered sink receives the span when it ends.
+    """
+
+    __slots__ = ('name', 'attributes', 'start_ns', 'end_ns', 'trace_id', 'span_id', 'parent_id', '_token',
+                 '_start_counter')
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = 0
+        self.end_ns = 0
+        self.trace_id = 0
+        self.span_id = random.getrandbits(64)
+        self.parent_id = 0
+        self._token = None
+        self._start_counter = 0
+
+    @property
+    def duration(self) -> float:
+        """Seconds between enter and exit, measured with the monotonic performance counter"""
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def set(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def __bool__(self):
+        return True
+
+    def __enter__(self) -> 'Span':
+        parent = _current_span.get()
+        if parent is not None:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        else:
+            self.trace_id = random.getrandbits(128)
+        self._token = _current_span.set(self)
+        self.start_ns = time.time_ns()
+        self._start_counter = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end_ns = self.start_ns + time.perf_counter_ns() - self._start_counter
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+
+        for sink in _sinks:
+            try:
+                sink(self)
+            except Exception:
+                logger.exception('span sink %r failed', sink)
+
+    def __repr__(self):
+        return 'Span(%r, %.6f s, %r)' % (self.name, self.duration, self.attributes)
+
+
+class _NoopSpan(object):
+    """Returned by span() while no sink is registered, falsy so callers can skip computing attributes"""
+
+    __slots__ = ()
+
+    def set(self, key: str, value: Any):
+        pass
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """
+    Context manager timing the code it wraps. While no sink is registered it returns a shared no-op object, a span
+    then costs one function call. The entered span is falsy when it is not recorded:
+
+        with span('dialogflow.encode') as current:
+            ...
+            if current:
+                current.set('bytes', len(data))
+    """
+    if not _sinks:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def traced(name: str, *argument_names: str):
+    """
+    Decorator running every call of the function inside span(name), the arguments named in argument_names become
+    attributes of the span
+    """
+    def decorator(func: Callable) -> Callable:
+        parameters = list(inspect.signature(func).parameters)
+        positions = [(argument_name, parameters.index(argument_name)) for argument_name in argument_names]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _sinks:
+                return func(*args, **kwargs)
+
+            attributes = {}
+            for argument_name, position in positions:
+                if argument_name in kwargs:
+                    attributes[argument_name] = kwargs[argument_name]
+                elif position < len(args):
+                    attributes[argument_name] = args[position]
+            with Span(name, attributes):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def add_span_sink(sink: SpanSink) -> SpanSink:
+    """Registers a callable receiving every span that ends, from then on spans are recorded"""
+    global _sinks
+    assert callable(sink)
+    _sinks = _sinks + (sink,)
+    return sink
+
+
+def remove_span_sink(sink: SpanSink):
+    global _sinks
+    _sinks = tuple(registered for registered in _sinks if registered is not sink)
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, Enum):
+        value = value.name
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        # 64 bit integers are strings in OTLP json
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': value if isinstance(value, str) else str(value)}
+
+
+class OtlpJsonFileExporter(object):
+    """
+    Span sink writing spans to a file in the OTLP json format, one ExportTraceServiceRequest per line, as the
+    OpenTelemetry collector's file exporter does. Spans are buffered and written batch_size at a time, call flush()
+    or close() to write the rest.
+    """
+
+    def __init__(self, path: str, service_name: str = 'DialogFlowPy', batch_size: int = 64):
+        assert batch_size > 0
+        self._file = open(path, 'a', encoding='utf-8')
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._spans: List[Span] = []
+        self._resource = {'attributes': [{'key': 'service.name', 'value': {'stringValue': service_name}},
+                                         {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}}]}
+
+    def __call__(self, ended_span: Span):
+        with self._lock:
+            self._spans.append(ended_span)
+            if len(self._spans) < self._batch_size:
+                return
+            spans, self._spans = self._spans, []
+            self._write(spans)
+
+    @staticmethod
+    def _otlp_span(ended_span: Span) -> Dict[str, Any]:
+        otlp_span = {
+            'traceId': '%032x' % ended_span.trace_id,
+            'spanId': '%016x' % ended_span.span_id,
+            'name': ended_span.name,
+            'kind': 1,
+            'startTimeUnixNano': str(ended_span.start_ns),
+            'endTimeUnixNano': str(ended_span.end_ns),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in ended_span.attributes.items()],
+            'status': {'code': 2} if 'error' in ended_span.attributes else {},
+        }
+        if ended_span.parent_id:
+            otlp_span['parentSpanId'] = '%016x' % ended_span.parent_id
+        return otlp_span
+
+    def _write(self, spans: List[Span]):
+        request = {'resourceSpans': [{'resource': self._resource, 'scopeSpans': [
+            {'scope': {'name': 'DialogFlowPy'}, 'spans': [self._otlp_span(ended_span) for ended_span in spans]}]}]}
+        self._file.write(json.dumps(request, separators=(',', ':')) + '\n')
+
+    def flush(self):
+        with self._lock:
+            spans, self._spans = self._spans, []
+            if spans:
+                self._write(spans)
+            self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
@@ -0,0 +1,234 @@
+import json
+import re
+import uuid
+from collections.abc import Mapping
+from enum import Enum
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(obj: Any) -> Any:
+    """Converts the objects neither backend serializes natively into plain json types"""
+    # components materialized at encoding time are by far the most frequent callers, check for them first
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is not None:
+        return to_dict()
+    if isinstance(obj, Enum):
+        # orjson writes enums as their value, keep the stdlib backend consistent with it
+        return obj.value
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError('Object of type %s is not JSON serializable' % type(obj).__name__)
+
+
+class JsonEncoder(object):
+    """Turns a response tree (dicts, lists and the dict based components) into utf-8 json bytes"""
+
+    name = None
+
+    def encode(self, obj: Any) -> bytes:
+        raise NotImplementedError()
+
+
+class StdlibJsonEncoder(JsonEncoder):
+    """json module backend: compact separators, no ascii escaping and no circular reference bookkeeping"""
+
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(',', ':'),
+                                         default=default)
+
+    def encode(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj).encode('utf-8')
+
+
+class OrjsonEncoder(JsonEncoder):
+    """orjson backend, writes bytes directly and serializes dict subclasses and enums natively"""
+
+    name = 'orjson'
+
+    def __init__(self):
+        assert orjson is not None, 'orjson is not installed'
+
+    def encode(self, obj: Any) -> bytes:
+        # int, float, bool and None keys are written as strings, like the json module does
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+# exact types that are never containers, checked before anything else while walking a response
+_LEAF_TYPES = frozenset((str, int, float, bool, type(None)))
+# random per process, so the markers can never collide with real response text
+_MEMO_TOKEN = uuid.uuid4().hex
+_MEMO_PATTERN = re.compile(rb'"\{\{memo:' + _MEMO_TOKEN.encode('ascii') + rb':(\d+)\}\}"')
+
+_LEAF, _MAPPING, _SEQUENCE, _MATERIALIZED, _FROZEN = range(5)
+# type -> how the walk treats its instances, classified once per type
+_node_kinds = {dict: _MAPPING, list: _SEQUENCE, tuple: _SEQUENCE}
+
+
+def _node_kind(node_type: type) -> int:
+    kind = _node_kinds.get(node_type)
+    if kind is None:
+        if hasattr(node_type, 'json_fragment'):
+            kind = _FROZEN
+        elif issubclass(node_type, dict):
+            kind = _MAPPING
+        elif issubclass(node_type, (list, tuple)):
+            kind = _SEQUENCE
+        elif hasattr(node_type, 'to_dict'):
+            kind = _MATERIALIZED
+        else:
+            kind = _LEAF
+        _node_kinds[node_type] = kind
+    return kind
+
+
+class _MemoizedEncode(object):
+    """State of a single MemoizingJsonEncoder.encode call"""
+
+    def __init__(self, encoder: JsonEncoder):
+        self._encoder = encoder
+        # id of every container walked -> id of the container it was first reached from
+        self._parents = {}
+        # ids of the containers holding a shared subtree somewhere below them, the only ones copied
+        self._dirty = set()
+        # id of a shared subtree -> its index in _nodes, _markers and _fragments
+        self._shared = {}
+        self._nodes = []
+        self._markers = []
+        self._fragments = {}
+        # to_dict() results, built once and kept alive so their ids stay unique for the whole encode
+        self._materialized = {}
+
+    def _materialize(self, node: Any) -> dict:
+        materialized = self._materialized.get(id(node))
+        if materialized is None:
+            materialized = self._materialized[id(node)] = node.to_dict()
+        return materialized
+
+    def _share(self, node: Any):
+        self._shared[id(node)] = len(self._nodes)
+        self._markers.append('{{memo:%s:%d}}' % (_MEMO_TOKEN, len(self._nodes)))
+        self._nodes.append(node)
+        self._mark_dirty(self._parents[id(node)])
+
+    def _mark_dirty(self, node_id: int):
+        parents, dirty = self._parents, self._dirty
+        while node_id is not None and node_id not in dirty:
+            dirty.add(node_id)
+            node_id = parents[node_id]
+
+    def _count(self, root: Any):
+        parents, shared = self._parents, self._shared
+        stack = [(root, None)]
+        while stack:
+            node, parent_id = stack.pop()
+            node_id = id(node)
+            if node_id in parents:
+                if node_id not in shared:
+                    self._share(node)
+                self._mark_dirty(parent_id)
+                continue
+            parents[node_id] = parent_id
+
+            kind = _node_kind(type(node))
+            if kind == _MAPPING:
+                children = node.values()
+            elif kind == _SEQUENCE:
+                children = node
+            elif kind == _MATERIALIZED:
+                children = self._materialize(node).values()
+            elif kind == _FROZEN:
+                # frozen components bring a fragment cached by an earlier response
+                self._share(node)
+                continue
+            else:
+                continue
+            stack.extend([(child, node_id) for child in children if type(child) not in _LEAF_TYPES])
+
+    def _replace(self, node: Any) -> Any:
+        index = self._shared.get(id(node))
+        if index is not None:
+            return self._markers[index]
+        if id(node) not in self._dirty:
+            return node
+        return self._expand(node)
+
+    def _expand(self, node: Any) -> Any:
+        """Copy of the node with its shared descendants replaced by markers"""
+        if _node_kind(type(node)) == _MATERIALIZED:
+            node = self._materialize(node)
+        if isinstance(node, dict):
+            return {key: self._replace(value) for key, value in node.items()}
+        return [self._replace(value) for value in node]
+
+    def _fragment(self, index: int) -> bytes:
+        fragment = self._fragments.get(index)
+        if fragment is None:
+            node = self._nodes[index]
+            if _node_kind(type(node)) == _FROZEN:
+                fragment = node.json_fragment(self._encoder)
+            else:
+                if id(node) in self._dirty:
+                    node = self._expand(node)
+                fragment = self._splice(self._encoder.encode(node))
+            self._fragments[index] = fragment
+        return fragment
+
+    def _splice(self, encoded: bytes) -> bytes:
+        return _MEMO_PATTERN.sub(lambda match: self._fragment(int(match.group(1))), encoded)
+
+    def encode(self, root: Any) -> bytes:
+        self._count(root)
+        if not self._nodes:
+            return self._encoder.encode(root)
+        return self._splice(self._encoder.encode(self._replace(root)))
+
+
+class MemoizingJsonEncoder(JsonEncoder):
+    """
+    Encodes every subtree referenced more than once in a response a single time and splices its bytes back in at each
+    reference, frozen components reuse the fragment cached by an earlier response. Subtrees are matched by identity
+    and must not change during the encode. Finding them costs a walk over the response in python, so this pays off
+    for responses sharing large or frozen subtrees, the plain encoders stay faster for everything else.
+    """
+
+    name = 'memoize'
+
+    def __init__(self, encoder: JsonEncoder = None):
+        assert encoder is None or not isinstance(encoder, MemoizingJsonEncoder)
+        self._encoder = encoder
+
+    def encode(self, obj: Any) -> bytes:
+        return _MemoizedEncode(self._encoder or get_json_encoder()).encode(obj)
+
+
+_json_encoder: JsonEncoder = None
+
+
+def get_json_encoder() -> JsonEncoder:
+    """Returns the encoder shared by every response, orjson when it is installed and the json module otherwise"""
+    global _json_encoder
+    if _json_encoder is None:
+        _json_encoder = OrjsonEncoder() if orjson is not None else StdlibJsonEncoder()
+    return _json_encoder
+
+
+def set_json_encoder(encoder: Union[JsonEncoder, str, None]) -> JsonEncoder:
+    """Selects the response encoder, either an instance, 'orjson', 'json', or None for the default"""
+    global _json_encoder
+    if isinstance(encoder, str):
+        encoders = {OrjsonEncoder.name: OrjsonEncoder, StdlibJsonEncoder.name: StdlibJsonEncoder}
+        assert encoder in encoders, 'unknown json encoder %s' % encoder
+        encoder = encoders[encoder]()
+
+    assert encoder is None or isinstance(encoder, JsonEncoder)
+    _json_encoder = encoder
+    return encoder
@@ -0,0 +1,179 @@
+import asyncio
+from collections.abc import Mapping
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator, List, Tuple
+
+from DialogFlowPy.JsonEncoder import JsonEncoder, get_json_encoder
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+def _json_key(key: Any) -> str:
+    """The object key the json module writes for a dict key"""
+    if isinstance(key, str):
+        return key
+    # bool before int, True is an int too
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, int):
+        return int.__repr__(key)
+    if isinstance(key, float):
+        if key != key:
+            return 'NaN'
+        if key in (float('inf'), float('-inf')):
+            return 'Infinity' if key > 0 else '-Infinity'
+        return float.__repr__(key)
+    raise TypeError('keys must be str, int, float, bool or None, not %s' % type(key).__name__)
+
+
+class _JsonStream(object):
+    """
+    Walks a response and encodes it piece by piece. Containers near the root, long lists, and containers holding a
+    long list are written element by element. Everything below them goes to the backend encoder in a single call, so
+    no piece is much larger than one element of the longest list.
+    """
+
+    def __init__(self, encoder: JsonEncoder, chunk_size: int, stream_depth: int, min_items: int):
+        self._encoder = encoder
+        self._chunk_size = chunk_size
+        self._stream_depth = stream_depth
+        self._min_items = min_items
+        self._keys = {}
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+
+    def _key(self, key: Any) -> bytes:
+        if type(key) is not str:
+            # not cached, 1, 1.0 and True are the same dict key but different json keys
+            return self._encoder.encode(_json_key(key)) + b':'
+        encoded = self._keys.get(key)
+        if encoded is None:
+            encoded = self._keys[key] = self._encoder.encode(key) + b':'
+        return encoded
+
+    def _is_large(self, node: Any, depth: int) -> bool:
+        if depth < self._stream_depth or len(node) >= self._min_items:
+            return True
+        values = node.values() if isinstance(node, Mapping) else node
+        return any(isinstance(value, list) and len(value) >= self._min_items for value in values)
+
+    def _is_large_item(self, item: Any, depth: int) -> bool:
+        # list items only get the cheap checks, their own children are not scanned
+        return isinstance(item, (Mapping, list, tuple)) and (depth < self._stream_depth or
+                                                             len(item) >= self._min_items)
+
+    def _pieces(self, node: Any, depth: int) -> Iterator[bytes]:
+        fragment = getattr(node, 'json_fragment', None)
+        if fragment is not None:
+            # frozen components carry their own encoding
+            yield fragment(self._encoder)
+            return
+
+        if not isinstance(node, (Mapping, list, tuple)) and hasattr(node, 'to_dict'):
+            node = node.to_dict()
+
+        if isinstance(node, Mapping) and self._is_large(node, depth):
+            yield b'{'
+            for position, (key, value) in enumerate(node.items()):
+                yield (b',' + self._key(key)) if position else self._key(key)
+                yield from self._pieces(value, depth + 1)
+            yield b'}'
+
+        elif isinstance(node, (list, tuple)) and self._is_large(node, depth):
+            yield b'['
+            yield from self._items(node, depth + 1)
+            yield b']'
+
+        else:
+            yield self._encoder.encode(node)
+
+    def _items(self, node: Any, depth: int) -> Iterator[bytes]:
+        """
+        Runs of small items are encoded together, one backend call per run instead of one per item. The run length
+        adapts so a run encodes to about half a chunk.
+        """
+        position, length, run = 0, len(node), 1
+        while position < length:
+            if position:
+                yield b','
+
+            if self._is_large_item(node[position], depth):
+                yield from self._pieces(node[position], depth)
+                position += 1
+                continue
+
+            end = position + 1
+            while end < length and end - position < run and not self._is_large_item(node[end], depth):
+                end += 1
+
+            encoded = self._encoder.encode(node[position:end])
+            # drop the brackets of the encoded slice
+            yield encoded[1:-1]
+
+            run = max(1, self._chunk_size * (end - position) // (2 * len(encoded)))
+            position = end
+
+    def chunks(self, root: Any) -> Iterator[bytes]:
+        pending, chunk_size = self._pending, self._chunk_size
+        for piece in self._pieces(root, 0):
+            pending.append(piece)
+            self._pending_size += len(piece)
+            if self._pending_size >= chunk_size:
+                yield b''.join(pending)
+                pending.clear()
+                self._pending_size = 0
+
+        if pending:
+            yield b''.join(pending)
+            pending.clear()
+            self._pending_size = 0
+
+
+def iter_json(obj: Any, encoder: JsonEncoder = None, chunk_size: int = DEFAULT_CHUNK_SIZE, stream_depth: int = 4,
+              min_items: int = 32) -> Iterator[bytes]:
+    """
+    Yields the response encoded as json in chunks of about chunk_size bytes, the concatenation is byte for byte what
+    the encoder returns for the whole response. The generator is a valid WSGI response body.
+    """
+    assert chunk_size > 0
+    return _JsonStream(encoder or get_json_encoder(), chunk_size, stream_depth, min_items).chunks(obj)
+
+
+async def aiter_json(obj: Any, encoder: JsonEncoder = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     stream_depth: int = 4, min_items: int = 32) -> AsyncIterator[bytes]:
+    """Asynchronous iter_json, gives the event loop a turn after every chunk"""
+    for chunk in iter_json(obj, encoder, chunk_size, stream_depth, min_items):
+        yield chunk
+        await asyncio.sleep(0)
+
+
+def write_json_stream(write: Callable[[bytes], Any], obj: Any, encoder: JsonEncoder = None,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Writes the response through a WSGI write callable (or any file-like write), returns the bytes written"""
+    written = 0
+    for chunk in iter_json(obj, encoder, chunk_size):
+        write(chunk)
+        written += len(chunk)
+    return written
+
+
+async def send_json_stream(send: Callable[[dict], Awaitable], obj: Any, status: int = 200,
+                           headers: Iterable[Tuple[bytes, bytes]] = (), encoder: JsonEncoder = None,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """
+    Sends the response as an ASGI http response, one body message per chunk. Every send is awaited before the next
+    chunk is encoded, so at most one chunk is buffered on our side. Returns the bytes sent.
+    """
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')] + list(headers)})
+
+    sent = 0
+    async for chunk in aiter_json(obj, encoder, chunk_size):
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        sent += len(chunk)
+
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    return sent
@@ -1,5 +1,6 @@
 from typing import List
 
+from DialogFlowPy.CompactComponents import CompactListItem
 from DialogFlowPy.Image import Image
 from DialogFlowPy.ListItem import ListItem
 from DialogFlowPy.SelectOptionInfo import SelectOptionInfo
@@ -26,7 +27,7 @@ class ListSelect(dict):
         self.list_items = []
 
         for item in list_items:
-            assert isinstance(item, ListItem)
+            assert isinstance(item, (ListItem, CompactListItem))
             self.list_items.append(item)
 
         self.title = title
@@ -58,7 +59,7 @@ class ListSelect(dict):
 
     def add_list_items(self, list_items: ListItem) -> List[ListItem]:
         for item in list_items:
-            assert isinstance(item, ListItem)
+            assert isinstance(item, (ListItem, CompactListItem))
             self.list_items.append(item)
         return self.list_items
 
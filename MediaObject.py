@@ -1,3 +1 @@
 from GoogleActions.MediaObject import MediaObject
-
-print('MediaObject : ', MediaObject)
@@ -1,4 +1,4 @@
-from typing import Union, List
+from typing import Dict, List, Optional, Tuple, Union
 
 from DialogFlowPy import PlatformEnum, ImageDisplayOptions, ResponseMediaType
 from DialogFlowPy.BasicCard import BasicCard
@@ -9,6 +9,7 @@ from DialogFlowPy.Card import Card
 from DialogFlowPy.CarouselItem import CarouselItem
 from DialogFlowPy.CarouselSelect import CarouselSelect
 from DialogFlowPy.ColumnProperties import ColumnProperties
+from DialogFlowPy.CompactComponents import CompactBasicCard, CompactCard
 from DialogFlowPy.Image import Image
 from DialogFlowPy.LinkOutSuggestion import LinkOutSuggestion
 from DialogFlowPy.ListItem import ListItem
@@ -78,90 +79,98 @@ class Message(dict):
     }
     """
 
+    __slots__ = ('_platform', '_message_key', '_message_type')
+
+    # component class -> (json key, message_type), extended through register_message_type
+    _message_types: Dict[type, Tuple[str, str]] = {
+        Text: ('text', 'text'),
+        Image: ('image', 'image'),
+        QuickReplies: ('quick_replies', 'quick_replies'),
+        Card: ('card', 'card'),
+        SimpleResponses: ('simple_responses', 'simple_responses'),
+        BasicCard: ('basic_card', 'basic_card'),
+        Suggestions: ('suggestions', 'suggestions'),
+        LinkOutSuggestion: ('link_out_suggestion', 'link_out_suggestion'),
+        ListSelect: ('list_select', 'list_select'),
+        CarouselSelect: ('carousel_select', 'carousel_select'),
+        BrowseCarouselCard: ('browse_carousel_card', 'browse_carousel_card'),
+        TableCard: ('tableCard', 'table_card'),
+        MediaContent: ('media_content', 'media_content'),
+        Payload: ('payload', 'payload'),
+        CompactCard: ('card', 'card'),
+        CompactBasicCard: ('basic_card', 'basic_card'),
+    }
+    # subclasses of registered components, resolved through their mro on first use
+    _resolved_message_types: Dict[type, Optional[Tuple[str, str]]] = {}
+
     def __init__(self, platform: PlatformEnum,
                  message_object: Union[Text, Image, QuickReplies, Card, SimpleResponses, BasicCard, Suggestions,
                                        LinkOutSuggestion, ListSelect, CarouselSelect, Payload, MediaContent, TableCard,
                                        BrowseCarouselCard]):
         super().__init__()
 
+        self._platform = None
+        self._message_key = None
         self._message_type = None
 
         self.platform = platform
 
         self.message_object = message_object
 
+    @classmethod
+    def register_message_type(cls, component_class: type, key: str, message_type: str = None) -> type:
+        """
+        Makes instances of component_class (and its subclasses) usable as message_object, serialized under key
+        """
+        cls._message_types[component_class] = (key, message_type or key)
+        cls._resolved_message_types.clear()
+        return component_class
+
+    @classmethod
+    def _resolve_message_type(cls, component_class: type) -> Optional[Tuple[str, str]]:
+        entry = cls._message_types.get(component_class)
+        if entry is not None:
+            return entry
+
+        try:
+            return cls._resolved_message_types[component_class]
+        except KeyError:
+            entry = next((cls._message_types[base] for base in component_class.__mro__
+                          if base in cls._message_types), None)
+            cls._resolved_message_types[component_class] = entry
+            return entry
+
     @property
-    def platform(self):
-        return PlatformEnum[self.get('platform')]
+    def platform(self) -> PlatformEnum:
+        return self._platform
 
     @platform.setter
     def platform(self, platform: PlatformEnum):
         self['platform'] = platform.name
+        self._platform = platform
 
     @property
     def message_object(self):
-        for item in self.values():
-            if not isinstance(item, str):
-                return item
+        if self._message_key is None:
+            return None
+        return self.get(self._message_key)
 
     @message_object.setter
     def message_object(self, message_object):
-
-        if isinstance(message_object, Text):
-            self['text'] = message_object
-            self._message_type = 'text'
-
-        elif isinstance(message_object, Image):
-            self['image'] = message_object
-            self._message_type = 'image'
-
-        elif isinstance(message_object, QuickReplies):
-            self['quick_replies'] = message_object
-            self._message_type = 'quick_replies'
-
-        elif isinstance(message_object, Card):
-            self['card'] = message_object
-            self._message_type = 'card'
-
-        elif isinstance(message_object, SimpleResponses):
-            self['simple_responses'] = message_object
-            self._message_type = 'simple_responses'
-
-        elif isinstance(message_object, BasicCard):
-            self['basic_card'] = message_object
-            self._message_type = 'basic_card'
-
-        elif isinstance(message_object, Suggestions):
-            self['suggestions'] = message_object
-            self._message_type = 'suggestions'
-
-        elif isinstance(message_object, LinkOutSuggestion):
-            self['link_out_suggestion'] = message_object
-            self._message_type = 'link_out_suggestion'
-
-        elif isinstance(message_object, ListSelect):
-            self['list_select'] = message_object
-            self._message_type = 'list_select'
-
-        elif isinstance(message_object, CarouselSelect):
-            self['carousel_select'] = message_object
-            self._message_type = 'carousel_select'
-
-        elif isinstance(message_object, BrowseCarouselCard):
-            self['browse_carousel_card'] = message_object
-            self._message_type = 'browse_carousel_card'
-
-        elif isinstance(message_object, TableCard):
-            self['tableCard'] = message_object
-            self._message_type = 'table_card'
-
-        elif isinstance(message_object, MediaContent):
-            self['media_content'] = message_object
-            self._message_type = 'media_content'
-
-        elif isinstance(message_object, Payload):
-            self['payload'] = message_object
-            self._message_type = 'payload'
+        if message_object is None:
+            return
+        entry = self._resolve_message_type(type(message_object))
+        if entry is None:
+            raise TypeError('%s is not a registered message type, see Message.register_message_type'
+                            % type(message_object).__name__)
+
+        key, message_type = entry
+        if self._message_key is not None and self._message_key != key:
+            self.pop(self._message_key, None)
+
+        self[key] = message_object
+        self._message_key = key
+        self._message_type = message_type
 
     @property
     def message_type(self):
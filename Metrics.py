@@ -0,0 +1,384 @@
+import atexit
+import bisect
+import glob
+import json
+import logging
+import math
+import multiprocessing.util
+import os
+import threading
+import weakref
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from DialogFlowPy.Instrumentation import Span, add_span_sink, remove_span_sink
+
+logger = logging.getLogger(__name__)
+
+# worker processes started with spawn or forkserver find the metrics directory here
+METRICS_DIRECTORY_ENV = 'DIALOGFLOWPY_METRICS_DIR'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+LabelValues = Tuple[str, ...]
+
+
+class _Metric(object):
+    """
+    A metric family, one array of values per label combination. Every thread updates a shard of its own, so updates
+    take no lock and never wait for each other, collect() adds the shards up. After a fork the child starts from
+    zero, the parent's values are still counted in the parent.
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 registry: 'MetricsRegistry' = None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._width = 1
+        self._reset()
+        self._registry = registry or get_metrics_registry()
+        self._registry.register(self)
+
+    def _reset(self):
+        self._local = threading.local()
+        self._shards: List[Dict[LabelValues, array]] = []
+        self._shards_lock = threading.Lock()
+
+    def _new_shard(self) -> Dict[LabelValues, array]:
+        shard = self._local.shard = {}
+        with self._shards_lock:
+            self._shards.append(shard)
+        self._registry.start_writer()
+        return shard
+
+    def _values(self, key: LabelValues) -> array:
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = array('d', bytes(8 * self._width))
+        return values
+
+    def labels(self, *label_values: Any) -> '_Child':
+        assert len(label_values) == len(self.label_names), '%s takes the labels %s' % (self.name, self.label_names)
+        return _Child(self, tuple(str(value) for value in label_values))
+
+    def collect(self) -> Dict[LabelValues, List[float]]:
+        """Values per label combination, summed over the shards of every thread"""
+        with self._shards_lock:
+            shards = list(self._shards)
+        totals: Dict[LabelValues, List[float]] = {}
+        for shard in shards:
+            for key, values in list(shard.items()):
+                _add(totals, key, values)
+        return totals
+
+    def samples(self, key: LabelValues, values: List[float]) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        raise NotImplementedError()
+
+
+class _Child(object):
+    """A metric bound to one label combination, keep it around instead of calling labels() on every update"""
+
+    __slots__ = ('_metric', '_key')
+
+    def __init__(self, metric: _Metric, key: LabelValues):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount: float = 1):
+        self._metric.inc(amount, self._key)
+
+    def observe(self, value: float):
+        self._metric.observe(value, self._key)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, key: LabelValues = ()):
+        assert amount >= 0, 'counters only go up'
+        self._values(key)[0] += amount
+
+    def samples(self, key: LabelValues, values: List[float]) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        yield self.name, dict(zip(self.label_names, key)), values[0]
+
+
+class Histogram(_Metric):
+    """Counts observations per bucket, an observation goes to the first bucket whose upper bound is not below it"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: 'MetricsRegistry' = None):
+        assert list(buckets) == sorted(buckets), 'buckets must be sorted'
+        super().__init__(name, documentation, label_names, registry)
+        self.buckets = tuple(float(bucket) for bucket in buckets)
+        # one count per bucket, one for +Inf, then the sum
+        self._width = len(self.buckets) + 2
+
+    def observe(self, value: float, key: LabelValues = ()):
+        values = self._values(key)
+        values[bisect.bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def samples(self, key: LabelValues, values: List[float]) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        labels = dict(zip(self.label_names, key))
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), values):
+            cumulative += count
+            yield self.name + '_bucket', dict(labels, le=_format_value(bound)), cumulative
+        yield self.name + '_sum', labels, values[-1]
+        yield self.name + '_count', labels, cumulative
+
+
+def _add(totals: Dict[LabelValues, List[float]], key: LabelValues, values: Iterable[float]):
+    total = totals.get(key)
+    if total is None:
+        totals[key] = list(values)
+    else:
+        for index, value in enumerate(values):
+            total[index] += value
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return 'NaN'
+    if value == math.inf:
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+_registries: 'weakref.WeakSet[MetricsRegistry]' = weakref.WeakSet()
+
+
+class MetricsRegistry(object):
+    """
+    The metrics exposed together in one Prometheus text page.
+
+    With a metrics directory every process writes its values to <directory>/metrics_<pid>.json, every write_interval
+    seconds and when it exits, and exposition() adds the files of the other processes to the values of its own. That
+    way the page served by the parent also counts what its pool workers did, including workers that have exited
+    since. Set the directory before the workers start and empty it before the server starts, files left over from an
+    earlier run would be counted too.
+    """
+
+    def __init__(self, directory: str = None, write_interval: float = 1.0):
+        self._metrics: Dict[str, _Metric] = {}
+        self._directory = directory
+        self._write_interval = write_interval
+        self._pid = os.getpid()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        self._writer_stopped = threading.Event()
+        self._finalizer = None
+        _registries.add(self)
+
+    @property
+    def directory(self) -> Optional[str]:
+        return self._directory
+
+    def enable_multiprocess(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        os.environ[METRICS_DIRECTORY_ENV] = directory
+        self.start_writer()
+
+    def register(self, metric: _Metric):
+        assert metric.name not in self._metrics, 'metric %s already registered' % metric.name
+        self._metrics[metric.name] = metric
+
+    def unregister(self, metric: _Metric):
+        self._metrics.pop(metric.name, None)
+
+    def __getitem__(self, name: str) -> _Metric:
+        return self._metrics[name]
+
+    def _after_fork(self):
+        self._pid = os.getpid()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._writer_stopped = threading.Event()
+        self._finalizer = None
+        for metric in self._metrics.values():
+            metric._reset()
+
+    # multiprocess
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self._directory, 'metrics_%d.json' % pid)
+
+    def start_writer(self):
+        """Starts the thread writing this process' values, a no-op without a metrics directory"""
+        if self._directory is None or self._writer is not None:
+            return
+        with self._writer_lock:
+            if self._writer is not None:
+                return
+            self._writer_stopped.clear()
+            self._writer = threading.Thread(target=self._write_loop, name='MetricsRegistry writer', daemon=True)
+            self._writer.start()
+        # pool workers leave through multiprocessing, which skips atexit
+        self._finalizer = multiprocessing.util.Finalize(None, self._write_logged, exitpriority=10)
+        atexit.register(self._write_logged)
+
+    def stop_writer(self):
+        """Stops the writer thread and writes this process' values one last time"""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+            if writer is None:
+                return
+            self._writer_stopped.set()
+        writer.join()
+        if self._finalizer is not None:
+            self._finalizer.cancel()
+            self._finalizer = None
+        atexit.unregister(self._write_logged)
+        self._write_logged()
+
+    def close(self):
+        """Stops writing to the metrics directory, the registry can still be read afterwards"""
+        self.stop_writer()
+
+    def _write_loop(self):
+        while not self._writer_stopped.wait(self._write_interval):
+            self._write_logged()
+
+    def _write_logged(self):
+        try:
+            self.write_snapshot()
+        except OSError:
+            logger.exception('writing the metrics of process %d failed', self._pid)
+
+    def write_snapshot(self):
+        if self._directory is None:
+            return
+        snapshot = {name: [[list(key), values] for key, values in metric.collect().items()]
+                    for name, metric in self._metrics.items()}
+        path = self._path(self._pid)
+        temporary = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(temporary, path)
+
+    def _read_snapshots(self) -> Iterable[Dict[str, list]]:
+        own = self._path(self._pid)
+        for path in glob.glob(os.path.join(self._directory, 'metrics_*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                logger.warning('skipping unreadable metrics file %s', path, exc_info=True)
+
+    # exposition
+
+    def collect(self) -> Dict[str, Dict[LabelValues, List[float]]]:
+        """Values of every metric per label combination, of all processes when there is a metrics directory"""
+        collected = {name: metric.collect() for name, metric in self._metrics.items()}
+        if self._directory is not None:
+            for snapshot in self._read_snapshots():
+                for name, series in snapshot.items():
+                    if name in collected:
+                        for key, values in series:
+                            _add(collected[name], tuple(key), values)
+        return collected
+
+    def exposition(self) -> bytes:
+        """The Prometheus text format of every metric"""
+        lines = []
+        for name, series in self.collect().items():
+            metric = self._metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.documentation.replace('\\', r'\\').replace('\n', r'\n')))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+            for key in sorted(series):
+                for sample_name, labels, value in metric.samples(key, series[key]):
+                    if labels:
+                        sample_name += '{%s}' % ','.join('%s="%s"' % (label, _escape(label_value))
+                                                         for label, label_value in labels.items())
+                    lines.append('%s %s' % (sample_name, _format_value(value)))
+        lines.append('')
+        return '\n'.join(lines).encode('utf-8')
+
+
+def _after_fork_in_child():
+    for registry in list(_registries):
+        registry._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+_metrics_registry: MetricsRegistry = None
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """Returns the registry of the built-in metrics, multiprocess when DIALOGFLOWPY_METRICS_DIR is set"""
+    global _metrics_registry
+    if _metrics_registry is None:
+        _metrics_registry = MetricsRegistry(os.environ.get(METRICS_DIRECTORY_ENV))
+    return _metrics_registry
+
+
+# built-in metrics
+
+REQUESTS = Counter('dialogflow_requests_total', 'Webhook requests by action, source platform and response status',
+                   ('action', 'platform', 'status'))
+STAGE_DURATION = Histogram('dialogflow_stage_duration_seconds', 'Time spent per request stage, one per span name',
+                           ('stage',))
+RESPONSE_BYTES = Histogram('dialogflow_response_bytes', 'Encoded response size by the message types it contains',
+                           ('message_type',), buckets=SIZE_BUCKETS)
+FULFILLMENT_MESSAGES = Histogram('dialogflow_fulfillment_messages', 'fulfillmentMessages per response',
+                                 buckets=COUNT_BUCKETS)
+CACHE_LOOKUPS = Counter('dialogflow_cache_lookups_total', 'Cache lookups by cache and result, hit or miss, the hit '
+                                                          'ratio is the rate of hits over the rate of all lookups',
+                        ('cache', 'result'))
+
+_stage_children: Dict[str, _Child] = {}
+
+
+def record_span(ended_span: Span):
+    """
+    Span sink feeding the built-in metrics: the duration of every span, the requests from webhook.request spans and
+    the response size and message count from the spans that encoded a response
+    """
+    stage = _stage_children.get(ended_span.name)
+    if stage is None:
+        stage = _stage_children[ended_span.name] = STAGE_DURATION.labels(ended_span.name)
+    stage.observe(ended_span.duration)
+
+    attributes = ended_span.attributes
+    if ended_span.name == 'webhook.request':
+        REQUESTS.inc(1, (str(attributes.get('action') or ''), str(attributes.get('platform') or 'unknown'),
+                         str(attributes.get('status', ''))))
+    elif 'message_types' in attributes and 'bytes' in attributes:
+        size = attributes['bytes']
+        for message_type in set(attributes['message_types'].split(',')) - {''} or ('none',):
+            RESPONSE_BYTES.observe(size, (message_type,))
+        FULFILLMENT_MESSAGES.observe(attributes.get('message_count', 0))
+
+
+def install_span_metrics():
+    """Registers record_span as a span sink, once"""
+    remove_span_sink(record_span)
+    add_span_sink(record_span)
+
+
+def uninstall_span_metrics():
+    remove_span_sink(record_span)
@@ -0,0 +1,124 @@
+import copy
+from typing import Dict, Iterable, List, Optional
+
+from DialogFlowPy.Context import Context
+
+
+class OutputContexts(list):
+    """
+    Contexts of the response kept in insertion order and indexed by name.
+
+    It is still a list of Context, so the response serializes to the same json array as before, but looking up,
+    adding, updating and expiring a context goes through the name index, which keeps the position of every context,
+    in constant time. The regular list methods keep the index in sync.
+    """
+
+    def __init__(self, contexts: Iterable[Context] = ()):
+        super().__init__()
+        self._index: Dict[str, int] = {}
+        self.extend(contexts)
+
+    def __reduce_ex__(self, protocol):
+        # the default list pickling appends the items before the index exists, rebuild it through __init__ instead
+        return self.__class__, (list(self),)
+
+    def __deepcopy__(self, memo: dict) -> 'OutputContexts':
+        copied = self.__class__()
+        memo[id(self)] = copied
+        copied.extend(copy.deepcopy(context, memo) for context in self)
+        return copied
+
+    def get_context(self, name: str) -> Optional[Context]:
+        position = self._index.get(name)
+        return self[position] if position is not None else None
+
+    def has_context(self, name: str) -> bool:
+        return name in self._index
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._index)
+
+    def set_context(self, name: str, lifespan_count: int = 0, **parameters) -> Context:
+        """Adds the context, or updates the lifespan and parameters of the one already in the response"""
+        context = self.get_context(name)
+        if context is None:
+            context = Context(name=name, lifespan_count=lifespan_count, **parameters)
+            self._index[name] = len(self)
+            super().append(context)
+        else:
+            context.lifespan_count = lifespan_count
+            context.update_parameters(**parameters)
+        return context
+
+    def set_contexts(self, contexts: Iterable[Context]) -> 'OutputContexts':
+        """Adds every context, replacing the ones with the same name in place"""
+        for context in contexts:
+            self.append(context)
+        return self
+
+    def expire_contexts(self, names: Iterable[str]) -> 'OutputContexts':
+        """Sends the contexts with a lifespan of 0, which makes Dialogflow drop them from the session"""
+        for name in names:
+            self.set_context(name, lifespan_count=0)
+        return self
+
+    def remove_contexts(self, names: Iterable[str]) -> 'OutputContexts':
+        """Takes the contexts out of the response in a single pass"""
+        removed = {name for name in names if name in self._index}
+        if removed:
+            super().__setitem__(slice(None), [context for context in self if context.name not in removed])
+            self._reindex()
+        return self
+
+    # list methods, kept consistent with the index
+
+    def append(self, context: Context):
+        assert isinstance(context, Context)
+
+        position = self._index.get(context.name)
+        if position is not None:
+            super().__setitem__(position, context)
+        else:
+            self._index[context.name] = len(self)
+            super().append(context)
+
+    def extend(self, contexts: Iterable[Context]):
+        for context in contexts:
+            self.append(context)
+
+    def __iadd__(self, contexts: Iterable[Context]):
+        self.extend(contexts)
+        return self
+
+    def insert(self, position: int, context: Context):
+        assert isinstance(context, Context)
+
+        if context.name in self._index:
+            self.remove_contexts([context.name])
+        super().insert(position, context)
+        self._reindex()
+
+    def remove(self, context: Context):
+        super().remove(context)
+        self._reindex()
+
+    def pop(self, position: int = -1) -> Context:
+        context = super().pop(position)
+        self._reindex()
+        return context
+
+    def clear(self):
+        super().clear()
+        self._index.clear()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._reindex()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._reindex()
+
+    def _reindex(self):
+        self._index = {context.name: position for position, context in enumerate(self)}
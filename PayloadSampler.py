@@ -0,0 +1,49 @@
+import itertools
+import logging
+
+payload_logger = logging.getLogger('DialogFlowPy.payloads')
+
+
+class PayloadSampler(object):
+    """
+    Picks 1 in every_n requests whose full request and response payloads are dumped to the DialogFlowPy.payloads
+    logger at the given level, independently of the DEBUG level of the rest of the package. every_n = 0 disables
+    sampling, which is the default.
+    """
+
+    def __init__(self, every_n: int = 0, level: int = logging.INFO):
+        assert isinstance(every_n, int) and every_n >= 0
+
+        self._every_n = every_n
+        self._level = level
+        self._counter = itertools.count(1)
+
+    @property
+    def every_n(self) -> int:
+        return self._every_n
+
+    @property
+    def level(self) -> int:
+        return self._level
+
+    def sample(self) -> bool:
+        if not self._every_n:
+            return False
+        return next(self._counter) % self._every_n == 0 and payload_logger.isEnabledFor(self._level)
+
+    def dump(self, label: str, payload):
+        payload_logger.log(self._level, '%s: %s', label, payload)
+
+
+_payload_sampler = PayloadSampler()
+
+
+def get_payload_sampler() -> PayloadSampler:
+    return _payload_sampler
+
+
+def set_payload_sample_rate(every_n: int, level: int = logging.INFO) -> PayloadSampler:
+    """Dumps the full payloads of 1 in every_n requests, 0 turns sampling off"""
+    global _payload_sampler
+    _payload_sampler = PayloadSampler(every_n=every_n, level=level)
+    return _payload_sampler
@@ -0,0 +1,192 @@
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from DialogFlowPy.DialogFlow import DialogFlow
+from DialogFlowPy.ResponseBudget import ResponseLimits
+from DialogFlowPy.SessionStore import SessionState
+
+logger = logging.getLogger(__name__)
+
+# (request json, create_payload_object, verified user claims, budget limits, session state)
+Snapshot = Tuple[dict, bool, Optional[dict], Optional[ResponseLimits], dict]
+
+
+def process_bound(handler: Callable[[DialogFlow], Any]) -> Callable[[DialogFlow], Any]:
+    """
+    Marks a handler as CPU bound, Router and WebhookApp run it in the shared ProcessPoolRunner instead of the event
+    loop. The handler itself is returned unchanged, so it has to be a module level function the workers can import,
+    and a direct call still runs it in process.
+    """
+    handler.process_bound = True
+    return handler
+
+
+def is_process_bound(handler: Callable) -> bool:
+    return getattr(handler, 'process_bound', False) is True
+
+
+def snapshot(dialog_flow: DialogFlow) -> Snapshot:
+    """
+    The part of the request a handler works from: session, action, parameters, intent, contexts and the user's
+    userStorage, plus the session state. Everything else of the request stays in the parent, the idToken is replaced
+    by its verified claims, verifying it here when that has not happened yet. The session store is only used by the
+    parent, workers get and return the state itself.
+    """
+    request = dialog_flow.request
+    query_result = request.query_result
+    user = request.user
+    intent = query_result.intent
+
+    request_data_json = {
+        'session': request.session,
+        'queryResult': {
+            'queryText': query_result.query_text,
+            'action': query_result.action,
+            'parameters': dict(query_result.parameters),
+            'intent': {'name': intent.name, 'displayName': intent.display_name},
+            'outputContexts': query_result.output_contexts,
+            'languageCode': query_result.language_code,
+        },
+    }
+    if request.has_user:
+        request_data_json['originalDetectIntentRequest'] = {'payload': {'user': {
+            'userId': user.user_id,
+            'locale': user.locale,
+            'userVerificationStatus': user.user_verification_status,
+            'userStorage': request.payload['user'].get('userStorage'),
+        }}}
+
+    budget = dialog_flow.budget
+    return (request_data_json, dialog_flow.create_payload_object, dialog_flow.user_claims,
+            budget.limits if budget is not None else None, dialog_flow.session_state.data)
+
+
+def _run_in_worker(handler: Callable[[DialogFlow], Any], request_snapshot: Snapshot) -> Tuple[dict, Optional[dict]]:
+    """Returns the response keys of the DialogFlow, and the session state if the handler changed it"""
+    request_data_json, create_payload_object, user_claims, limits, session_state = request_snapshot
+    dialog_flow = DialogFlow(request_data_json, version='v2', create_payload_object=create_payload_object)
+    dialog_flow._user_claims = user_claims
+    dialog_flow._session_state = state = SessionState(session_state)
+    if limits is not None:
+        dialog_flow.enable_budget(limits)
+
+    result = handler(dialog_flow)
+    if inspect.isawaitable(result):
+        result = asyncio.run(result)
+    if isinstance(result, DialogFlow):
+        dialog_flow = result
+    return dict(dialog_flow), state.data if state.changed else None
+
+
+def _warm_up(_=None) -> int:
+    return os.getpid()
+
+
+class ProcessPoolRunner(object):
+    """
+    Runs process bound handlers in a pool of worker processes. The request goes over as a compact snapshot, the
+    worker builds the whole response and its keys come back pickled, replacing the response of the caller's
+    DialogFlow, so middlewares running after the handler and the response cache see it as if the handler had run in
+    process. start() forks the workers ahead of the first request,
+    WebhookApp(on_startup=[runner.start], on_shutdown=[runner.shutdown]).
+    """
+
+    def __init__(self, max_workers: int = None, mp_context=None):
+        self._max_workers = max_workers or os.cpu_count() or 1
+        self._mp_context = mp_context
+        self._executor: Optional[Executor] = None
+
+    @property
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers,
+                                                 mp_context=self._mp_context or multiprocessing.get_context())
+        return self._executor
+
+    def start(self):
+        """Starts every worker now, instead of on the first requests"""
+        pids = set(self.executor.map(_warm_up, range(self._max_workers * 2)))
+        logger.debug('process pool started with workers %s', sorted(pids))
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    @staticmethod
+    def _apply(dialog_flow: DialogFlow, result: Tuple[dict, Optional[dict]]) -> DialogFlow:
+        response, session_state = result
+        dialog_flow.clear()
+        dialog_flow.update(response)
+        if session_state is not None:
+            dialog_flow.session_state.replace(session_state)
+        return dialog_flow
+
+    def run_sync(self, handler: Callable[[DialogFlow], Any], dialog_flow: DialogFlow) -> DialogFlow:
+        return self._apply(dialog_flow, self.executor.submit(_run_in_worker, handler, snapshot(dialog_flow)).result())
+
+    async def run(self, handler: Callable[[DialogFlow], Any], dialog_flow: DialogFlow) -> DialogFlow:
+        loop = asyncio.get_running_loop()
+        if dialog_flow._session_state is None or dialog_flow._user_claims is None:
+            # loading the session state and verifying the idToken must not block the event loop
+            request_snapshot = await loop.run_in_executor(None, snapshot, dialog_flow)
+        else:
+            request_snapshot = snapshot(dialog_flow)
+        result = await loop.run_in_executor(self.executor, _run_in_worker, handler, request_snapshot)
+        return self._apply(dialog_flow, result)
+
+
+class InlineRunner(ProcessPoolRunner):
+    """Runs process bound handlers right in the calling process, for code already running in a worker"""
+
+    def __init__(self):
+        super().__init__(max_workers=1)
+
+    def start(self):
+        pass
+
+    def run_sync(self, handler: Callable[[DialogFlow], Any], dialog_flow: DialogFlow) -> DialogFlow:
+        result = handler(dialog_flow)
+        if inspect.isawaitable(result):
+            result = asyncio.run(result)
+        return result if isinstance(result, DialogFlow) else dialog_flow
+
+    async def run(self, handler: Callable[[DialogFlow], Any], dialog_flow: DialogFlow) -> DialogFlow:
+        result = handler(dialog_flow)
+        if inspect.isawaitable(result):
+            result = await result
+        return result if isinstance(result, DialogFlow) else dialog_flow
+
+
+def offload(handler: Callable[[DialogFlow], Any]) -> Callable[[DialogFlow], Any]:
+    """Coroutine function running the process bound handler in the shared runner"""
+    async def offloaded(dialog_flow: DialogFlow) -> DialogFlow:
+        return await get_process_runner().run(handler, dialog_flow)
+
+    return offloaded
+
+
+_process_runner: ProcessPoolRunner = None
+
+
+def get_process_runner() -> ProcessPoolRunner:
+    global _process_runner
+    if _process_runner is None:
+        _process_runner = ProcessPoolRunner()
+    return _process_runner
+
+
+def set_process_runner(process_runner: ProcessPoolRunner) -> ProcessPoolRunner:
+    global _process_runner
+    assert process_runner is None or isinstance(process_runner, ProcessPoolRunner)
+    _process_runner = process_runner
+    return process_runner
@@ -0,0 +1,343 @@
+import copy
+import logging
+import re
+from collections import Counter, namedtuple
+from typing import Any, Dict, List, Optional, Tuple
+
+from DialogFlowPy.JsonEncoder import JsonEncoder, get_json_encoder
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+# message types that carry the answer itself, never dropped to make a response fit
+_ESSENTIAL_MESSAGE_TYPES = frozenset(('text', 'simple_responses', 'payload'))
+
+BudgetChange = namedtuple('BudgetChange', ('target', 'action', 'detail'))
+
+
+class ResponseTooLarge(ValueError):
+    """Raised when a response is still over max_response_bytes after every optional message was dropped"""
+
+
+class ResponseLimits(object):
+    """
+    Limits Actions on Google and Dialogflow enforce on a response, None disables a limit. Texts are measured in
+    characters, userStorage and the whole response in encoded bytes.
+    """
+
+    def __init__(self, max_text_length: Optional[int] = 640, max_simple_responses: Optional[int] = 2,
+                 max_suggestions: Optional[int] = 8, max_suggestion_title_length: Optional[int] = 25,
+                 max_carousel_items: Optional[int] = 10, max_list_items: Optional[int] = 30,
+                 max_browse_carousel_items: Optional[int] = 10, max_user_storage_bytes: Optional[int] = 10000,
+                 max_response_bytes: Optional[int] = 64 * 1024, ellipsis: str = '…'):
+        self.max_text_length = max_text_length
+        self.max_simple_responses = max_simple_responses
+        self.max_suggestions = max_suggestions
+        self.max_suggestion_title_length = max_suggestion_title_length
+        self.max_carousel_items = max_carousel_items
+        self.max_list_items = max_list_items
+        self.max_browse_carousel_items = max_browse_carousel_items
+        self.max_user_storage_bytes = max_user_storage_bytes
+        self.max_response_bytes = max_response_bytes
+        self.ellipsis = ellipsis
+
+
+class BudgetReport(object):
+    """What enforcing the budget changed, and the encoded response it produced"""
+
+    def __init__(self):
+        self.changes: List[BudgetChange] = []
+        self.data: bytes = None
+
+    @property
+    def size(self) -> int:
+        return len(self.data) if self.data is not None else 0
+
+    def add(self, target: str, action: str, detail: Any = None):
+        self.changes.append(BudgetChange(target, action, detail))
+
+    def __bool__(self):
+        return bool(self.changes)
+
+    def __repr__(self):
+        return 'BudgetReport(size=%d, changes=%r)' % (self.size, self.changes)
+
+
+def truncate_text(text: str, max_length: int, ellipsis: str = '…') -> str:
+    """Cuts text to max_length characters, at the last word boundary when there is one in the second half"""
+    if text is None or len(text) <= max_length:
+        return text
+
+    cut = text[:max(max_length - len(ellipsis), 0)]
+    space = cut.rfind(' ')
+    if space > max_length // 2:
+        cut = cut[:space]
+    return cut.rstrip() + ellipsis
+
+
+def split_text(text: str, max_length: int) -> List[str]:
+    """Splits text into parts of at most max_length characters, between sentences where possible, else between words"""
+    parts, current = [], ''
+    for sentence in _SENTENCE_END.split(text):
+        words = [sentence] if len(sentence) <= max_length else sentence.split(' ')
+        for word in words:
+            while len(word) > max_length:
+                if current:
+                    parts.append(current)
+                    current = ''
+                parts.append(word[:max_length])
+                word = word[max_length:]
+
+            candidate = current + ' ' + word if current else word
+            if len(candidate) <= max_length:
+                current = candidate
+            else:
+                parts.append(current)
+                current = word
+
+    if current:
+        parts.append(current)
+    return parts
+
+
+class ResponseBudget(object):
+    """
+    Keeps a response inside ResponseLimits. Messages are counted and measured as they are added, so estimated_size
+    follows the response while it is built. enforce() then makes one pass over the messages and the google payload,
+    truncating texts, splitting simple responses, capping item lists and dropping an oversized userStorage, and
+    finally drops optional messages from the end, picked by their measured size, while the encoded response is still
+    too large. Every change is written to the returned BudgetReport.
+    """
+
+    def __init__(self, limits: ResponseLimits = None):
+        self.limits = limits or ResponseLimits()
+        self.counts = Counter()
+        self.estimated_size = 0
+        # id(message) -> (message, message_type, encoded size), holding the message keeps its id from being reused
+        self._sizes: Dict[int, Tuple[Any, str, int]] = {}
+
+    def track(self, message, encoder: JsonEncoder = None) -> int:
+        """
+        Measures a message added to the response, or measures it again after it changed. Returns its encoded size.
+        """
+        size = len((encoder or get_json_encoder()).encode(message))
+        self.untrack(message)
+        self._sizes[id(message)] = (message, message.message_type, size)
+        self.counts[message.message_type] += 1
+        # the message and the comma separating it from its neighbour
+        self.estimated_size += size + 1
+        return size
+
+    def untrack(self, message):
+        entry = self._sizes.pop(id(message), None)
+        if entry is not None:
+            self.counts[entry[1]] -= 1
+            self.estimated_size -= entry[2] + 1
+
+    def reset(self):
+        self.counts.clear()
+        self.estimated_size = 0
+        self._sizes.clear()
+
+    def _sync(self, messages: list, encoder: JsonEncoder):
+        """Forgets the messages removed since they were tracked, measures the ones added without going through track"""
+        present = {id(message) for message in messages}
+        for message, _, _ in [entry for key, entry in self._sizes.items() if key not in present]:
+            self.untrack(message)
+        for message in messages:
+            if id(message) not in self._sizes:
+                self.track(message, encoder)
+
+    # texts
+
+    def _truncate(self, text: str, target: str, report: BudgetReport) -> str:
+        max_length = self.limits.max_text_length
+        if max_length is None or not isinstance(text, str) or len(text) <= max_length:
+            return text
+        report.add(target, 'truncated', len(text))
+        return truncate_text(text, max_length, self.limits.ellipsis)
+
+    def _cap(self, items: list, max_items: Optional[int], target: str, report: BudgetReport):
+        if max_items is not None and items is not None and len(items) > max_items:
+            report.add(target, 'capped', len(items))
+            del items[max_items:]
+
+    def _fit_simple_responses(self, responses: list, target: str, report: BudgetReport) -> list:
+        """Splits every simple response longer than max_text_length into several, at most max_simple_responses"""
+        limits = self.limits
+        if not responses:
+            return responses
+
+        fitted = []
+        for response in responses:
+            text = response.get('textToSpeech')
+            long_text = limits.max_text_length is not None and isinstance(text, str) and \
+                len(text) > limits.max_text_length
+            if not long_text or response.get('ssml'):
+                # ssml cannot be split safely, its display text is truncated like any other text
+                if response.get('displayText'):
+                    response['displayText'] = self._truncate(response['displayText'], target, report)
+                fitted.append(response)
+                continue
+
+            report.add(target, 'split', len(text))
+            for part in split_text(text, limits.max_text_length):
+                piece = copy.copy(response)
+                piece['textToSpeech'] = part
+                if piece.get('displayText'):
+                    piece['displayText'] = part
+                fitted.append(piece)
+
+        max_responses = limits.max_simple_responses
+        if max_responses is not None and len(fitted) > max_responses:
+            report.add(target, 'merged', len(fitted))
+            last = fitted[max_responses - 1]
+            rest = ' '.join(response.get('textToSpeech') or '' for response in fitted[max_responses - 1:])
+            last['textToSpeech'] = truncate_text(rest, limits.max_text_length or len(rest), limits.ellipsis)
+            if last.get('displayText'):
+                last['displayText'] = last['textToSpeech']
+            del fitted[max_responses:]
+
+        return fitted
+
+    def _fit_suggestions(self, suggestions: list, target: str, report: BudgetReport):
+        limits = self.limits
+        if not suggestions:
+            return
+        self._cap(suggestions, limits.max_suggestions, target, report)
+        if limits.max_suggestion_title_length is None:
+            return
+        for suggestion in suggestions:
+            title = suggestion.get('title')
+            if isinstance(title, str) and len(title) > limits.max_suggestion_title_length:
+                report.add(target, 'truncated', title)
+                suggestion['title'] = truncate_text(title, limits.max_suggestion_title_length, limits.ellipsis)
+
+    # messages
+
+    def _fit_message(self, message, report: BudgetReport):
+        limits = self.limits
+        component = message.message_object
+        message_type = message.message_type
+        target = '%s.%s' % (message.platform.name if message.platform else None, message_type)
+
+        if message_type == 'text':
+            component['text'] = [self._truncate(text, target, report) for text in component.get('text') or []]
+        elif message_type == 'simple_responses':
+            component.simple_responses = self._fit_simple_responses(component.simple_responses, target, report)
+        elif message_type == 'suggestions':
+            self._fit_suggestions(component.get('suggestions'), target, report)
+        elif message_type == 'carousel_select':
+            self._cap(component.get('items'), limits.max_carousel_items, target, report)
+        elif message_type == 'list_select':
+            self._cap(component.get('items'), limits.max_list_items, target, report)
+        elif message_type == 'browse_carousel_card':
+            self._cap(component.get('items'), limits.max_browse_carousel_items, target, report)
+        elif message_type == 'payload':
+            self._fit_google_payload(component.get('google'), report)
+
+    def _fit_google_payload(self, google_payload, report: BudgetReport):
+        if not google_payload:
+            return
+        limits = self.limits
+
+        rich_response = google_payload.get('richResponse')
+        if rich_response:
+            items = rich_response.get('items') or []
+            responses = [item['simpleResponse'] for item in items if 'simpleResponse' in item]
+            fitted = self._fit_simple_responses(responses, 'payload.simpleResponse', report)
+            if len(fitted) != len(responses) or any(new is not old for new, old in zip(fitted, responses)):
+                # the fitted simple responses take the place of the first original one
+                rebuilt, placed = [], False
+                for item in items:
+                    if 'simpleResponse' not in item:
+                        rebuilt.append(item)
+                    elif not placed:
+                        rebuilt.extend({'simpleResponse': response} for response in fitted)
+                        placed = True
+                items[:] = rebuilt
+
+            for item in items:
+                carousel = item.get('carouselBrowse')
+                if carousel:
+                    self._cap(carousel.get('items'), limits.max_browse_carousel_items, 'payload.carouselBrowse',
+                              report)
+
+            self._fit_suggestions(rich_response.get('suggestions'), 'payload.suggestions', report)
+
+        user_storage = google_payload.get('userStorage')
+        if limits.max_user_storage_bytes is not None and isinstance(user_storage, str) and \
+                len(user_storage.encode('utf-8')) > limits.max_user_storage_bytes:
+            report.add('payload.userStorage', 'dropped', len(user_storage.encode('utf-8')))
+            logger.warning('userStorage of %d bytes dropped from the response', len(user_storage.encode('utf-8')))
+            google_payload['userStorage'] = ''
+
+    def _fit_size(self, response, encoder: JsonEncoder, report: BudgetReport):
+        max_bytes = self.limits.max_response_bytes
+        data = encoder.encode(response)
+        if max_bytes is None or len(data) <= max_bytes:
+            report.data = data
+            return
+
+        messages = response.get('fulfillmentMessages') or []
+        while len(data) > max_bytes:
+            if all(self.counts[message_type] <= 0 for message_type in self.counts
+                   if message_type not in _ESSENTIAL_MESSAGE_TYPES):
+                raise ResponseTooLarge('response of %d bytes is over the %d bytes limit' % (len(data), max_bytes))
+
+            # picked by their tracked sizes, without encoding the candidates again
+            size, dropped = len(data), []
+            for message in reversed(list(messages)):
+                if size <= max_bytes:
+                    break
+                if message.message_type in _ESSENTIAL_MESSAGE_TYPES:
+                    continue
+                message_size = self._sizes[id(message)][2]
+                size -= message_size + 1
+                dropped.append((message, message_size))
+            if size > max_bytes:
+                # nothing is dropped from a response that would not fit anyway
+                raise ResponseTooLarge('response of %d bytes is over the %d bytes limit without its optional '
+                                       'messages' % (size, max_bytes))
+
+            for message, message_size in dropped:
+                del messages[next(position for position, other in enumerate(messages) if other is message)]
+                self.untrack(message)
+                report.add('%s.%s' % (message.platform.name, message.message_type), 'dropped', message_size)
+
+            data = encoder.encode(response)
+            if len(data) > max_bytes:
+                # a message changed after it was measured, measure the remaining ones again before the next round
+                for message in messages:
+                    self.track(message, encoder)
+        report.data = data
+
+    def enforce(self, response, encoder: JsonEncoder = None) -> BudgetReport:
+        """
+        Brings the response inside the limits, in place, returns the report with the encoded response. When the
+        measured sizes show that even the essential messages are over max_response_bytes it raises ResponseTooLarge
+        before dropping any message, the texts already truncated and the lists already capped stay that way.
+        """
+        report = BudgetReport()
+        encoder = encoder or get_json_encoder()
+
+        if response.get('fulfillmentText'):
+            response['fulfillmentText'] = self._truncate(response['fulfillmentText'], 'fulfillmentText', report)
+        messages = response.get('fulfillmentMessages') or []
+        self._sync(messages, encoder)
+        for message in messages:
+            changes = len(report.changes)
+            self._fit_message(message, report)
+            if len(report.changes) != changes:
+                self.track(message, encoder)
+        payload = response.get('payload')
+        # the payload is usually also one of the messages, it is only fitted once
+        if payload and not any(message.message_object is payload for message in messages):
+            self._fit_google_payload(payload.get('google'), report)
+
+        self._fit_size(response, encoder, report)
+
+        if report:
+            logger.debug('response budget changes: %s', report.changes)
+        return report
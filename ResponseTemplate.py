@@ -0,0 +1,84 @@
+import json
+import re
+import uuid
+from typing import Any, List, Tuple
+
+from DialogFlowPy.JsonEncoder import JsonEncoder, get_json_encoder
+
+# random per process, so the markers can never collide with real response text
+_TOKEN = uuid.uuid4().hex
+
+
+class Slot(str):
+    """
+    Named placeholder that can be passed to any builder helper in place of a string. A slot standing for a whole json
+    value can be rendered with any json value, a slot concatenated into a longer string is rendered as text.
+    """
+
+    def __new__(cls, name: str):
+        assert name.isascii() and name.isidentifier(), 'slot names must be ascii identifiers'
+
+        slot = super().__new__(cls, '{{slot:%s:%s}}' % (_TOKEN, name))
+        slot.name = name
+        return slot
+
+
+_SLOT_PATTERN = re.compile(rb'("?)\{\{slot:' + _TOKEN.encode('ascii') + rb':(\w+)\}\}("?)')
+
+
+class ResponseTemplate(object):
+    """
+    Response compiled once into pre-serialized json fragments around its slots.
+
+    Build the response a single time with Slot placeholders (a DialogFlow created from an empty request works), wrap it
+    in a ResponseTemplate and call render() per request. Rendering only encodes the slot values and joins bytes, no
+    component objects are built and the static parts are never serialized again.
+
+        dialog_flow = DialogFlow({})
+        dialog_flow.add_card(platform, title=Slot('title'), subtitle='Today', image_uri=LOGO_URI)
+        template = ResponseTemplate(dialog_flow)
+        template.render(title='Weather in Paris')
+    """
+
+    def __init__(self, response: Any, encoder: JsonEncoder = None):
+        self._encoder = encoder or get_json_encoder()
+        self._fragments: List[bytes] = []
+        self._slots: List[Tuple[str, bool]] = []
+
+        encoded = self._encoder.encode(response)
+        position = 0
+        for match in _SLOT_PATTERN.finditer(encoded):
+            opening_quote, name, closing_quote = match.group(1), match.group(2), match.group(3)
+            whole_value = bool(opening_quote and closing_quote)
+
+            # quotes that belong to a surrounding string stay part of the static fragments
+            start = match.start() if whole_value else match.start() + len(opening_quote)
+            end = match.end() if whole_value else match.end() - len(closing_quote)
+
+            self._fragments.append(encoded[position:start])
+            self._slots.append((name.decode('ascii'), whole_value))
+            position = end
+
+        self._fragments.append(encoded[position:])
+
+    @property
+    def slot_names(self) -> List[str]:
+        return list(dict.fromkeys(name for name, _ in self._slots))
+
+    def _encode_value(self, value: Any, whole_value: bool) -> bytes:
+        if whole_value:
+            return self._encoder.encode(value)
+        # the value lands inside an existing json string, escape it without the surrounding quotes
+        return json.dumps(str(value), ensure_ascii=False)[1:-1].encode('utf-8')
+
+    def render(self, **values) -> bytes:
+        """Returns the encoded response with every slot replaced by its escaped value"""
+        fragments = self._fragments
+        parts = [fragments[0]]
+        for position, (name, whole_value) in enumerate(self._slots, 1):
+            if name not in values:
+                raise KeyError('no value given for slot %s' % name)
+            parts.append(self._encode_value(values[name], whole_value))
+            parts.append(fragments[position])
+
+        return b''.join(parts)
@@ -0,0 +1,258 @@
+import copy
+import inspect
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from DialogFlowPy.DialogFlow import DialogFlow, normalize_action
+from DialogFlowPy.Metrics import CACHE_LOOKUPS
+from DialogFlowPy.ProcessOffload import is_process_bound, offload
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[DialogFlow], Any]
+Next = Callable[[DialogFlow], Awaitable]
+Middleware = Callable[[DialogFlow, Next], Awaitable]
+
+_ACTION, _INTENT, _CONTEXT = 'action', 'intent', 'context'
+
+
+class NoRoute(LookupError):
+    """Raised when a request matches no route and the router has no fallback"""
+
+
+def _as_coroutine_function(handler: Handler) -> Callable[[DialogFlow], Awaitable]:
+    if inspect.iscoroutinefunction(handler):
+        return handler
+
+    async def call(dialog_flow: DialogFlow):
+        return handler(dialog_flow)
+
+    return call
+
+
+def _compose(handler: Handler, middlewares: Iterable[Middleware]) -> Callable[[DialogFlow], Awaitable]:
+    """
+    Wraps the handler in the middlewares once, the first middleware is the outermost. Process bound handlers run in
+    the shared ProcessPoolRunner, their middlewares still run in process.
+    """
+    call = offload(handler) if is_process_bound(handler) else _as_coroutine_function(handler)
+    for middleware in reversed(list(middlewares)):
+        def link(dialog_flow: DialogFlow, middleware=middleware, call_next=call):
+            return middleware(dialog_flow, call_next)
+        call = link
+    return call
+
+
+class _DispatchTable(object):
+    __slots__ = ('actions', 'intents', 'contexts', 'fallback')
+
+    def __init__(self):
+        self.actions: Dict[str, Callable] = {}
+        self.intents: Dict[str, Callable] = {}
+        # context name -> (priority, chain), the context registered first wins when several are present
+        self.contexts: Dict[str, Tuple[int, Callable]] = {}
+        self.fallback: Optional[Callable] = None
+
+
+class Router(object):
+    """
+    Dispatches a DialogFlow to the handler registered for its action, else its intent display name, else one of its
+    incoming contexts, else the fallback. Handlers may be plain or coroutine functions.
+
+    Middlewares are coroutine functions middleware(dialog_flow, call_next), those given to use() wrap every route,
+    the ones given with a route only wrap that route. compile(), run on the first request unless called earlier,
+    builds one dict per kind of route with every handler already wrapped in its middlewares, so a request costs a
+    few dict lookups however many routes there are. The router is itself a handler for WebhookApp.
+    """
+
+    def __init__(self):
+        self._routes: List[Tuple[str, str, Handler, Tuple[Middleware, ...]]] = []
+        self._middlewares: List[Middleware] = []
+        self._fallback: Optional[Tuple[Handler, Tuple[Middleware, ...]]] = None
+        self._table: Optional[_DispatchTable] = None
+
+    # registration
+
+    def use(self, middleware: Middleware) -> Middleware:
+        assert inspect.iscoroutinefunction(middleware) or inspect.iscoroutinefunction(
+            getattr(middleware, '__call__', None)), 'middlewares must be coroutine functions'
+        self._middlewares.append(middleware)
+        self._table = None
+        return middleware
+
+    def add_route(self, kind: str, key: str, handler: Handler, middlewares: Iterable[Middleware] = ()):
+        assert kind in (_ACTION, _INTENT, _CONTEXT)
+        assert isinstance(key, str) and callable(handler)
+        if kind == _ACTION:
+            key = normalize_action(key)
+        self._routes.append((kind, key, handler, tuple(middlewares)))
+        self._table = None
+
+    def _decorator(self, kind: str, keys: Tuple[str, ...], middlewares: Iterable[Middleware]):
+        middlewares = tuple(middlewares)
+
+        def register(handler: Handler) -> Handler:
+            for key in keys:
+                self.add_route(kind, key, handler, middlewares)
+            return handler
+
+        return register
+
+    def on_action(self, *actions: str, middlewares: Iterable[Middleware] = ()):
+        """Decorator registering a handler for actions, 'input.welcome' and 'welcome' are the same action"""
+        return self._decorator(_ACTION, actions, middlewares)
+
+    def on_intent(self, *display_names: str, middlewares: Iterable[Middleware] = ()):
+        return self._decorator(_INTENT, display_names, middlewares)
+
+    def on_context(self, *context_names: str, middlewares: Iterable[Middleware] = ()):
+        """Decorator registering a handler for incoming contexts, by short name"""
+        return self._decorator(_CONTEXT, context_names, middlewares)
+
+    def fallback(self, handler: Handler = None, middlewares: Iterable[Middleware] = ()):
+        """Registers the handler for requests no route matches, usable as a decorator"""
+        def register(handler: Handler) -> Handler:
+            self._fallback = (handler, tuple(middlewares))
+            self._table = None
+            return handler
+
+        return register(handler) if handler is not None else register
+
+    # dispatch
+
+    def compile(self) -> _DispatchTable:
+        table = _DispatchTable()
+        tables = {_ACTION: table.actions, _INTENT: table.intents}
+        for priority, (kind, key, handler, middlewares) in enumerate(self._routes):
+            chain = _compose(handler, self._middlewares + list(middlewares))
+            if kind == _CONTEXT:
+                table.contexts.setdefault(key, (priority, chain))
+            elif key in tables[kind]:
+                logger.warning('%s %s already has a handler, %s is ignored', kind, key, handler)
+            else:
+                tables[kind][key] = chain
+
+        if self._fallback is not None:
+            handler, middlewares = self._fallback
+            table.fallback = _compose(handler, self._middlewares + list(middlewares))
+
+        self._table = table
+        return table
+
+    def resolve(self, dialog_flow: DialogFlow) -> Optional[Callable[[DialogFlow], Awaitable]]:
+        """The compiled chain handling this request, None if there is none"""
+        table = self._table or self.compile()
+
+        chain = table.actions.get(dialog_flow.action)
+        if chain is not None:
+            return chain
+
+        if table.intents:
+            chain = table.intents.get(dialog_flow.request.query_result.intent.display_name)
+            if chain is not None:
+                return chain
+
+        if table.contexts:
+            # walks the request's few contexts, not the registered ones
+            matches = [table.contexts[name] for name in dialog_flow.incoming_contexts if name in table.contexts]
+            if matches:
+                return min(matches, key=lambda match: match[0])[1]
+
+        return table.fallback
+
+    async def __call__(self, dialog_flow: DialogFlow) -> Any:
+        chain = self.resolve(dialog_flow)
+        if chain is None:
+            raise NoRoute('no handler for action %s' % dialog_flow.action)
+        return await chain(dialog_flow)
+
+
+# built-in middlewares
+
+def timing(record: Callable[[str, float], Any] = None) -> Middleware:
+    """Measures the rest of the chain, record(action, seconds) is called after every request, logged if None"""
+    async def timing_middleware(dialog_flow: DialogFlow, call_next: Next):
+        start = time.perf_counter()
+        try:
+            return await call_next(dialog_flow)
+        finally:
+            elapsed = time.perf_counter() - start
+            if record is None:
+                logger.debug('handled %s in %.3f ms', dialog_flow.action, elapsed * 1000)
+            else:
+                record(dialog_flow.action, elapsed)
+
+    return timing_middleware
+
+
+def verified_user(dialog_flow: DialogFlow) -> bool:
+    return dialog_flow.user_verification_status == 'VERIFIED'
+
+
+def authorize(predicate: Callable[[DialogFlow], bool] = verified_user,
+              on_denied: Handler = None) -> Middleware:
+    """
+    Lets a request through only when predicate(dialog_flow) is true. Denied requests go to on_denied instead, or
+    raise PermissionError, which WebhookApp answers with a 403.
+    """
+    denied = _as_coroutine_function(on_denied) if on_denied is not None else None
+
+    async def authorize_middleware(dialog_flow: DialogFlow, call_next: Next):
+        if predicate(dialog_flow):
+            return await call_next(dialog_flow)
+        if denied is None:
+            raise PermissionError('request for %s not authorized' % dialog_flow.action)
+        return await denied(dialog_flow)
+
+    return authorize_middleware
+
+
+def _default_cache_key(dialog_flow: DialogFlow) -> Hashable:
+    return dialog_flow.action, frozenset(dialog_flow.parameters.items())
+
+
+# the parts of a response a cached handler result is made of, contexts belong to the session and are not cached
+_CACHED_KEYS = ('fulfillmentText', 'fulfillmentMessages', 'payload')
+
+
+def cache_responses(ttl: float = 60, max_entries: int = 1024,
+                    key: Callable[[DialogFlow], Hashable] = _default_cache_key) -> Middleware:
+    """
+    Caches what the rest of the chain writes into fulfillmentText, fulfillmentMessages and payload, keyed by
+    key(dialog_flow), action and parameters by default, for ttl seconds. A hit copies the cached parts into the
+    response without running the handler. Only for handlers whose response depends on nothing but the key.
+    """
+    assert ttl > 0 and max_entries > 0
+    entries: OrderedDict = OrderedDict()
+    hits, misses = CACHE_LOOKUPS.labels('responses', 'hit'), CACHE_LOOKUPS.labels('responses', 'miss')
+
+    async def cache_middleware(dialog_flow: DialogFlow, call_next: Next):
+        try:
+            cache_key = key(dialog_flow)
+            hash(cache_key)
+        except TypeError:
+            # unhashable parameters, lists or nested objects, are never cached
+            return await call_next(dialog_flow)
+
+        now = time.monotonic()
+        entry = entries.get(cache_key)
+        if entry is not None and entry[0] > now:
+            hits.inc()
+            entries.move_to_end(cache_key)
+            # copied in one call, the payload message keeps sharing its object with the top-level payload
+            dialog_flow.update(copy.deepcopy(entry[1]))
+            return None
+
+        misses.inc()
+        result = await call_next(dialog_flow)
+        response = result if isinstance(result, DialogFlow) else dialog_flow
+        entries[cache_key] = (now + ttl, copy.deepcopy({part: response[part] for part in _CACHED_KEYS
+                                                        if part in response}))
+        entries.move_to_end(cache_key)
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
+        return result
+
+    return cache_middleware
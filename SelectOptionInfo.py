@@ -1,3 +1 @@
 from GoogleActions.OptionInfo import OptionInfo as SelectOptionInfo
-
-print('OptionInfo: ', SelectOptionInfo)
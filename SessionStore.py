@@ -0,0 +1,291 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from DialogFlowPy.JsonEncoder import get_json_encoder
+
+logger = logging.getLogger(__name__)
+
+# Dialogflow expires contexts 20 minutes after the last turn, session state lives as long by default
+CONTEXT_TTL = 20 * 60
+
+
+class SessionState(MutableMapping):
+    """
+    State kept between the turns of a session, loaded from the session store on first access. Assignments and
+    deletions mark it changed, call mark_changed() after mutating a nested value in place. ttl is how many seconds
+    the state is kept after this turn.
+    """
+
+    def __init__(self, data: dict = None, ttl: float = CONTEXT_TTL):
+        self._data = data if data is not None else {}
+        self._changed = False
+        self.ttl = ttl
+
+    @property
+    def data(self) -> dict:
+        return self._data
+
+    @property
+    def changed(self) -> bool:
+        return self._changed
+
+    def mark_changed(self):
+        self._changed = True
+
+    def replace(self, data: dict):
+        self._data = data
+        self._changed = True
+
+    def __getitem__(self, key: str) -> Any:
+        return self._data[key]
+
+    def __setitem__(self, key: str, value: Any):
+        self._data[key] = value
+        self._changed = True
+
+    def __delitem__(self, key: str):
+        del self._data[key]
+        self._changed = True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self):
+        return 'SessionState(%r)' % self._data
+
+
+class SessionStore(object):
+    """Keeps a dict of json serializable values per session id, for ttl seconds after it was last saved"""
+
+    def load(self, session_id: str) -> Optional[dict]:
+        raise NotImplementedError()
+
+    def save(self, session_id: str, data: dict, ttl: float = CONTEXT_TTL):
+        raise NotImplementedError()
+
+    def delete(self, session_id: str):
+        raise NotImplementedError()
+
+    def flush(self):
+        """Writes whatever is still buffered, a no-op for stores writing synchronously"""
+
+    def close(self):
+        self.flush()
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process LRU store split into shards, each with its own lock, so concurrent threads rarely wait for each
+    other. Every shard keeps at most max_entries / shards sessions, expired entries are dropped when they are read
+    or reach the LRU end. load() returns a shallow copy of the saved dict.
+    """
+
+    def __init__(self, max_entries: int = 100000, shards: int = 16):
+        assert max_entries >= shards > 0
+
+        self._shard_size = max_entries // shards
+        self._shards: List[Tuple[threading.Lock, OrderedDict]] = [(threading.Lock(), OrderedDict())
+                                                                  for _ in range(shards)]
+
+    def _shard(self, session_id: str) -> Tuple[threading.Lock, OrderedDict]:
+        return self._shards[hash(session_id) % len(self._shards)]
+
+    def __len__(self) -> int:
+        return sum(len(entries) for _, entries in self._shards)
+
+    def load(self, session_id: str) -> Optional[dict]:
+        lock, entries = self._shard(session_id)
+        with lock:
+            entry = entries.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del entries[session_id]
+                return None
+            entries.move_to_end(session_id)
+            return dict(entry[1])
+
+    def save(self, session_id: str, data: dict, ttl: float = CONTEXT_TTL):
+        lock, entries = self._shard(session_id)
+        now = time.monotonic()
+        with lock:
+            entries[session_id] = (now + ttl, dict(data))
+            entries.move_to_end(session_id)
+            while len(entries) > self._shard_size:
+                entries.popitem(last=False)
+            # expired entries at the LRU end go first, they would be dropped on their next read anyway
+            while entries:
+                oldest = next(iter(entries.values()))
+                if oldest[0] > now:
+                    break
+                entries.popitem(last=False)
+
+    def delete(self, session_id: str):
+        lock, entries = self._shard(session_id)
+        with lock:
+            entries.pop(session_id, None)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Durable store in a SQLite database in WAL mode. save() and delete() only buffer the change, a writer thread
+    writes the buffer every flush_interval seconds, or as soon as max_batch changes are waiting, in one transaction.
+    Reads see buffered changes first. Expired rows are purged by the writer at most once every purge_interval seconds.
+    """
+
+    _DELETED = object()
+
+    def __init__(self, path: str, flush_interval: float = 0.05, max_batch: int = 512, purge_interval: float = 60):
+        self._path = path
+        self._flush_interval = flush_interval
+        self._max_batch = max_batch
+        self._purge_interval = purge_interval
+        self._last_purge = 0
+
+        self._local = threading.local()
+        # every thread's connection, close() closes them all
+        self._connections: List[sqlite3.Connection] = []
+        self._pending: Dict[str, Any] = {}
+        # the batch being written, still read from until its transaction is committed
+        self._flushing: Dict[str, Any] = {}
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS session_state '
+                           '(session_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS session_state_expires ON session_state (expires)')
+        connection.commit()
+
+        self._writer = threading.Thread(target=self._write_loop, name='SqliteSessionStore writer', daemon=True)
+        self._writer.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        # one connection per thread, sqlite3 connections must not be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # each connection is only used by its own thread, close() is the exception
+            connection = self._local.connection = sqlite3.connect(self._path, timeout=30, isolation_level=None,
+                                                                  check_same_thread=False)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            with self._pending_lock:
+                self._connections.append(connection)
+        return connection
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._pending_lock:
+            pending = self._pending.get(session_id)
+            if pending is None:
+                pending = self._flushing.get(session_id)
+        if pending is self._DELETED:
+            return None
+        if pending is not None:
+            return json.loads(pending[0])
+
+        row = self._connection().execute('SELECT data FROM session_state WHERE session_id = ? AND expires > ?',
+                                         (session_id, time.time())).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _buffer(self, session_id: str, change: Any):
+        assert not self._closed, 'session store is closed'
+        with self._pending_lock:
+            self._pending[session_id] = change
+            full = len(self._pending) >= self._max_batch
+        if full:
+            self._wake.set()
+
+    def save(self, session_id: str, data: dict, ttl: float = CONTEXT_TTL):
+        # encoded now, later changes to data do not leak into the buffered write
+        self._buffer(session_id, (get_json_encoder().encode(data).decode('utf-8'), time.time() + ttl))
+
+    def delete(self, session_id: str):
+        self._buffer(session_id, self._DELETED)
+
+    def flush(self):
+        with self._write_lock:
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+                self._flushing = pending
+            if not pending:
+                return
+            try:
+                self._write(pending)
+            finally:
+                with self._pending_lock:
+                    self._flushing = {}
+
+    def _write(self, pending: Dict[str, Any]):
+        upserts = [(session_id, change[0], change[1]) for session_id, change in pending.items()
+                   if change is not self._DELETED]
+        deletes = [(session_id,) for session_id, change in pending.items() if change is self._DELETED]
+
+        connection = self._connection()
+        connection.execute('BEGIN')
+        try:
+            connection.executemany('INSERT OR REPLACE INTO session_state (session_id, data, expires) '
+                                   'VALUES (?, ?, ?)', upserts)
+            connection.executemany('DELETE FROM session_state WHERE session_id = ?', deletes)
+            now = time.time()
+            if now - self._last_purge >= self._purge_interval:
+                connection.execute('DELETE FROM session_state WHERE expires <= ?', (now,))
+                self._last_purge = now
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            with self._pending_lock:
+                # keep the failed changes for the next flush, unless newer ones replaced them meanwhile
+                for session_id, change in pending.items():
+                    self._pending.setdefault(session_id, change)
+            raise
+
+    def _write_loop(self):
+        while not self._closed:
+            self._wake.wait(self._flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # the writer must outlive any failure, later saves would pile up unwritten otherwise
+                logger.exception('writing session state failed')
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self._writer.join()
+        try:
+            self.flush()
+        finally:
+            with self._pending_lock:
+                connections, self._connections = self._connections, []
+            for connection in connections:
+                connection.close()
+
+
+_session_store: SessionStore = None
+
+
+def get_session_store() -> SessionStore:
+    """Returns the store behind DialogFlow.session_state, an in-memory one unless another was set"""
+    global _session_store
+    if _session_store is None:
+        _session_store = MemorySessionStore()
+    return _session_store
+
+
+def set_session_store(session_store: SessionStore) -> SessionStore:
+    global _session_store
+    assert session_store is None or isinstance(session_store, SessionStore)
+    _session_store = session_store
+    return session_store
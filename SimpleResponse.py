@@ -1,3 +1 @@
 from GoogleActions.SimpleResponse import SimpleResponse
-
-print('SimpleResponse: ', SimpleResponse)
@@ -1,3 +1 @@
 from GoogleActions.Suggestion import Suggestion
-
-print('Suggestion: ', Suggestion)
@@ -4,6 +4,7 @@ from DialogFlowPy import HorizontalAlignment
 
 from DialogFlowPy.Button import Button
 from DialogFlowPy.ColumnProperties import ColumnProperties
+from DialogFlowPy.CompactComponents import CompactButton, CompactTableCardRow
 from DialogFlowPy.Image import Image
 from DialogFlowPy.OpenUriAction import OpenUriAction
 from DialogFlowPy.TableCardCell import TableCardCell
@@ -104,7 +105,7 @@ class TableCard(dict):
 
     def add_rows(self, rows: TableCardRow) -> List[TableCardRow]:
         for item in rows:
-            assert isinstance(item, TableCardRow)
+            assert isinstance(item, (TableCardRow, CompactTableCardRow))
             self.rows.append(item)
         return self.rows
 
@@ -125,7 +126,7 @@ class TableCard(dict):
 
     def add_buttons(self, buttons) -> List[Button]:
         for item in buttons:
-            assert isinstance(item, Button)
+            assert isinstance(item, (Button, CompactButton))
             self.buttons.append(item)
 
         return self.buttons
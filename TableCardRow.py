@@ -1,5 +1,6 @@
 from typing import List
 
+from DialogFlowPy.CompactComponents import CompactTableCardCell
 from DialogFlowPy.TableCardCell import TableCardCell
 
 
@@ -41,7 +42,7 @@ class TableCardRow(dict):
 
     def add_cells(self, cells: TableCardCell) -> List[TableCardCell]:
         for item in cells:
-            assert isinstance(item, TableCardCell)
+            assert isinstance(item, (TableCardCell, CompactTableCardCell))
             self['cells'].append(item)
 
         return self['cells']
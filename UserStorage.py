@@ -0,0 +1,183 @@
+import base64
+import hashlib
+import json
+import re
+import zlib
+from ast import literal_eval
+from collections.abc import MutableMapping
+from typing import Optional, Union
+
+COMPRESSED_PREFIX = 'z1:'
+
+_VERSION_PATTERN = re.compile(r'z\d+:')
+
+
+class UserStorageCodec(object):
+    """
+    Converts userStorage between its wire string and a dict.
+
+    Data is written as compact json with sorted keys, keys of mixed types (1 and 'a') are sorted as the strings json
+    writes them. With compress=True, json of at least min_compress_size
+    characters is written as 'z1:' + urlsafe base64 of the zlib compressed json instead, whenever that is shorter. The
+    'z1:' prefix versions the format, plain json and older python literal strings are still read.
+    """
+
+    def __init__(self, compress: bool = False, min_compress_size: int = 256, level: int = 9):
+        self.compress = compress
+        self.min_compress_size = min_compress_size
+        self.level = level
+
+    @staticmethod
+    def dumps(data: dict) -> str:
+        try:
+            return json.dumps(data, separators=(',', ':'), sort_keys=True, ensure_ascii=False)
+        except TypeError:
+            # mixed key types cannot be compared, once written as json every key is a string
+            text = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+            return json.dumps(json.loads(text), separators=(',', ':'), sort_keys=True, ensure_ascii=False)
+
+    @staticmethod
+    def digest(text: str) -> bytes:
+        return hashlib.sha1(text.encode('utf-8')).digest()
+
+    def decode_text(self, raw: str) -> str:
+        """Returns the json text held in a userStorage string, decompressing it when needed"""
+        if raw.startswith(COMPRESSED_PREFIX):
+            return zlib.decompress(base64.urlsafe_b64decode(raw[len(COMPRESSED_PREFIX):])).decode('utf-8')
+        if _VERSION_PATTERN.match(raw):
+            raise ValueError('unsupported userStorage format %s' % raw.split(':', 1)[0])
+        return raw
+
+    @staticmethod
+    def loads(text: str) -> dict:
+        if not text:
+            return {}
+
+        try:
+            data = json.loads(text)
+        except ValueError:
+            # storage written before the codec existed is a python literal
+            data = literal_eval(text)
+
+        if not isinstance(data, dict):
+            raise ValueError('userStorage must hold an object, got %s' % type(data).__name__)
+        return data
+
+    def decode(self, raw: str) -> dict:
+        return self.loads(self.decode_text(raw or ''))
+
+    def encode(self, data: dict, compress: bool = None) -> str:
+        return self.encode_text(self.dumps(data), compress=compress)
+
+    def encode_text(self, text: str, compress: bool = None) -> str:
+        if compress is None:
+            compress = self.compress
+
+        if compress and len(text) >= self.min_compress_size:
+            compressed = COMPRESSED_PREFIX + base64.urlsafe_b64encode(
+                zlib.compress(text.encode('utf-8'), self.level)).decode('ascii')
+            if len(compressed) < len(text):
+                return compressed
+
+        return text
+
+
+class UserStorage(MutableMapping):
+    """
+    userStorage of a request, decoded on first access.
+
+    encode() only re-serializes and compresses the data when its content hash differs from what the request carried,
+    otherwise the original string is handed back untouched.
+    """
+
+    def __init__(self, raw: Union[str, dict, None] = None, codec: UserStorageCodec = None):
+        self._codec = codec or get_user_storage_codec()
+        self._data = None
+        self._digest = None
+
+        if isinstance(raw, dict):
+            self._raw = self._codec.dumps(raw)
+            self._data = raw
+            self._digest = self._codec.digest(self._raw)
+        else:
+            self._raw = raw or ''
+
+    @property
+    def raw(self) -> str:
+        return self._raw
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = self._codec.loads(self._codec.decode_text(self._raw))
+            # digest of the canonical form, storage written with other spacing or key order is not a change
+            self._digest = self._codec.digest(self._codec.dumps(self._data))
+        return self._data
+
+    @property
+    def decoded(self) -> bool:
+        return self._data is not None
+
+    def _text_if_changed(self) -> Optional[str]:
+        if self._data is None:
+            return None
+
+        text = self._codec.dumps(self._data)
+        if self._codec.digest(text) == self._digest:
+            return None
+        return text
+
+    @property
+    def changed(self) -> bool:
+        """Serializes the data to compare it, use encode_if_changed() to check and encode in one pass"""
+        return self._text_if_changed() is not None
+
+    def encode_if_changed(self, compress: bool = None) -> Optional[str]:
+        """The encoded data when it differs from what the request carried, else None"""
+        text = self._text_if_changed()
+        if text is None:
+            return None
+
+        self._raw = self._codec.encode_text(text, compress=compress)
+        self._digest = self._codec.digest(text)
+        return self._raw
+
+    def encode(self, compress: bool = None) -> str:
+        encoded = self.encode_if_changed(compress=compress)
+        return encoded if encoded is not None else self._raw
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return 'UserStorage(%r)' % (self._data if self._data is not None else self._raw)
+
+
+_user_storage_codec: UserStorageCodec = None
+
+
+def get_user_storage_codec() -> UserStorageCodec:
+    global _user_storage_codec
+    if _user_storage_codec is None:
+        _user_storage_codec = UserStorageCodec()
+    return _user_storage_codec
+
+
+def set_user_storage_codec(codec: UserStorageCodec) -> UserStorageCodec:
+    """Replaces the codec used for every request, e.g. UserStorageCodec(compress=True)"""
+    global _user_storage_codec
+    assert codec is None or isinstance(codec, UserStorageCodec)
+    _user_storage_codec = codec
+    return codec
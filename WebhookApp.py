@@ -0,0 +1,302 @@
+import asyncio
+import inspect
+import json
+import logging
+from concurrent.futures import Executor
+from typing import Any, Awaitable, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from DialogFlowPy.DialogFlow import DialogFlow, InvalidIdToken
+from DialogFlowPy.Instrumentation import span
+from DialogFlowPy.JsonEncoder import JsonEncoder, get_json_encoder
+from DialogFlowPy.JsonStream import DEFAULT_CHUNK_SIZE
+from DialogFlowPy.Metrics import CONTENT_TYPE, MetricsRegistry, get_metrics_registry, install_span_metrics
+from DialogFlowPy.ProcessOffload import get_process_runner, is_process_bound
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class RequestRejected(Exception):
+    """Ends a request early with an error status, raised while the request is still being read"""
+
+    def __init__(self, status: int, message: str, headers: Headers = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or []
+
+
+class _TrackedSend(object):
+    """ASGI send remembering whether the response has started, after that no error response can be sent"""
+
+    __slots__ = ('_send', 'started')
+
+    def __init__(self, send: Callable[[dict], Awaitable]):
+        self._send = send
+        self.started = False
+
+    async def __call__(self, message: dict):
+        if message['type'] == 'http.response.start':
+            self.started = True
+        await self._send(message)
+
+
+def _loads(body) -> Any:
+    # both parsers take bytes, bytearray and memoryview as they are, the body is never decoded to str first
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class WebhookApp(object):
+    """
+    ASGI application serving a Dialogflow fulfillment webhook. The request body is parsed once, straight into a
+    DialogFlow built by from_request_async, which is handed to handler(dialog_flow). The handler may be a coroutine
+    function or a plain function, it fills the response in and may return another DialogFlow to send instead. The
+    response is streamed back with iter_json, a response that fits in one chunk goes out in a single body message with
+    a content-length, so HTTP/1.1 servers keep the connection alive without chunked encoding.
+
+    At most max_concurrency requests are handled at once, the ones beyond that are answered 503 right away instead
+    of queueing up behind slow handlers. An invalid idToken is answered 401, a PermissionError raised by the handler
+    403. An error while the response is already being streamed aborts it instead. The session state is saved in the
+    default executor after the response is sent. on_startup and on_shutdown callables run on the ASGI lifespan events.
+
+    Every request runs in a webhook.request span. With a metrics_path the spans feed the built-in metrics, served in
+    the Prometheus text format on GET metrics_path, aggregated over the pool workers once the registry has a metrics
+    directory.
+    """
+
+    def __init__(self, handler: Callable[[DialogFlow], Any], path: Optional[str] = None, version: str = 'v1',
+                 create_payload_object: bool = False, client_key: str = None, max_concurrency: int = None,
+                 max_body_size: int = 1024 * 1024, encoder: JsonEncoder = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, executor: Executor = None,
+                 on_startup: Iterable[Callable] = (), on_shutdown: Iterable[Callable] = (),
+                 metrics_path: Optional[str] = None, metrics_registry: MetricsRegistry = None):
+        assert callable(handler)
+        assert max_concurrency is None or max_concurrency > 0
+
+        self.handler = handler
+        self.path = path
+        self.version = version
+        self.create_payload_object = create_payload_object
+        self.client_key = client_key
+        self.max_concurrency = max_concurrency
+        self.max_body_size = max_body_size
+        self.encoder = encoder
+        self.chunk_size = chunk_size
+        self.executor = executor
+        self.on_startup = list(on_startup)
+        self.on_shutdown = list(on_shutdown)
+        self.metrics_path = metrics_path
+        self.metrics_registry = metrics_registry
+        self._in_flight = 0
+
+        if metrics_path is not None:
+            install_span_metrics()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def __call__(self, scope: dict, receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable]):
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        else:
+            raise ValueError('unsupported ASGI scope type %s' % scope['type'])
+
+    # lifespan
+
+    @staticmethod
+    async def _run_hooks(hooks: List[Callable]):
+        for hook in hooks:
+            result = hook()
+            if inspect.isawaitable(result):
+                await result
+
+    async def _lifespan(self, receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable]):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self._run_hooks(self.on_startup)
+                except Exception as e:
+                    logger.exception('webhook startup failed')
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                try:
+                    await self._run_hooks(self.on_shutdown)
+                except Exception as e:
+                    logger.exception('webhook shutdown failed')
+                    await send({'type': 'lifespan.shutdown.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # http
+
+    async def _read_body(self, receive: Callable[[], Awaitable[dict]]):
+        """Returns the request body, the bytes of the first body message itself when it holds the whole body"""
+        message = await receive()
+        body = message.get('body', b'')
+        if not message.get('more_body', False):
+            if len(body) > self.max_body_size:
+                raise RequestRejected(413, 'request body too large')
+            return body
+
+        buffer = bytearray(body)
+        while message.get('more_body', False):
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ConnectionAbortedError('client disconnected while sending the request')
+            buffer += message.get('body', b'')
+            if len(buffer) > self.max_body_size:
+                raise RequestRejected(413, 'request body too large')
+        return buffer
+
+    async def _http(self, scope: dict, receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable]):
+        send = _TrackedSend(send)
+        if self.metrics_path is not None and scope['path'] == self.metrics_path:
+            await self._metrics(scope, send)
+            return
+
+        try:
+            if self.path is not None and scope['path'] != self.path:
+                raise RequestRejected(404, 'not found')
+            if scope['method'] != 'POST':
+                raise RequestRejected(405, 'method not allowed', [(b'allow', b'POST')])
+            if self.max_concurrency is not None and self._in_flight >= self.max_concurrency:
+                raise RequestRejected(503, 'too many concurrent requests', [(b'retry-after', b'1')])
+        except RequestRejected as e:
+            await self._send_error(send, e)
+            return
+
+        self._in_flight += 1
+        status = 200
+        with span('webhook.request') as request_span:
+            try:
+                try:
+                    request_data_json = _loads(await self._read_body(receive))
+                except ValueError:
+                    raise RequestRejected(400, 'request body is not valid json')
+                if not isinstance(request_data_json, dict):
+                    raise RequestRejected(400, 'request body is not a json object')
+
+                dialog_flow = await DialogFlow.from_request_async(
+                    request_data_json, version=self.version, create_payload_object=self.create_payload_object,
+                    client_key=self.client_key, executor=self.executor)
+                if request_span:
+                    request_span.set('action', dialog_flow.action)
+                    request_span.set('platform', dialog_flow.request.source)
+                dialog_flow = await self._handle(dialog_flow)
+                await self._send_response(send, dialog_flow)
+            except RequestRejected as e:
+                status = e.status
+                await self._send_error(send, e)
+                return
+            except InvalidIdToken:
+                status = 401
+                await self._send_error(send, RequestRejected(status, 'invalid id token'))
+                return
+            except PermissionError as e:
+                status = 403
+                await self._send_error(send, RequestRejected(status, str(e) or 'forbidden'))
+                return
+            except ConnectionAbortedError:
+                # nginx's code for a client closing the connection before the response
+                status = 499
+                logger.debug('request aborted by the client')
+                return
+            except Exception:
+                status = 500
+                logger.exception('webhook handler failed')
+                await self._send_error(send, RequestRejected(status, 'internal server error'))
+                return
+            finally:
+                self._in_flight -= 1
+                if request_span:
+                    request_span.set('status', status)
+
+        # the response is out, saving the session state no longer delays it
+        if dialog_flow.session_state_changed:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, dialog_flow.save_session_state)
+            except Exception:
+                logger.exception('saving the session state failed')
+
+    async def _handle(self, dialog_flow: DialogFlow) -> DialogFlow:
+        if is_process_bound(self.handler):
+            return await get_process_runner().run(self.handler, dialog_flow)
+        result = self.handler(dialog_flow)
+        if inspect.isawaitable(result):
+            result = await result
+        return result if isinstance(result, DialogFlow) else dialog_flow
+
+    async def _send_response(self, send: Callable[[dict], Awaitable], dialog_flow: DialogFlow, status: int = 200):
+        if dialog_flow.budget is not None:
+            # the budget needs the whole encoded response to check its size
+            chunks = iter((dialog_flow.to_json_bytes(self.encoder),))
+            await self._send_chunks(send, chunks, status)
+            return
+
+        # encoded while it is sent, the span stands in for the dialogflow.encode span of to_json_bytes
+        with span('webhook.send') as current:
+            size = await self._send_chunks(send, dialog_flow.iter_json(self.encoder, self.chunk_size), status)
+            if current:
+                current.set('action', dialog_flow.action)
+                current.set('message_count', len(dialog_flow.fulfillment_messages))
+                current.set('message_types', ','.join(dialog_flow.message_types()))
+                current.set('bytes', size)
+
+    async def _send_chunks(self, send: Callable[[dict], Awaitable], chunks: Iterator[bytes], status: int) -> int:
+        """Sends the response body and returns its size"""
+        first = next(chunks, b'')
+        second = next(chunks, None)
+        if second is None:
+            await self._send_body(send, status, first)
+            return len(first)
+
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        size = len(first) + len(second)
+        for chunk in (first, second):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        for chunk in chunks:
+            size += len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await asyncio.sleep(0)
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        return size
+
+    @staticmethod
+    async def _send_body(send: Callable[[dict], Awaitable], status: int, body: bytes, headers: Headers = (),
+                         content_type: bytes = b'application/json'):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', content_type),
+                                (b'content-length', str(len(body)).encode('ascii'))] + list(headers)})
+        await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+
+    async def _send_error(self, send: _TrackedSend, error: RequestRejected):
+        if send.started:
+            # a second http.response.start is a protocol error, the server can only drop the connection now
+            raise RuntimeError('webhook response aborted after it started: %s' % error.message)
+        body = (self.encoder or get_json_encoder()).encode({'error': error.message})
+        await self._send_body(send, error.status, body, error.headers)
+
+    async def _metrics(self, scope: dict, send: Callable[[dict], Awaitable]):
+        if scope['method'] != 'GET':
+            await self._send_error(send, RequestRejected(405, 'method not allowed', [(b'allow', b'GET')]))
+            return
+        registry = self.metrics_registry or get_metrics_registry()
+        # reading the other processes' files is blocking, it stays off the event loop
+        body = await asyncio.get_running_loop().run_in_executor(None, registry.exposition)
+        await self._send_body(send, 200, body, content_type=CONTENT_TYPE.encode('ascii'))
@@ -0,0 +1,312 @@
+from types import MappingProxyType
+from typing import FrozenSet, List, Mapping, Optional
+
+from DialogFlowPy.IncomingContexts import IncomingContexts
+from DialogFlowPy.UserStorage import UserStorage
+
+_EMPTY = MappingProxyType({})
+_UNSET = object()
+
+
+class Intent(object):
+    """
+    {
+      "name": string,
+      "displayName": string
+    }
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data: dict):
+        self._data = data or {}
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._data.get('name')
+
+    @property
+    def display_name(self) -> Optional[str]:
+        return self._data.get('displayName')
+
+
+class QueryResult(object):
+    """
+    {
+      "queryText": string,
+      "action": string,
+      "parameters": {
+        object
+      },
+      "allRequiredParamsPresent": boolean,
+      "fulfillmentText": string,
+      "outputContexts": [
+        {
+          object(Context)
+        }
+      ],
+      "intent": {
+        object(Intent)
+      },
+      "intentDetectionConfidence": number,
+      "languageCode": string
+    }
+
+    v1 requests ('result') are read through the same properties.
+    """
+
+    __slots__ = ('_data', '_intent', '_parameters')
+
+    def __init__(self, data: dict):
+        self._data = data or {}
+        self._intent = _UNSET
+        self._parameters = _UNSET
+
+    @property
+    def query_text(self) -> Optional[str]:
+        return self._data.get('queryText') or self._data.get('resolvedQuery')
+
+    @property
+    def action(self) -> Optional[str]:
+        return self._data.get('action')
+
+    @property
+    def parameters(self) -> Mapping:
+        """Read-only view over the request parameters, nothing is copied"""
+        if self._parameters is _UNSET:
+            parameters = self._data.get('parameters')
+            self._parameters = MappingProxyType(parameters) if parameters is not None else _EMPTY
+        return self._parameters
+
+    @property
+    def all_required_params_present(self) -> Optional[bool]:
+        return self._data.get('allRequiredParamsPresent')
+
+    @property
+    def fulfillment_text(self) -> Optional[str]:
+        return self._data.get('fulfillmentText')
+
+    @property
+    def output_contexts(self) -> List[dict]:
+        return self._data.get('outputContexts') or self._data.get('contexts') or []
+
+    @property
+    def intent(self) -> Intent:
+        if self._intent is _UNSET:
+            intent = self._data.get('intent')
+            if intent is None and 'metadata' in self._data:
+                metadata = self._data['metadata']
+                intent = {'name': metadata.get('intentId'), 'displayName': metadata.get('intentName')}
+            self._intent = Intent(intent)
+        return self._intent
+
+    @property
+    def intent_detection_confidence(self) -> Optional[float]:
+        return self._data.get('intentDetectionConfidence', self._data.get('score'))
+
+    @property
+    def language_code(self) -> Optional[str]:
+        return self._data.get('languageCode')
+
+
+class User(object):
+    """
+    {
+      "userId": string,
+      "idToken": string,
+      "locale": string,
+      "lastSeen": string,
+      "permissions": [
+        enum(Permission)
+      ],
+      "userVerificationStatus": enum(UserVerificationStatus),
+      "userStorage": string
+    }
+    """
+
+    __slots__ = ('_data', '_storage')
+
+    def __init__(self, data: dict):
+        self._data = data or {}
+        self._storage = _UNSET
+
+    @property
+    def user_id(self) -> Optional[str]:
+        return self._data.get('userId')
+
+    @property
+    def id_token(self) -> Optional[str]:
+        return self._data.get('idToken')
+
+    @property
+    def locale(self) -> Optional[str]:
+        return self._data.get('locale')
+
+    @property
+    def last_seen(self) -> Optional[str]:
+        return self._data.get('lastSeen')
+
+    @property
+    def permissions(self) -> List[str]:
+        return self._data.get('permissions') or []
+
+    @property
+    def user_verification_status(self) -> Optional[str]:
+        return self._data.get('userVerificationStatus')
+
+    @property
+    def storage(self) -> UserStorage:
+        """userStorage as a mutable mapping, decoded on first access"""
+        if self._storage is _UNSET:
+            self._storage = UserStorage(self._data.get('userStorage'))
+        return self._storage
+
+    @property
+    def user_storage(self) -> Mapping:
+        """Read-only view over the decoded userStorage"""
+        return MappingProxyType(self.storage.data)
+
+
+class Surface(object):
+    """
+    {
+      "capabilities": [
+        {
+          "name": string
+        }
+      ]
+    }
+    """
+
+    __slots__ = ('_data', '_capabilities')
+
+    def __init__(self, data: dict):
+        self._data = data or {}
+        self._capabilities = _UNSET
+
+    @property
+    def capabilities(self) -> FrozenSet[str]:
+        if self._capabilities is _UNSET:
+            self._capabilities = frozenset(capability.get('name') for capability in
+                                           self._data.get('capabilities') or [])
+        return self._capabilities
+
+    def has_capability(self, capability_name: str) -> bool:
+        return capability_name in self.capabilities
+
+
+class Conversation(object):
+    """
+    {
+      "conversationId": string,
+      "type": enum(ConversationType),
+      "conversationToken": string
+    }
+    """
+
+    __slots__ = ('_data',)
+
+    def __init__(self, data: dict):
+        self._data = data or {}
+
+    @property
+    def conversation_id(self) -> Optional[str]:
+        return self._data.get('conversationId')
+
+    @property
+    def type(self) -> Optional[str]:
+        return self._data.get('type')
+
+    @property
+    def conversation_token(self) -> Optional[str]:
+        return self._data.get('conversationToken')
+
+
+class WebhookRequest(object):
+    """
+    Typed, lazily parsed view over a Dialogflow webhook request. Nothing is read out of the request json until the
+    matching property is first accessed, sub-objects are built once and reused afterwards.
+    """
+
+    __slots__ = ('_data', '_query_result', '_contexts', '_payload', '_user', '_surface', '_conversation')
+
+    def __init__(self, data: dict):
+        assert isinstance(data, dict)
+
+        self._data = data
+        self._query_result = _UNSET
+        self._contexts = _UNSET
+        self._payload = _UNSET
+        self._user = _UNSET
+        self._surface = _UNSET
+        self._conversation = _UNSET
+
+    @property
+    def data(self) -> dict:
+        return self._data
+
+    @property
+    def response_id(self) -> Optional[str]:
+        return self._data.get('responseId')
+
+    @property
+    def session(self) -> Optional[str]:
+        return self._data.get('session')
+
+    @property
+    def query_result(self) -> QueryResult:
+        if self._query_result is _UNSET:
+            self._query_result = QueryResult(self._data.get('queryResult') or self._data.get('result'))
+        return self._query_result
+
+    @property
+    def contexts(self) -> IncomingContexts:
+        """Contexts of the request indexed by short name"""
+        if self._contexts is _UNSET:
+            self._contexts = IncomingContexts(self.query_result.output_contexts, session=self.session)
+        return self._contexts
+
+    @property
+    def original_detect_intent_request(self) -> Mapping:
+        return self._data.get('originalDetectIntentRequest') or _EMPTY
+
+    @property
+    def source(self) -> Optional[str]:
+        return self.original_detect_intent_request.get('source')
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.original_detect_intent_request.get('version')
+
+    @property
+    def payload(self) -> Mapping:
+        if self._payload is _UNSET:
+            payload = self.original_detect_intent_request.get('payload')
+            self._payload = MappingProxyType(payload) if payload else _EMPTY
+        return self._payload
+
+    @property
+    def is_in_sandbox(self) -> bool:
+        return bool(self.payload.get('isInSandbox'))
+
+    @property
+    def has_user(self) -> bool:
+        return bool(self.payload.get('user'))
+
+    @property
+    def user(self) -> User:
+        if self._user is _UNSET:
+            self._user = User(self.payload.get('user'))
+        return self._user
+
+    @property
+    def surface(self) -> Surface:
+        if self._surface is _UNSET:
+            self._surface = Surface(self.payload.get('surface'))
+        return self._surface
+
+    @property
+    def conversation(self) -> Conversation:
+        if self._conversation is _UNSET:
+            self._conversation = Conversation(self.payload.get('conversation'))
+        return self._conversation
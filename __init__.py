@@ -1,6 +1,9 @@
 name = "DialogFlowPy"
+import logging
 from enum import Enum
 
+logging.getLogger(__name__).addHandler(logging.NullHandler())
+
 
 class PlatformEnum(Enum):
     PLATFORM_UNSPECIFIED = 'PLATFORM_UNSPECIFIED'
@@ -1,17 +1,66 @@
+import asyncio
+import base64
+import copy
+import io
 import json
+import os
+import pickle
+import tempfile
+import threading
+import time
 import unittest
+from DialogFlowPy.AsgiTestClient import AsgiTestClient
+from DialogFlowPy.Batch import iter_lines, run_batch
 from DialogFlowPy.Button import Button
 from DialogFlowPy.CarouselItem import CarouselItem
+from DialogFlowPy.CarouselSelect import CarouselSelect
 from DialogFlowPy import PlatformEnum, ImageDisplayOptions, ResponseMediaType, UrlTypeHint
 from DialogFlowPy.BrowseCarouselCard import BrowseCarouselCard
 from DialogFlowPy.BrowseCarouselCardItem import BrowseCarouselCardItem
+from DialogFlowPy.CertificateStore import CertificateStore, set_certificate_store
+from DialogFlowPy.ClaimsCache import ClaimsCache, get_claims_cache
+from DialogFlowPy.CompactComponents import CompactBrowseCarouselCardItem, CompactCarouselItem, CompactImage, \
+    CompactListItem, CompactTableCardRow
 from DialogFlowPy.DialogFlow import DialogFlow
+from DialogFlowPy.FulfillmentMessages import FulfillmentMessages
+from DialogFlowPy.FrozenComponent import FrozenButton, FrozenDict, FrozenImage, FrozenOpenUriAction, freeze
 from DialogFlowPy.Image import Image
+from DialogFlowPy.JsonStream import iter_json
+from DialogFlowPy.Message import Message
+from DialogFlowPy.Instrumentation import OtlpJsonFileExporter, add_span_sink, remove_span_sink, span
+from DialogFlowPy.Metrics import Counter, Histogram, MetricsRegistry, uninstall_span_metrics
+from DialogFlowPy.JsonEncoder import MemoizingJsonEncoder, StdlibJsonEncoder, orjson, OrjsonEncoder
 from DialogFlowPy.OpenUrlAction import OpenUrlAction
+from DialogFlowPy.SessionStore import MemorySessionStore, SqliteSessionStore, set_session_store
 from DialogFlowPy.SelectOptionInfo import SelectOptionInfo
+from DialogFlowPy.TableCardCell import TableCardCell
+from DialogFlowPy.TableCardRow import TableCardRow
+from DialogFlowPy.Text import Text
+from DialogFlowPy.UserStorage import UserStorage, UserStorageCodec
+from DialogFlowPy.WebhookApp import WebhookApp
+from DialogFlowPy.WebhookRequest import WebhookRequest
 from GoogleActions.MediaObject import MediaObject
 from DialogFlowPy.ListItem import ListItem
 from DialogFlowPy.OpenUriAction import OpenUriAction
+from DialogFlowPy.OutputContexts import OutputContexts
+from DialogFlowPy.ProcessOffload import ProcessPoolRunner, process_bound, set_process_runner
+from DialogFlowPy.Router import Router, authorize, cache_responses
+from DialogFlowPy.SingleFlight import SingleFlight
+from DialogFlowPy.ResponseBudget import ResponseLimits, ResponseTooLarge, split_text, truncate_text
+from DialogFlowPy.ResponseTemplate import ResponseTemplate, Slot
+from DialogFlowPy.Context import Context
+
+
+@process_bound
+def offloaded_handler(dialog_flow):
+    dialog_flow.add_text_message(platform=PlatformEnum.ACTIONS_ON_GOOGLE,
+                                 text_to_speech='%s %s' % (dialog_flow.action, dialog_flow.get_parameter('count')))
+
+
+@process_bound
+def greeting_handler(dialog_flow):
+    dialog_flow.add_text_message(platform=PlatformEnum.ACTIONS_ON_GOOGLE,
+                                 text_to_speech='hello %s' % dialog_flow.user_email)
 
 
 class MyTestCase(unittest.TestCase):
@@ -96,6 +145,677 @@ class MyTestCase(unittest.TestCase):
         assert isinstance(dialog_flow, dict)
         assert json.dumps(dialog_flow)
 
+    def test_certificate_store(self):
+        now = [0]
+        fetched = []
+
+        def fetcher():
+            fetched.append(now[0])
+            return {'kid-%d' % len(fetched): 'certificate'}, 100
+
+        store = CertificateStore(fetcher=fetcher, clock=lambda: now[0], min_refetch_interval=10)
+        self.assertEqual(store.get_certs(kid='kid-1'), {'kid-1': 'certificate'})
+        self.assertEqual(len(fetched), 1)
+
+        # cached until max-age, unknown kids re-fetch only once per min_refetch_interval
+        now[0] = 5
+        store.get_certs(kid='kid-1')
+        store.get_certs(kid='rotated')
+        self.assertEqual(len(fetched), 1)
+        now[0] = 20
+        self.assertIn('kid-2', store.get_certs(kid='rotated'))
+        self.assertEqual(len(fetched), 2)
+
+        now[0] = 500
+        self.assertIn('kid-3', store.get_certs())
+
+    def test_certificate_store_async(self):
+        fetched = []
+        failing = [False]
+
+        async def async_fetcher():
+            fetched.append(len(fetched) + 1)
+            await asyncio.sleep(0.01)
+            if failing[0]:
+                raise ConnectionError('certificates unavailable')
+            return {'kid-%d' % len(fetched): 'certificate'}, 100
+
+        async def concurrently(*coroutines):
+            return await asyncio.gather(*coroutines, return_exceptions=True)
+
+        # concurrent callers share one fetch
+        store = CertificateStore(fetcher=None, async_fetcher=async_fetcher)
+        results = asyncio.run(concurrently(*(store.get_certs_async(kid='kid-1') for _ in range(3))))
+        self.assertEqual(results, [{'kid-1': 'certificate'}] * 3)
+        self.assertEqual(len(fetched), 1)
+
+        # a failed fetch reaches every waiter, the next call fetches again
+        failing[0] = True
+        store = CertificateStore(fetcher=None, async_fetcher=async_fetcher)
+        results = asyncio.run(concurrently(*(store.get_certs_async() for _ in range(3))))
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+        self.assertEqual(len(fetched), 2)
+        failing[0] = False
+        self.assertEqual(asyncio.run(store.get_certs_async()), {'kid-3': 'certificate'})
+
+        # without an async fetcher the blocking one runs in the executor
+        store = CertificateStore(fetcher=lambda: ({'kid-sync': 'certificate'}, 100))
+        self.assertEqual(asyncio.run(store.get_certs_async(kid='kid-sync')), {'kid-sync': 'certificate'})
+
+        # cancelling one waiter leaves the shared operation running for the others
+        async def cancel_one():
+            flight = SingleFlight()
+            first = asyncio.ensure_future(flight.do('key', asyncio.sleep, 0.01, 'result'))
+            second = asyncio.ensure_future(flight.do('key', asyncio.sleep, 0.01, 'other'))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second, len(flight)
+        self.assertEqual(asyncio.run(cancel_one()), ('result', 0))
+
+        # concurrent requests with different tokens share the certificate fetch, and its failure
+        def token(claims):
+            return '.'.join(base64.urlsafe_b64encode(json.dumps(part).encode('utf-8')).decode('ascii').rstrip('=')
+                            for part in ({'alg': 'RS256', 'kid': 'kid-1'}, claims, 'signature'))
+
+        failing[0] = True
+        set_certificate_store(CertificateStore(fetcher=None, async_fetcher=async_fetcher))
+        try:
+            requests = [{'originalDetectIntentRequest': {'payload': {'user': {'idToken': token({'sub': user})}}}}
+                        for user in ('a', 'b')]
+            results = asyncio.run(concurrently(*(DialogFlow.from_request_async(request) for request in requests)))
+        finally:
+            set_certificate_store(None)
+        self.assertTrue(all(isinstance(result, ConnectionError) for result in results))
+        self.assertEqual(len(fetched), 4)
+
+    def test_claims_cache(self):
+        now = [1000]
+        cache = ClaimsCache(max_entries=2, clock=lambda: now[0])
+        self.assertIsNone(cache.get('token-a'))
+        cache.put('token-a', {'email': 'a@example.com', 'exp': 2000})
+        self.assertEqual(cache.get('token-a')['email'], 'a@example.com')
+        self.assertIsNone(cache.get('token-a', audience='other client'))
+
+        cache.put('token-b', {'exp': 2000})
+        cache.put('token-c', {'exp': 2000})
+        self.assertIsNone(cache.get('token-a'))
+        self.assertEqual(cache.evictions, 1)
+
+        now[0] = 2000
+        self.assertIsNone(cache.get('token-c'))
+        self.assertEqual((cache.hits, cache.misses), (1, 4))
+
+    def test_incoming_contexts(self):
+        session = 'projects/project/agent/sessions/session'
+        dialog_flow = DialogFlow({'session': session, 'queryResult': {'action': 'test', 'outputContexts': [
+            {'name': session + '/contexts/order', 'lifespanCount': 2, 'parameters': {'size': 'large'}},
+            {'name': 'short', 'parameters': {'count': 1}}]}})
+
+        for name in ('order', session + '/contexts/order'):
+            self.assertTrue(dialog_flow.has_context(name))
+            self.assertEqual(dialog_flow.get_context_parameter(name, 'size'), 'large')
+        self.assertEqual(dialog_flow.incoming_contexts[session + '/contexts/order'].lifespan_count, 2)
+        self.assertEqual(dialog_flow.incoming_contexts.full_name('short'), session + '/contexts/short')
+        self.assertEqual(dialog_flow.get_context_parameter(session + '/contexts/short', 'count'), 1)
+
+        # a context of another session, a missing context or a missing parameter
+        self.assertFalse(dialog_flow.has_context('projects/project/agent/sessions/other/contexts/order'))
+        self.assertFalse(dialog_flow.has_context('missing'))
+        self.assertIsNone(dialog_flow.get_context_parameter('order', 'colour'))
+        self.assertEqual(dialog_flow.get_context_parameter('missing', 'size', 'small'), 'small')
+        with self.assertRaises(KeyError):
+            dialog_flow.incoming_contexts['missing']
+        self.assertEqual(sorted(dialog_flow.incoming_contexts), ['order', 'short'])
+
+    def test_webhook_request(self):
+        with open('request_data.json', 'r') as f:
+            request_json = json.load(f)
+
+        request = WebhookRequest(request_json)
+        self.assertEqual(request.query_result.action, 'read')
+        self.assertEqual(request.query_result.intent.display_name, 'next')
+        self.assertEqual(request.query_result.parameters['mailuid'], '')
+        with self.assertRaises(TypeError):
+            request.query_result.parameters['mailuid'] = '1'
+        self.assertFalse(request.has_user)
+        self.assertEqual(dict(request.user.user_storage), {})
+
+        dialog_flow = DialogFlow(request_json)
+        self.assertEqual(dialog_flow.action, 'read')
+        self.assertEqual(dialog_flow.user_given_name, '')
+
+    def test_user_storage(self):
+        user_storage = UserStorage('{"name":"nullable","visits":null}')
+        self.assertEqual(user_storage['name'], 'nullable')
+        self.assertIsNone(user_storage['visits'])
+        self.assertFalse(user_storage.changed)
+        self.assertEqual(user_storage.encode(), '{"name":"nullable","visits":null}')
+
+        codec = UserStorageCodec(compress=True, min_compress_size=16)
+        user_storage = UserStorage(user_storage.raw, codec=codec)
+        user_storage['history'] = ['turn'] * 100
+        encoded = user_storage.encode()
+        self.assertTrue(encoded.startswith('z1:'))
+        self.assertEqual(codec.decode(encoded)['history'], ['turn'] * 100)
+        self.assertEqual(dict(UserStorage("{'legacy': None}")), {'legacy': None})
+
+        user_storage = UserStorage('{"b": 1, "a": 2}')
+        self.assertEqual(user_storage['a'], 2)
+        self.assertFalse(user_storage.changed)
+        self.assertEqual(user_storage.encode(), '{"b": 1, "a": 2}')
+
+        user_storage = UserStorage('{}')
+        self.assertIsNone(user_storage.encode_if_changed())
+        user_storage.update({1: 'int key', 'b': 'str key', 'a': {2: 'nested', 'c': None}})
+        self.assertEqual(user_storage.encode_if_changed(),
+                         '{"1":"int key","a":{"2":"nested","c":null},"b":"str key"}')
+        self.assertIsNone(user_storage.encode_if_changed())
+        self.assertFalse(user_storage.changed)
+
+    def test_output_contexts(self):
+        contexts = OutputContexts()
+        contexts.set_context('first', lifespan_count=1, a=1)
+        contexts.set_context('second', lifespan_count=2)
+        contexts.set_context('first', lifespan_count=3, b=2)
+        contexts.set_contexts([Context('third'), Context('second', lifespan_count=5)])
+        contexts.expire_contexts(['first'])
+        self.assertEqual([(context.name, context.lifespan_count) for context in contexts],
+                         [('first', 0), ('second', 5), ('third', 0)])
+        self.assertEqual(contexts.get_context('first').parameters, {'a': 1, 'b': 2})
+
+        contexts.remove_contexts(['first', 'missing'])
+        self.assertEqual(json.loads(json.dumps(contexts)),
+                         [{'name': 'second', 'lifespanCount': 5, 'parameters': {}},
+                          {'name': 'third', 'lifespanCount': 0, 'parameters': {}}])
+        self.assertFalse(contexts.has_context('first'))
+
+        dialog_flow = DialogFlow({'queryResult': {'action': 'test'}})
+        dialog_flow.add_context(context_name='copied', lifespan=2, a=1)
+        for copied in (pickle.loads(pickle.dumps(dialog_flow)), copy.deepcopy(dialog_flow)):
+            copied_contexts = copied['outputContexts']
+            self.assertEqual(copied_contexts, dialog_flow['outputContexts'])
+            self.assertEqual(copied_contexts.get_context('copied').parameters, {'a': 1})
+            self.assertIsNot(copied_contexts.get_context('copied'), dialog_flow['outputContexts'].get_context('copied'))
+            copied_contexts.set_context('copied', lifespan_count=3)
+            self.assertEqual(len(copied_contexts), 1)
+
+    def test_message_types(self):
+        message = Message(PlatformEnum.ACTIONS_ON_GOOGLE, Text('hello'))
+        self.assertEqual((message.message_type, message['text']), ('text', message.message_object))
+
+        # subclasses of a registered component resolve to its entry, a new component replaces the old key
+        class Greeting(Text):
+            pass
+        message.message_object = Greeting('hi')
+        self.assertEqual(message.message_type, 'text')
+        message.message_object = Image('https://example.com/image.png')
+        self.assertEqual((message.message_type, list(message)), ('image', ['platform', 'image']))
+
+        class Rating(dict):
+            pass
+        with self.assertRaises(TypeError):
+            message.message_object = Rating(stars=5)
+        self.assertEqual(message.message_type, 'image')
+
+        Message.register_message_type(Rating, 'rating_card', 'rating')
+        try:
+            message = Message(PlatformEnum.ACTIONS_ON_GOOGLE, Rating(stars=5))
+            self.assertEqual(message.message_type, 'rating')
+            self.assertEqual(json.loads(StdlibJsonEncoder().encode(message)),
+                             {'platform': 'ACTIONS_ON_GOOGLE', 'rating_card': {'stars': 5}})
+        finally:
+            del Message._message_types[Rating]
+            Message._resolved_message_types.clear()
+
+    def test_fulfillment_messages(self):
+        google, facebook = PlatformEnum.ACTIONS_ON_GOOGLE, PlatformEnum.FACEBOOK
+        first, second = Message(google, Text('first')), Message(google, Text('second'))
+        image = Message(facebook, Image(image_uri='https://example.com/image.png'))
+        messages = FulfillmentMessages([first, image])
+        messages.insert(0, second)
+        self.assertEqual(messages.get_messages(google, 'text'), [second, first])
+        self.assertEqual(messages.get_message(google, 'text'), second)
+        self.assertTrue(messages.has_message_type(facebook, 'image'))
+        self.assertFalse(messages.has_message_type(google, 'image'))
+
+        messages.remove(second)
+        self.assertEqual(messages.get_messages(google, 'text'), [first])
+        self.assertIs(messages.pop(), image)
+        self.assertFalse(messages.has_message_type(facebook, 'image'))
+        self.assertIsNone(messages.get_message(facebook, 'image'))
+
+        for copied in (copy.deepcopy(copy.deepcopy(messages)), pickle.loads(pickle.dumps(messages))):
+            self.assertEqual(copied, messages)
+            self.assertEqual(copied.get_messages(google, 'text'), [first])
+            self.assertIsNot(copied.get_message(google, 'text'), first)
+
+        router = Router()
+        router.on_action('cached', middlewares=[cache_responses()])(
+            lambda dialog_flow: dialog_flow.add_text_message(platform=google, text_to_speech='cached'))
+        for _ in range(3):
+            dialog_flow = DialogFlow({'queryResult': {'action': 'cached'}})
+            asyncio.run(router(dialog_flow))
+            self.assertEqual(len(dialog_flow.fulfillment_messages.get_messages(google, 'simple_responses')), 1)
+
+        # on a hit the payload message still shares its object with the top-level payload
+        router.on_action('cached payload', middlewares=[cache_responses()])(
+            lambda dialog_flow: dialog_flow.add_text_message(platform=google, text_to_speech='hi'))
+        for _ in range(2):
+            dialog_flow = DialogFlow({'queryResult': {'action': 'cached payload'}}, create_payload_object=True)
+            asyncio.run(router(dialog_flow))
+            dialog_flow.add_text_message(platform=google, text_to_speech='after')
+            self.assertIs(dialog_flow.get_fulfillment_message(platform=google, message_type='payload').message_object,
+                          dialog_flow.payload)
+            items = json.loads(dialog_flow.to_json_bytes())['payload']['google']['richResponse']['items']
+            self.assertEqual([item['simpleResponse']['textToSpeech'] for item in items], ['hi', 'after'])
+
+    def test_json_encoders(self):
+        dialog_flow = DialogFlow({'queryResult': {'action': 'test'}}, create_payload_object=True)
+        dialog_flow.add_text_message(platform=PlatformEnum.ACTIONS_ON_GOOGLE, text_to_speech='caf\u00e9')
+        dialog_flow.add_context(context_name='test context', lifespan=1, enum_value=ImageDisplayOptions.WHITE,
+                                ids={1: 'a', 2: 'b'})
+
+        encoded = StdlibJsonEncoder().encode(dialog_flow)
+        self.assertIsInstance(encoded, bytes)
+        self.assertEqual(json.loads(encoded)['outputContexts'][0]['parameters']['enum_value'], 'WHITE')
+        self.assertEqual(json.loads(encoded)['outputContexts'][0]['parameters']['ids'], {'1': 'a', '2': 'b'})
+        if orjson is not None:
+            self.assertEqual(OrjsonEncoder().encode(dialog_flow), encoded)
+
+    def test_response_template(self):
+        dialog_flow = DialogFlow({}, create_payload_object=True)
+        dialog_flow.add_context(context_name='order', lifespan=2, order_id=Slot('order_id'), items=Slot('items'))
+        dialog_flow['fulfillmentText'] = 'Your order ' + Slot('order_id') + ' is ready'
+
+        template = ResponseTemplate(dialog_flow, encoder=StdlibJsonEncoder())
+        self.assertEqual(template.slot_names, ['order_id', 'items'])
+
+        rendered = json.loads(template.render(order_id='A "1"', items=[1, 2]))
+        self.assertEqual(rendered['fulfillmentText'], 'Your order A "1" is ready')
+        self.assertEqual(rendered['outputContexts'][0]['parameters'], {'order_id': 'A "1"', 'items': [1, 2]})
+        self.assertRaises(KeyError, template.render, order_id='A1')
+        # the rendered json cannot match non-ascii names, they are refused up front
+        self.assertRaises(AssertionError, Slot, 'gr\u00f6\u00dfe')
+
+    def test_frozen_components(self):
+        logo = FrozenImage(image_uri='https://example.com/logo.png', accessibility_text='Logo')
+        self.assertIs(logo, FrozenImage('https://example.com/logo.png', 'Logo'))
+        self.assertIs(freeze(Image('https://example.com/logo.png', 'Logo')), logo)
+        self.assertEqual(logo, Image('https://example.com/logo.png', 'Logo'))
+        self.assertRaises(TypeError, logo.__setitem__, 'imageUri', '')
+
+        # equal components hash equal whatever their frozen type
+        untyped = freeze({'imageUri': 'https://example.com/logo.png', 'accessibilityText': 'Logo'})
+        self.assertIsInstance(untyped, FrozenDict)
+        self.assertIsNot(untyped, logo)
+        self.assertEqual(untyped, logo)
+        self.assertEqual(hash(untyped), hash(logo))
+        self.assertEqual(len({untyped, logo}), 1)
+
+        # equal values of different types are interned apart and keep their own encoding
+        self.assertEqual(json.loads(freeze({'x': 1}).json_fragment()), {'x': 1})
+        self.assertIs(json.loads(freeze({'x': True}).json_fragment())['x'], True)
+        self.assertIs(json.loads(freeze({'x': [{'y': True}]}).json_fragment())['x'][0]['y'], True)
+        self.assertIsNot(freeze({'x': [{'y': 1}]}), freeze({'x': [{'y': True}]}))
+
+        button = FrozenButton('Open', OpenUriAction('https://example.com'))
+        self.assertIsInstance(button.open_uri_action, FrozenOpenUriAction)
+        self.assertEqual(json.loads(button.json_fragment()), button)
+        self.assertIs(pickle.loads(pickle.dumps(button)), button)
+
+        editable = button.thaw()
+        editable.title = 'Close'
+        self.assertEqual(button.title, 'Open')
+
+    def test_compact_components(self):
+        items = [CarouselItem(title='Item %d' % i, description='', image=Image('https://example.com/%d.png' % i))
+                 for i in range(3)]
+        compact_items = [CompactCarouselItem(title='Item %d' % i, description='',
+                                             image=CompactImage('https://example.com/%d.png' % i)) for i in range(3)]
+
+        encoder = StdlibJsonEncoder()
+        self.assertEqual(encoder.encode(CarouselSelect(compact_items)), encoder.encode(CarouselSelect(items)))
+        self.assertEqual(compact_items[0], items[0])
+
+        compact_items[0].add_image('https://example.com/other.png')
+        self.assertEqual(compact_items[0].to_dict()['image'].image_uri, 'https://example.com/other.png')
+
+        # unset fields are written the way the dict components write them
+        action = OpenUrlAction(url='https://example.com', url_type_hint=UrlTypeHint.AMP_CONTENT)
+        pairs = [(ListItem('List', '', None, None), CompactListItem('List', '', None, None)),
+                 (BrowseCarouselCardItem(action, 'Browse', '', None, None),
+                  CompactBrowseCarouselCardItem(action, 'Browse', '', None, None)),
+                 (CarouselItem(title='Carousel', description=None),
+                  CompactCarouselItem(title='Carousel', description=None)),
+                 (TableCardRow(), CompactTableCardRow())]
+        for item, compact_item in pairs:
+            self.assertEqual(encoder.encode(compact_item), encoder.encode(item))
+
+    def test_memoizing_encoder(self):
+        buttons = [Button('Open', OpenUriAction('https://example.com'))]
+        logo = FrozenImage('https://example.com/logo.png', 'Logo')
+        compact_image = CompactImage('https://example.com/1.png')
+        response = {'fulfillmentMessages': [{'buttons': buttons, 'image': logo, 'items': [compact_image]}],
+                    'payload': {'buttons': buttons, 'image': logo, 'items': [compact_image, compact_image]}}
+
+        encoder = StdlibJsonEncoder()
+        self.assertEqual(MemoizingJsonEncoder(encoder).encode(response), encoder.encode(response))
+        self.assertEqual(MemoizingJsonEncoder(encoder).encode({'a': [1, 'b']}), b'{"a":[1,"b"]}')
+
+    def test_json_stream(self):
+        dialog_flow = DialogFlow({'queryResult': {'action': 'test'}})
+        dialog_flow.add_text_message(platform=PlatformEnum.ACTIONS_ON_GOOGLE, text_to_speech='Here is the table')
+        dialog_flow.add_table_card(platform=PlatformEnum.ACTIONS_ON_GOOGLE, title='Table', subtitle='',
+                                   image_uri='https://example.com/table.png', accessibility_text='', image_height=10,
+                                   image_width=10, column_properties=[], buttons=[],
+                                   rows=[TableCardRow(table_card_cells=[TableCardCell('cell %d' % i)])
+                                         for i in range(200)])
+
+        encoder = StdlibJsonEncoder()
+        chunks = list(dialog_flow.iter_json(encoder, chunk_size=512))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), encoder.encode(dialog_flow))
+        self.assertEqual(b''.join(iter_json([[], {}, 'text'], encoder, chunk_size=1)), b'[[],{},"text"]')
+
+        keys = {1: 'int', 2.5: 'float', False: 'bool', None: 'none', float('inf'): 'inf', 'text': 'str'}
+        self.assertEqual(b''.join(iter_json(keys, encoder, chunk_size=1)), encoder.encode(keys))
+        with self.assertRaises(TypeError):
+            b''.join(iter_json({(1, 2): 'tuple'}, encoder))
+
+    def test_response_budget(self):
+        self.assertEqual(truncate_text('hello world again', 12), 'hello world…')
+        self.assertEqual(split_text('One two. Three four.', 10), ['One two.', 'Three', 'four.'])
+
+        dialog_flow = DialogFlow({'queryResult': {'action': 'test'}})
+        dialog_flow.enable_budget(ResponseLimits(max_text_length=20, max_carousel_items=2))
+        dialog_flow.add_text_message(platform=PlatformEnum.ACTIONS_ON_GOOGLE, text_to_speech='a long answer ' * 5)
+        carousel_items = [CarouselItem(title='t%d' % i, description='d') for i in range(5)]
+        dialog_flow.add_carousel_select(platform=PlatformEnum.ACTIONS_ON_GOOGLE, carousel_items=carousel_items)
+
+        response = json.loads(dialog_flow.to_json_bytes(StdlibJsonEncoder()))
+        self.assertLessEqual(len(response['fulfillmentText']), 20)
+        self.assertEqual(len(response['fulfillmentMessages'][1]['carousel_select']['items']), 2)
+        self.assertIn(('ACTIONS_ON_GOOGLE.carousel_select', 'capped', 5),
+                      [tuple(change) for change in dialog_flow.budget_report.changes])
+
+        encoder = StdlibJsonEncoder()
+        carousel = dialog_flow.fulfillment_messages[-1]
+        carousel_size = len(encoder.encode(carousel))
+        full_size = len(dialog_flow.to_json_bytes(encoder))
+        budget = dialog_flow.enable_budget(ResponseLimits(max_response_bytes=full_size - 1))
+        self.assertEqual(budget.counts['carousel_select'], 1)
+        self.assertEqual(budget.estimated_size, sum(len(encoder.encode(message)) + 1
+                                                    for message in dialog_flow.fulfillment_messages))
+
+        class RecordingEncoder(StdlibJsonEncoder):
+            def __init__(self):
+                super().__init__()
+                self.encoded = []
+
+            def encode(self, obj):
+                self.encoded.append(type(obj).__name__)
+                return super().encode(obj)
+
+        # the dropped message is picked by its tracked size, only the whole response is encoded, before and after
+        recording_encoder = RecordingEncoder()
+        dialog_flow.to_json_bytes(recording_encoder)
+        self.assertEqual(recording_encoder.encoded, ['DialogFlow', 'DialogFlow'])
+        self.assertNotIn(carousel, dialog_flow.fulfillment_messages)
+        self.assertEqual(budget.counts['carousel_select'], 0)
+        self.assertIn(('ACTIONS_ON_GOOGLE.carousel_select', 'dropped', carousel_size),
+                      [tuple(change) for change in dialog_flow.budget_report.changes])
+
+        dialog_flow.add_carousel_select(platform=PlatformEnum.ACTIONS_ON_GOOGLE, carousel_items=carousel_items)
+        message_count = len(dialog_flow.fulfillment_messages)
+        dialog_flow.enable_budget(ResponseLimits(max_response_bytes=10))
+        with self.assertRaises(ResponseTooLarge):
+            dialog_flow.to_json_bytes()
+        # nothing is dropped when the response cannot fit anyway
+        self.assertEqual(len(dialog_flow.fulfillment_messages), message_count)
+
+    def test_webhook_app(self):
+        async def handler(dialog_flow):
+            dialog_flow.add_text_message(platform=PlatformEnum.ACTIONS_ON_GOOGLE, text_to_speech=dialog_flow.action)
+
+        client = AsgiTestClient(WebhookApp(handler, path='/webhook'), body_chunk_size=64)
+        response = client.post('/webhook', {'session': 'session', 'queryResult': {'action': 'input.welcome'}})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.json()['fulfillmentText'], 'welcome')
+        self.assertEqual(int(response.header('content-length')), len(response.body))
+
+        self.assertEqual(client.post('/other', {}).status, 404)
+        self.assertEqual(client.post('/webhook', []).status, 400)
+        self.assertEqual(client.post('/webhook', {'originalDetectIntentRequest': {'payload': {'user': {
+            'idToken': 'not a token'}}}}).status, 401)
+
+        async def unencodable(dialog_flow):
+            dialog_flow['fulfillmentText'] = 'streamed ' * 100
+            dialog_flow.add_context(context_name='broken', lifespan=1, value=object())
+
+        streaming = AsgiTestClient(WebhookApp(unencodable, chunk_size=64))
+        # the response already started, it is aborted instead of starting an error response
+        with self.assertRaises(RuntimeError):
+            streaming.post('/', {'queryResult': {'action': 'stream'}})
+
+        async def remember(dialog_flow):
+            dialog_flow.session_state['action'] = dialog_flow.action
+
+        store = set_session_store(MemorySessionStore())
+        try:
+            AsgiTestClient(WebhookApp(remember)).post('/', {'session': 'saved', 'queryResult': {'action': 'save'}})
+        finally:
+            set_session_store(None)
+        self.assertEqual(store.load('saved'), {'action': 'save'})
+
+    def test_router(self):
+        router = Router()
+        router.on_action('welcome')(lambda dialog_flow: 'welcome')
+        router.on_intent('Order')(lambda dialog_flow: 'order')
+        router.on_context('checkout', middlewares=[authorize()])(lambda dialog_flow: 'checkout')
+        router.fallback(lambda dialog_flow: 'fallback')
+
+        def route(query_result: dict, session: str = 'session'):
+            return asyncio.run(router(DialogFlow({'session': session, 'queryResult': query_result})))
+
+        self.assertEqual(route({'action': 'input.welcome'}), 'welcome')
+        self.assertEqual(route({'action': 'order.start', 'intent': {'displayName': 'Order'}}), 'order')
+        self.assertEqual(route({'action': 'unknown'}), 'fallback')
+        with self.assertRaises(PermissionError):
+            route({'action': 'pay', 'outputContexts': [{'name': 'session/contexts/checkout'}]})
+
+    def test_process_offload(self):
+        async def footer(dialog_flow, call_next):
+            result = await call_next(dialog_flow)
+            dialog_flow.add_text_message(platform=PlatformEnum.ACTIONS_ON_GOOGLE, text_to_speech='footer')
+            return result
+
+        router = Router()
+        router.on_action('ranked', middlewares=[cache_responses(), footer])(offloaded_handler)
+        runner = set_process_runner(ProcessPoolRunner(max_workers=1))
+        try:
+            dialog_flow = DialogFlow({'queryResult': {'action': 'rank', 'parameters': {'count': 3}}})
+            self.assertIs(runner.run_sync(offloaded_handler, dialog_flow), dialog_flow)
+            loaded_in = []
+
+            class RecordingStore(MemorySessionStore):
+                def load(self, session_id):
+                    loaded_in.append(threading.current_thread())
+                    return super().load(session_id)
+
+            set_session_store(RecordingStore())
+            awaited = asyncio.run(runner.run(offloaded_handler, DialogFlow({'session': 'session',
+                                                                            'queryResult': {'action': 'run'}})))
+            self.assertEqual(len(loaded_in), 1)
+            self.assertIsNot(loaded_in[0], threading.main_thread())
+
+            # claims of a request built synchronously are verified before the snapshot is sent
+            get_claims_cache().put('offloaded token', {'email': 'user@example.com', 'exp': time.time() + 3600})
+            greeted = DialogFlow({'queryResult': {'action': 'greet'}, 'originalDetectIntentRequest': {
+                'payload': {'user': {'idToken': 'offloaded token'}}}})
+            asyncio.run(runner.run(greeting_handler, greeted))
+            self.assertEqual(greeted.fulfillment_text, 'hello user@example.com')
+
+            routed = []
+            for _ in range(2):
+                routed.append(DialogFlow({'queryResult': {'action': 'ranked', 'parameters': {'count': 1}}}))
+                asyncio.run(router(routed[-1]))
+        finally:
+            set_session_store(None)
+            set_process_runner(None)
+            runner.shutdown()
+
+        self.assertEqual(json.loads(dialog_flow.to_json_bytes())['fulfillmentText'], 'rank 3')
+        self.assertEqual(awaited.fulfillment_text, 'run None')
+        self.assertTrue(awaited.fulfillment_messages.has_message_type(PlatformEnum.ACTIONS_ON_GOOGLE,
+                                                                      'simple_responses'))
+        for dialog_flow in routed:
+            messages = dialog_flow.fulfillment_messages.get_messages(PlatformEnum.ACTIONS_ON_GOOGLE, 'simple_responses')
+            self.assertEqual([message['simple_responses']['simpleResponses'][0]['textToSpeech']
+                              for message in messages], ['ranked 1', 'footer'])
+
+    def test_session_store(self):
+        memory_store = MemorySessionStore(max_entries=4, shards=2)
+        for number in range(10):
+            memory_store.save('session %d' % number, {'number': number})
+        self.assertLessEqual(len(memory_store), 4)
+        self.assertEqual(memory_store.load('session 9'), {'number': 9})
+
+        with tempfile.TemporaryDirectory() as directory:
+            sqlite_store = SqliteSessionStore(os.path.join(directory, 'sessions.db'))
+            set_session_store(sqlite_store)
+            try:
+                for turn in range(2):
+                    dialog_flow = DialogFlow({'session': 'session', 'queryResult': {'action': 'count'}})
+                    dialog_flow.session_state['turns'] = dialog_flow.session_state.get('turns', 0) + 1
+                    self.assertTrue(dialog_flow.save_session_state())
+                sqlite_store.close()
+                sqlite_store = SqliteSessionStore(os.path.join(directory, 'sessions.db'))
+                self.assertEqual(sqlite_store.load('session'), {'turns': 2})
+                sqlite_store.close()
+            finally:
+                set_session_store(None)
+
+            class FailingStore(SqliteSessionStore):
+                failures = [RuntimeError('write failed')]
+
+                def _write(self, pending):
+                    if self.failures:
+                        raise self.failures.pop()
+                    super()._write(pending)
+
+            # a failed write does not stop the writer, int keys are written as strings
+            with self.assertLogs('DialogFlowPy.SessionStore', 'ERROR'):
+                failing_store = FailingStore(os.path.join(directory, 'failing.db'), flush_interval=0.01)
+                failing_store.save('lost', {})
+                for _ in range(500):
+                    if not failing_store.failures:
+                        break
+                    time.sleep(0.01)
+            failing_store.save('written', {1: 'one'})
+            for _ in range(500):
+                if not failing_store._pending and not failing_store._flushing:
+                    break
+                time.sleep(0.01)
+            self.assertTrue(failing_store._writer.is_alive())
+            self.assertEqual(failing_store.load('written'), {'1': 'one'})
+            failing_store.close()
+            self.assertFalse(failing_store._connections)
+
+    def test_batch(self):
+        requests = io.BytesIO(b''.join(json.dumps({'queryResult': {'action': action}}).encode('utf-8') + b'\n\n'
+                                       for action in ('first', 'fail', 'third')))
+
+        def handler(dialog_flow):
+            assert dialog_flow.action != 'fail'
+            dialog_flow.add_text_message(platform=PlatformEnum.ACTIONS_ON_GOOGLE, text_to_speech=dialog_flow.action)
+
+        output = io.BytesIO()
+        stats = run_batch(handler, iter_lines(requests), output.write, workers=0, chunk_size=2)
+        responses = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual((stats.requests, stats.errors), (3, 1))
+        self.assertEqual([response.get('fulfillmentText') for response in responses], ['first', None, 'third'])
+        self.assertIn('error', responses[1])
+
+    def test_instrumentation(self):
+        with span('unrecorded') as unrecorded:
+            self.assertFalse(unrecorded)
+
+        spans = []
+        sink = add_span_sink(spans.append)
+        try:
+            with span('request') as request:
+                dialog_flow = DialogFlow({'queryResult': {'action': 'spans'}})
+                dialog_flow.add_text_message(platform=PlatformEnum.ACTIONS_ON_GOOGLE, text_to_speech='traced')
+                dialog_flow.to_json_bytes()
+        finally:
+            remove_span_sink(sink)
+
+        by_name = {ended.name: ended for ended in spans}
+        self.assertEqual(by_name['dialogflow.load_request'].attributes['action'], 'spans')
+        self.assertEqual(by_name['dialogflow.add_text_message'].attributes['platform'], PlatformEnum.ACTIONS_ON_GOOGLE)
+        self.assertEqual(by_name['dialogflow.encode'].attributes['message_count'], 1)
+        self.assertTrue(all(ended.trace_id == request.trace_id for ended in spans))
+        self.assertEqual(by_name['dialogflow.encode'].parent_id, request.span_id)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'spans.json')
+            exporter = OtlpJsonFileExporter(path)
+            for ended in spans:
+                exporter(ended)
+            exporter.close()
+            with open(path, 'r') as f:
+                exported = json.loads(f.readline())['resourceSpans'][0]['scopeSpans'][0]['spans']
+        self.assertEqual([otlp_span['name'] for otlp_span in exported], [ended.name for ended in spans])
+
+    def test_metrics(self):
+        with tempfile.TemporaryDirectory() as directory:
+            registry = MetricsRegistry(directory)
+            try:
+                requests = Counter('requests_total', 'requests', ('action',), registry=registry)
+                latency = Histogram('latency_seconds', 'latency', buckets=(0.1, 1), registry=registry)
+                requests.labels('welcome').inc()
+                requests.labels('welcome').inc(2)
+                for seconds in (0.05, 0.5, 5):
+                    latency.observe(seconds)
+                # what another worker process wrote
+                with open(os.path.join(directory, 'metrics_1.json'), 'w') as f:
+                    json.dump({'requests_total': [[['welcome'], [4]]], 'latency_seconds': [[[], [1, 0, 0, 0.01]]]}, f)
+
+                text = registry.exposition().decode('utf-8')
+            finally:
+                registry.close()
+            self.assertTrue(os.path.exists(os.path.join(directory, 'metrics_%d.json' % os.getpid())))
+        self.assertFalse(any(thread.name == 'MetricsRegistry writer' for thread in threading.enumerate()))
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('requests_total{action="welcome"} 7', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 3', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_count 4', text)
+
+        app = WebhookApp(lambda dialog_flow: None, metrics_path='/metrics')
+        client = AsgiTestClient(app)
+        try:
+            client.post('/', {'queryResult': {'action': 'measured'}})
+            response = asyncio.run(client.request('GET', '/metrics'))
+        finally:
+            uninstall_span_metrics()
+        self.assertEqual(response.status, 200)
+        self.assertIn(b'dialogflow_requests_total{action="measured",platform="unknown",status="200"}', response.body)
+        self.assertIn(b'dialogflow_stage_duration_seconds_count{stage="dialogflow.load_request"}', response.body)
+
+        # a streamed response is measured by its webhook.send span
+        spans = []
+        sink = add_span_sink(spans.append)
+        try:
+            client = AsgiTestClient(WebhookApp(lambda dialog_flow: dialog_flow.add_text_message(
+                platform=PlatformEnum.ACTIONS_ON_GOOGLE, text_to_speech='streamed')))
+            body = client.post('/', {'queryResult': {'action': 'streamed'}}).body
+        finally:
+            remove_span_sink(sink)
+        sends = [ended for ended in spans if ended.name == 'webhook.send']
+        self.assertEqual(sends[0].attributes['bytes'], len(body))
+
 
 if __name__ == '__main__':
     unittest.main()
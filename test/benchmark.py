@@ -0,0 +1,221 @@
+"""
+Micro-benchmarks of the response builders, standard library only.
+
+    python benchmark.py -o results.json
+    python benchmark.py -o new.json --baseline results.json --threshold 0.1
+
+Every benchmark is timed repeat times, each run calling it enough times to last at least --min-time seconds. The
+median time per call goes to the results file, with --baseline the run is compared against an earlier results file
+and the exit status is 1 when a benchmark got slower by more than threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from DialogFlowPy import ImageDisplayOptions, PlatformEnum, ResponseMediaType, UrlTypeHint
+from DialogFlowPy.BrowseCarouselCardItem import BrowseCarouselCardItem
+from DialogFlowPy.Button import Button
+from DialogFlowPy.DialogFlow import DialogFlow
+from DialogFlowPy.Image import Image
+from DialogFlowPy.JsonEncoder import OrjsonEncoder, StdlibJsonEncoder, get_json_encoder, orjson
+from DialogFlowPy.OpenUriAction import OpenUriAction
+from DialogFlowPy.OpenUrlAction import OpenUrlAction
+from DialogFlowPy.TableCardCell import TableCardCell
+from DialogFlowPy.TableCardRow import TableCardRow
+from GoogleActions.MediaObject import MediaObject
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'request_data.json')
+
+PLATFORM = PlatformEnum.ACTIONS_ON_GOOGLE
+IMAGE_URI = 'https://example.com/image.png'
+URI = 'https://example.com'
+
+# name -> (prepare(), operation(prepared)), only the operation is timed
+Benchmark = Tuple[Callable[[], Any], Callable[[Any], Any]]
+
+
+def load_fixture() -> dict:
+    with open(FIXTURE, 'r') as f:
+        return json.load(f)
+
+
+def add_text_message(dialog_flow: DialogFlow):
+    dialog_flow.add_text_message(platform=PLATFORM, text_to_speech='this is a test message')
+
+
+def add_card(dialog_flow: DialogFlow):
+    dialog_flow.add_card(platform=PLATFORM, title='card', subtitle='subtitle', image_uri=IMAGE_URI,
+                         formatted_text='formatted text', image_text='image text',
+                         buttons=[Button(title='button', open_uri_action=OpenUriAction(uri=URI))])
+
+
+def add_table_card(dialog_flow: DialogFlow):
+    dialog_flow.add_table_card(platform=PLATFORM, title='table', subtitle='subtitle', image_uri=IMAGE_URI,
+                               accessibility_text='table image', image_height=100, image_width=100,
+                               column_properties=[], buttons=[],
+                               rows=[TableCardRow(table_card_cells=[TableCardCell('row %d' % row), TableCardCell('x')])
+                                     for row in range(10)])
+
+
+def add_carousel_browse_card(dialog_flow: DialogFlow):
+    items = [BrowseCarouselCardItem(open_uri_action=OpenUrlAction(url=URI, url_type_hint=UrlTypeHint.AMP_ACTION),
+                                    title='item %d' % item, description='description', footer='footer',
+                                    image=Image(image_uri=IMAGE_URI, accessibility_text='image'))
+             for item in range(5)]
+    dialog_flow.add_carousel_browse_card(platform=PLATFORM, image_display_options=ImageDisplayOptions.WHITE,
+                                         browse_carousel_card_items=items)
+
+
+def add_media(dialog_flow: DialogFlow):
+    media_object = MediaObject(name='media', description='media object', content_url='https://example.com/audio.mp3',
+                               large_image=Image(image_uri=IMAGE_URI, accessibility_text='large image'),
+                               icon=Image(image_uri=IMAGE_URI, accessibility_text='icon'))
+    dialog_flow.add_media(platform=PLATFORM, media_type=ResponseMediaType.AUDIO, media_objects=[media_object])
+
+
+def add_quick_replies(dialog_flow: DialogFlow):
+    dialog_flow.add_quick_replies(platform=PLATFORM, title='quick replies',
+                                  quick_replies=['reply %d' % reply for reply in range(5)])
+
+
+HELPERS = (add_text_message, add_card, add_table_card, add_carousel_browse_card, add_media, add_quick_replies)
+
+
+def full_response(request_json: dict, create_payload_object: bool) -> DialogFlow:
+    dialog_flow = DialogFlow(request_json, create_payload_object=create_payload_object)
+    for helper in HELPERS:
+        try:
+            helper(dialog_flow)
+        except Exception:
+            # helpers failing with the payload object are reported by their own benchmark
+            pass
+    return dialog_flow
+
+
+def benchmarks() -> Dict[str, Benchmark]:
+    request_json = load_fixture()
+    suite: Dict[str, Benchmark] = {}
+
+    for create_payload_object in (False, True):
+        suffix = '[payload_object]' if create_payload_object else ''
+
+        suite['DialogFlow.__init__' + suffix] = (
+            lambda: request_json,
+            lambda request, create=create_payload_object: DialogFlow(request, create_payload_object=create))
+
+        for helper in HELPERS:
+            def prepare(create=create_payload_object, first=helper is add_text_message) -> DialogFlow:
+                dialog_flow = DialogFlow(request_json, create_payload_object=create)
+                if not first:
+                    # rich messages are only kept once the response has a simple response
+                    add_text_message(dialog_flow)
+                return dialog_flow
+            suite['DialogFlow.%s%s' % (helper.__name__, suffix)] = (prepare, helper)
+
+        encoders = [('json', StdlibJsonEncoder())] + ([('orjson', OrjsonEncoder())] if orjson is not None else [])
+        for name, encoder in encoders:
+            suite['DialogFlow.to_json_bytes[%s]%s' % (name, suffix)] = (
+                lambda create=create_payload_object: full_response(request_json, create),
+                lambda dialog_flow, encoder=encoder: dialog_flow.to_json_bytes(encoder))
+
+    return suite
+
+
+def measure(prepare: Callable[[], Any], operation: Callable[[Any], Any], repeat: int,
+            min_time: float) -> Dict[str, Any]:
+    """Times operation on freshly prepared inputs, the number of calls per run doubles until a run lasts min_time"""
+    number = 1
+    while True:
+        elapsed = _run(prepare, operation, number)
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+
+    timings = [elapsed] + [_run(prepare, operation, number) for _ in range(repeat - 1)]
+    per_call = [timing / number * 1e9 for timing in timings]
+    return {'ns_per_op': statistics.median(per_call), 'min_ns_per_op': min(per_call), 'number': number,
+            'repeat': repeat}
+
+
+def _run(prepare: Callable[[], Any], operation: Callable[[Any], Any], number: int) -> float:
+    inputs = [prepare() for _ in range(number)]
+    start = time.perf_counter()
+    for prepared in inputs:
+        operation(prepared)
+    return time.perf_counter() - start
+
+
+def run(names_filter: str = '', repeat: int = 5, min_time: float = 0.05) -> Dict[str, Any]:
+    results = {}
+    for name, (prepare, operation) in benchmarks().items():
+        if names_filter not in name:
+            continue
+        try:
+            results[name] = measure(prepare, operation, repeat, min_time)
+        except Exception as e:
+            results[name] = {'error': '%s: %s' % (type(e).__name__, e)}
+        print_result(name, results[name])
+
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'platform': platform.platform(), 'encoder': get_json_encoder().name, 'timestamp': time.time(),
+            'results': results}
+
+
+def print_result(name: str, result: Dict[str, Any]):
+    if 'error' in result:
+        print('%-55s %s' % (name, result['error']))
+    else:
+        print('%-55s %12.0f ns/op  (min %.0f, %d x %d)' % (name, result['ns_per_op'], result['min_ns_per_op'],
+                                                            result['number'], result['repeat']))
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Returns the names of the benchmarks more than threshold slower than in baseline"""
+    regressions = []
+    print('\n%-55s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'change'))
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None or 'error' in before or 'error' in result:
+            continue
+        change = result['ns_per_op'] / before['ns_per_op'] - 1
+        regressed = change > threshold
+        if regressed:
+            regressions.append(name)
+        print('%-55s %12.0f %12.0f %+7.1f%%%s' % (name, before['ns_per_op'], result['ns_per_op'], change * 100,
+                                                  '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the DialogFlowPy response builders')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='results file to write')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='slowdown counted as a regression, 0.10 is 10%% (default)')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--min-time', type=float, default=0.05, help='minimum seconds per timed run')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    arguments = parser.parse_args(argv)
+
+    current = run(arguments.filter, arguments.repeat, arguments.min_time)
+    with open(arguments.output, 'w') as f:
+        json.dump(current, f, indent=2, sort_keys=True)
+
+    if arguments.baseline:
+        with open(arguments.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, arguments.threshold)
+        if regressions:
+            print('\n%d regression(s) over %.0f%%: %s' % (len(regressions), arguments.threshold * 100,
+                                                          ', '.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())